@@ -80,7 +80,7 @@ class PositionAnalyzer:
         """Загрузка данных из БД с fallback на user_data"""
         try:
             # Пробуем получить из БД
-            self.closed_trades = self.db.get_closed_trades(self.user_id, limit=10000)
+            self.closed_trades = self.db.get_closed_trades(self.user_id, limit=10000, full=True)
             
             # Если в БД нет данных, пробуем получить из user_data (для обратной совместимости)
             if not self.closed_trades:
@@ -17,7 +17,7 @@ def analyze_trades(user_id: int = 8486449177):
     user_data = UserDataManager()
     
     # Получаем все закрытые сделки
-    closed_trades = db.get_closed_trades(user_id, limit=10000)
+    closed_trades = db.get_closed_trades(user_id, limit=10000, full=True)
     
     if not closed_trades:
         print("❌ Нет закрытых сделок для анализа")
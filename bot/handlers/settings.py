@@ -120,7 +120,7 @@ async def process_secret_key(message: Message, state: FSMContext):
         current_data = user_data.get_user_data(user_id)
         current_data['api_key'] = api_key
         current_data['secret_key'] = secret_key
-        user_data.save_user_data(user_id, current_data)
+        await user_data.save_user_data_async(user_id, current_data)
         
         await state.clear()
         
@@ -223,7 +223,7 @@ async def toggle_demo_mode(message: Message):
     
     if new_mode:
         # Включаем демо
-        user_data.update_user_setting(user_id, 'is_demo_mode', True)
+        await user_data.update_user_setting_async(user_id, 'is_demo_mode', True)
         await message.answer(
             "🧪 Демо-режим включен\n\n"
             "Бот будет торговать виртуально без риска для реальных средств.\n"
@@ -237,7 +237,7 @@ async def toggle_demo_mode(message: Message):
             )
             return
         
-        user_data.update_user_setting(user_id, 'is_demo_mode', False)
+        await user_data.update_user_setting_async(user_id, 'is_demo_mode', False)
         await message.answer(
             "⚠️ РЕАЛЬНЫЙ РЕЖИМ ВКЛЮЧЕН\n\n"
             "Внимание! Торговля реальными средствами.\n"
@@ -302,7 +302,7 @@ async def process_risk_percent(message: Message, state: FSMContext):
             return
         
         user_id = message.from_user.id
-        user_data.update_user_setting(user_id, 'risk_per_trade', risk)
+        await user_data.update_user_setting_async(user_id, 'risk_per_trade', risk)
         
         await state.clear()
         await message.answer(f"✅ Максимальный риск на позицию установлен: {risk}%")
@@ -333,7 +333,7 @@ async def process_tp_percent(message: Message, state: FSMContext):
             return
         
         user_id = message.from_user.id
-        user_data.update_user_setting(user_id, 'take_profit_percent', tp)
+        await user_data.update_user_setting_async(user_id, 'take_profit_percent', tp)
         
         await state.clear()
         await message.answer(f"✅ Take-Profit установлен: {tp}%")
@@ -364,7 +364,7 @@ async def process_sl_percent(message: Message, state: FSMContext):
             return
         
         user_id = message.from_user.id
-        user_data.update_user_setting(user_id, 'stop_loss_percent', sl)
+        await user_data.update_user_setting_async(user_id, 'stop_loss_percent', sl)
         
         await state.clear()
         await message.answer(f"✅ Stop-Loss установлен: {sl}%")
@@ -401,7 +401,7 @@ async def process_max_positions(message: Message, state: FSMContext):
             return
         
         user_id = message.from_user.id
-        user_data.update_user_setting(user_id, 'max_open_positions', max_pos)
+        await user_data.update_user_setting_async(user_id, 'max_open_positions', max_pos)
         
         await state.clear()
         await message.answer(f"✅ Максимальное количество позиций установлено: {max_pos}")
@@ -84,7 +84,7 @@ async def toggle_mode_from_main(message: Message):
     
     if new_mode:
         # Включаем демо
-        user_data.update_user_setting(user_id, 'is_demo_mode', True)
+        await user_data.update_user_setting_async(user_id, 'is_demo_mode', True)
         await message.answer(
             "🧪 Демо-режим включен\n\n"
             "Бот будет торговать виртуально без риска для реальных средств.\n"
@@ -98,7 +98,7 @@ async def toggle_mode_from_main(message: Message):
             )
             return
         
-        user_data.update_user_setting(user_id, 'is_demo_mode', False)
+        await user_data.update_user_setting_async(user_id, 'is_demo_mode', False)
         await message.answer(
             "⚠️ РЕАЛЬНЫЙ РЕЖИМ ВКЛЮЧЕН\n\n"
             "Внимание! Торговля реальными средствами.\n"
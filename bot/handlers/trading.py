@@ -1,3 +1,8 @@
+import asyncio
+import sqlite3
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable
 from aiogram import Router, F
 from aiogram.types import Message
 from aiogram.fsm.context import FSMContext
@@ -7,8 +12,9 @@ from bot.keyboards.trading_menu import (
 )
 from bot.keyboards.main_menu import get_main_menu
 from bot.states import TradingStates
+from config.settings import DEFAULT_PAIRS
 from data.user_data import UserDataManager
-from services.bingx_api import BingXAPI
+from services.bingx_api import BingXAPI, get_user_api
 from services.trading import TradingEngine
 from services.market_analysis import MarketAnalyzer
 from services.statistics import StatisticsManager
@@ -20,28 +26,81 @@ user_data = UserDataManager()
 auto_trading_manager = AutoTradingManager()  # Глобальный менеджер авто-торговли
 profiles = StrategyProfiles()
 
+# Кэш количества открытых демо-позиций для меню: user_id -> (monotonic timestamp, count)
+_open_count_cache: dict[int, tuple[float, int]] = {}
+_OPEN_COUNT_TTL = 3.0  # секунд
+
+# Подписи сигнала RSI и знак P&L для отчётов
+_RSI_SIGNAL_TEXT = {
+    'oversold': '→ перепроданность',
+    'overbought': '→ перекупленность',
+    'neutral': '→ нейтрально'
+}
+_PNL_SIGN = {1: "📈", -1: "📉", 0: "➖"}
+
+# Блокировки переключения авто-торговли по пользователям
+_toggle_locks: defaultdict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+# Срезы DEFAULT_PAIRS по лимиту профиля (scan_pairs_limit -> tuple), чтобы не резать на каждый скан
+_DEFAULT_PAIRS_BY_LIMIT: dict[int, tuple] = {}
+
+
+def _get_api(user_id: int, data: dict) -> BingXAPI:
+    """Клиент BingX пользователя (кэшируется и пересоздаётся только при смене ключей)"""
+    return get_user_api(user_id, data.get('api_key'), data.get('secret_key'))
+
+
+def _default_pairs_for_limit(limit: int) -> tuple:
+    """Вернуть DEFAULT_PAIRS, ограниченные лимитом профиля (с кэшем по лимиту)"""
+    pairs = _DEFAULT_PAIRS_BY_LIMIT.get(limit)
+    if pairs is None:
+        pairs = DEFAULT_PAIRS[:limit]
+        _DEFAULT_PAIRS_BY_LIMIT[limit] = pairs
+    return pairs
+
+
+def _invalidate_open_count(user_id: int):
+    """Сбросить кэш количества открытых позиций (после открытия/закрытия позиции)"""
+    _open_count_cache.pop(user_id, None)
+
+
+auto_trading_manager.on_positions_changed = _invalidate_open_count
+
+
+def _count_open_demo_trades(user_id: int) -> int:
+    """Синхронно посчитать открытые демо-сделки (чтение БД/JSON)"""
+    stats = StatisticsManager(None, user_id)
+    return len(stats.get_demo_trades(status='open'))
+
+
+async def _get_open_positions_count(user_id: int) -> int:
+    """Количество открытых демо-позиций с коротким TTL-кэшем, чтение вне event loop"""
+    cached = _open_count_cache.get(user_id)
+    now = time.monotonic()
+    if cached and now - cached[0] < _OPEN_COUNT_TTL:
+        return cached[1]
+    count = await asyncio.to_thread(_count_open_demo_trades, user_id)
+    _open_count_cache[user_id] = (now, count)
+    return count
+
 
-@router.message(F.text == "📊 Торговля")
 async def trading_menu(message: Message):
     """Улучшенное меню торговли с информацией о позициях"""
     user_id = message.from_user.id
     data = user_data.get_user_data(user_id)
     auto_enabled = data.get('auto_trading_enabled', False)
     
-    # Получаем количество открытых позиций
-    try:
-        from services.statistics import StatisticsManager
-        stats = StatisticsManager(None, user_id)
-        open_trades = stats.get_demo_trades(status='open') if data.get('is_demo_mode', True) else []
-        positions_count = len(open_trades)
-    except:
-        positions_count = 0
+    # Получаем количество открытых позиций (в реальном режиме не используется)
+    positions_count = 0
+    if data.get('is_demo_mode', True):
+        try:
+            positions_count = await _get_open_positions_count(user_id)
+        except (OSError, ValueError, sqlite3.Error):
+            positions_count = 0
     
     # Проверяем наличие API ключей (только для реального режима)
-    # Проверяем что ключи не только существуют, но и не пустые
-    api_key = data.get('api_key')
-    secret_key = data.get('secret_key')
-    has_api = bool(api_key and secret_key and api_key.strip() and secret_key.strip())
+    # Флаг считается в UserDataManager: ключи не только существуют, но и не пустые
+    has_api = data.get('has_valid_api', False)
     is_demo = data.get('is_demo_mode', True)
     
     menu_text = (
@@ -52,23 +111,29 @@ async def trading_menu(message: Message):
         f"Выберите действие:"
     )
     
+    # Показываем предупреждение только если в реальном режиме, нет API и авто-торговля выключена
+    # Не показываем предупреждение если ключи есть или если авто-торговля уже включена
+    show_warning = not is_demo and not has_api and not auto_enabled
+    
+    # Сначала меню, затем предупреждение: порядок сообщений гарантирован
     await message.answer(
         menu_text,
         reply_markup=get_trading_menu(auto_enabled, positions_count),
         parse_mode='HTML'
     )
-    
-    # Показываем предупреждение только если в реальном режиме, нет API и авто-торговля выключена
-    # Не показываем предупреждение если ключи есть или если авто-торговля уже включена
-    if not is_demo and not has_api and not auto_enabled:
-        await message.answer(
-            "⚠️ <b>Для авто-торговли в реальном режиме нужны API ключи</b>\n\n"
-            "Подключите API ключи BingX в настройках, чтобы включить авто-торговлю.",
-            parse_mode='HTML'
-        )
+    if show_warning:
+        await _send_api_warning(message)
+
+
+async def _send_api_warning(message: Message):
+    """Предупреждение об отсутствии API ключей"""
+    await message.answer(
+        "⚠️ <b>Для авто-торговли в реальном режиме нужны API ключи</b>\n\n"
+        "Подключите API ключи BingX в настройках, чтобы включить авто-торговлю.",
+        parse_mode='HTML'
+    )
 
 
-@router.message(F.text.in_(["🧠 Профиль", "🧠 Стратегия"]))
 async def choose_profile_menu(message: Message):
     """Выбор профиля стратегии (как в pycryptobot: конфиг-профили)"""
     plist = profiles.list_profiles()
@@ -79,56 +144,61 @@ async def choose_profile_menu(message: Message):
     await message.answer("🧠 Выберите профиль стратегии:", reply_markup=get_strategy_profiles_menu(titles))
 
 
-@router.message(F.text.contains("Скальп") | F.text.contains("Тренд") | F.text.contains("✅"))
+def _profile_title(text: str) -> str:
+    """Название профиля из текста кнопки (без отметки выбранного)"""
+    return text.replace("✅", "").strip()
+
+
+def _is_profile_button(message: Message) -> bool:
+    """Фильтр: текст сообщения точно совпадает с названием профиля"""
+    return bool(message.text) and _profile_title(message.text) in profiles.titles_index
+
+
+@router.message(_is_profile_button)
 async def set_profile(message: Message):
     """Установка профиля по названию"""
-    text = message.text.replace("✅", "").strip()
-    plist = profiles.list_profiles()
-    match = next((p for p in plist if p.title == text), None)
+    match = profiles.titles_index.get(_profile_title(message.text))
     if not match:
-        return  # не наш обработчик
+        return  # профили изменились между фильтром и обработчиком
     user_id = message.from_user.id
-    user_data.update_user_setting(user_id, "strategy_profile", match.key)
     # Также пробросим некоторые параметры профиля в user_data, чтобы авто-торговля читала их напрямую
-    user_data.update_user_setting(user_id, "max_drawdown_percent", match.max_drawdown_percent)
-    user_data.update_user_setting(user_id, "sl_cooldown_minutes", match.sl_cooldown_minutes)
-    user_data.update_user_setting(user_id, "atr_min_percent", match.atr_min_percent)
-    user_data.update_user_setting(user_id, "timeframe", match.timeframe)
-    user_data.update_user_setting(user_id, "htf_timeframe", match.htf_timeframe)
+    await user_data.update_user_settings_async(
+        user_id,
+        strategy_profile=match.key,
+        max_drawdown_percent=match.max_drawdown_percent,
+        sl_cooldown_minutes=match.sl_cooldown_minutes,
+        atr_min_percent=match.atr_min_percent,
+        timeframe=match.timeframe,
+        htf_timeframe=match.htf_timeframe,
+    )
 
     await message.answer(f"✅ Профиль установлен: {match.title}", reply_markup=get_trading_menu(user_data.get_user_data(user_id).get("auto_trading_enabled", False)))
 
 
-@router.message(F.text.in_(["🧪 Сканер", "🧪 Сканер рынка"]))
 async def scan_market(message: Message):
     """Сканер рынка: топ сигналов по списку пар"""
     user_id = message.from_user.id
     data = user_data.get_user_data(user_id)
-    if not data.get('api_key') or not data.get('secret_key'):
+    if not data.get('has_valid_api', False):
         await message.answer("❌ Сначала подключите API BingX в настройках")
         return
 
     await message.answer("⏳ Сканирую рынок (топ-сигналы)...")
 
-    api = BingXAPI(
-        api_key=data.get('api_key'),
-        secret_key=data.get('secret_key'),
-        sandbox=False
-    )
+    api = _get_api(user_id, data)
     engine = TradingEngine(api, is_demo=data.get("is_demo_mode", True))
 
     tf = data.get("timeframe", "5m")
     # берём ограничение из профиля (или дефолт)
     prof = profiles.get_or_default(data.get("strategy_profile"))
-    from config.settings import DEFAULT_PAIRS
     user_pairs = data.get("trading_pairs") or []
     if user_pairs:
         pairs = user_pairs[: prof.scan_pairs_limit]
     else:
         # Если у пользователя нет сохранённых пар, используем DEFAULT_PAIRS
-        pairs = DEFAULT_PAIRS[: prof.scan_pairs_limit]
+        pairs = _default_pairs_for_limit(prof.scan_pairs_limit)
     if not pairs:
-        pairs = DEFAULT_PAIRS[: prof.scan_pairs_limit] or ['BTC/USDT:USDT']
+        pairs = _default_pairs_for_limit(prof.scan_pairs_limit) or ('BTC/USDT:USDT',)
 
     top = await engine.scan_market(pairs=pairs, timeframe=tf, top_n=prof.scan_top_n)
     if not top:
@@ -148,43 +218,44 @@ async def scan_market(message: Message):
 async def toggle_auto_trading(message: Message):
     """Включить/выключить авто-торговлю"""
     user_id = message.from_user.id
-    data = user_data.get_user_data(user_id)
+    # Блокировка на пользователя: двойное нажатие не приводит к двойному старту/остановке
+    async with _toggle_locks[user_id]:
+        data = user_data.get_user_data(user_id)
     
-    current_status = data.get('auto_trading_enabled', False)
-    new_status = not current_status
+        current_status = data.get('auto_trading_enabled', False)
+        new_status = not current_status
     
-    # Проверяем API перед включением
-    if new_status:
-        if not data.get('api_key') or not data.get('secret_key'):
-            await message.answer(
-                "❌ Сначала подключите API BingX в настройках для авто-торговли"
-            )
-            return
+        # Проверяем API перед включением
+        if new_status:
+            if not data.get('has_valid_api', False):
+                await message.answer(
+                    "❌ Сначала подключите API BingX в настройках для авто-торговли"
+                )
+                return
     
-    # Обновляем статус
-    user_data.update_user_setting(user_id, 'auto_trading_enabled', new_status)
+        # Обновляем статус
+        await user_data.update_user_setting_async(user_id, 'auto_trading_enabled', new_status)
     
-    # Запускаем или останавливаем авто-торговлю
-    try:
-        if new_status:
-            started = await auto_trading_manager.start_auto_trading(user_id)
-            if started:
-                status_text = "включена и запущена"
+        # Запускаем или останавливаем авто-торговлю
+        try:
+            if new_status:
+                started = await auto_trading_manager.start_auto_trading(user_id)
+                if started:
+                    status_text = "включена и запущена"
+                else:
+                    status_text = "включена (уже была запущена)"
             else:
-                status_text = "включена (уже была запущена)"
-        else:
-            stopped = await auto_trading_manager.stop_auto_trading(user_id)
-            status_text = "выключена и остановлена"
-    except Exception as e:
-        status_text = f"{'включена' if new_status else 'выключена'} (ошибка запуска: {str(e)})"
+                stopped = await auto_trading_manager.stop_auto_trading(user_id)
+                status_text = "выключена и остановлена"
+        except Exception as e:
+            status_text = f"{'включена' if new_status else 'выключена'} (ошибка запуска: {str(e)})"
     
-    await message.answer(
-        f"🤖 Авто-торговля {status_text}",
-        reply_markup=get_trading_menu(new_status)
-    )
+        await message.answer(
+            f"🤖 Авто-торговля {status_text}",
+            reply_markup=get_trading_menu(new_status)
+        )
 
 
-@router.message(F.text.in_(["✋ Ручная торговля", "✋ Ручная"]))
 async def manual_trading_menu(message: Message):
     """Меню ручной торговли"""
     await message.answer(
@@ -210,7 +281,6 @@ async def select_pair(message: Message, state: FSMContext):
     )
 
 
-@router.message(F.text.in_(["📋 Мои позиции", "📋 Позиции"]))
 async def positions_menu(message: Message):
     """Меню позиций"""
     await message.answer(
@@ -219,14 +289,13 @@ async def positions_menu(message: Message):
     )
 
 
-@router.message(F.text.in_(["📈 Сигналы сейчас", "📈 Сигналы", "📈 Сигналы"]))
 async def show_signals(message: Message):
     """Показать текущие сигналы (из меню торговли или главного меню)"""
     user_id = message.from_user.id
     data = user_data.get_user_data(user_id)
     
     # Проверяем API
-    if not data.get('api_key') or not data.get('secret_key'):
+    if not data.get('has_valid_api', False):
         await message.answer(
             "❌ Сначала подключите API BingX в настройках",
             reply_markup=get_main_menu(
@@ -242,16 +311,11 @@ async def show_signals(message: Message):
         is_demo = data.get('is_demo_mode', True)
         # BingX не имеет testnet API, всегда используем реальный API
         # Демо-режим контролируется на уровне логики бота
-        api = BingXAPI(
-            api_key=data.get('api_key'),
-            secret_key=data.get('secret_key'),
-            sandbox=False
-        )
+        api = _get_api(user_id, data)
         
         trading_engine = TradingEngine(api, is_demo=is_demo)
         
         # Анализируем первую пару из списка
-        from config.settings import DEFAULT_PAIRS
         user_pairs = data.get('trading_pairs') or []
         pairs = user_pairs if user_pairs else DEFAULT_PAIRS
         symbol = pairs[0] if pairs else 'BTC/USDT:USDT'
@@ -277,7 +341,33 @@ async def show_signals(message: Message):
         await message.answer(f"❌ Ошибка анализа: {str(e)}")
 
 
-@router.message(F.text.in_(["📊 Список позиций", "📊 Список"]))
+POSITIONS_PER_MESSAGE = 10
+
+_POSITION_ROW = (
+    "{i}. {symbol} {side}\n"
+    "   Размер: {size}\n"
+    "   Вход: {entry:.2f}\n"
+    "   Текущая: {mark:.2f}\n"
+    "   {sign} P&L: {pnl:.2f} USDT ({pct:.2f}%)\n\n"
+).format
+
+
+def _format_position_row(i: int, pos: dict) -> str:
+    """Строка позиции для списка открытых позиций"""
+    pnl = pos.get('unrealizedPnl', 0)
+    return _POSITION_ROW(
+        i=i,
+        symbol=pos.get('symbol', 'N/A'),
+        side=pos.get('side', 'N/A').upper(),
+        size=abs(pos.get('contracts', 0)),
+        entry=pos.get('entryPrice', 0),
+        mark=pos.get('markPrice', 0),
+        sign=_PNL_SIGN[(pnl > 0) - (pnl < 0)],
+        pnl=pnl,
+        pct=pos.get('percentage', 0),
+    )
+
+
 async def list_positions(message: Message):
     """Показать список открытых позиций"""
     user_id = message.from_user.id
@@ -287,7 +377,7 @@ async def list_positions(message: Message):
     await message.answer("⏳ Загружаю позиции...")
     
     try:
-        if not is_demo and (not data.get('api_key') or not data.get('secret_key')):
+        if not is_demo and not data.get('has_valid_api', False):
             await message.answer("❌ Сначала подключите API BingX в настройках")
             return
         
@@ -295,11 +385,7 @@ async def list_positions(message: Message):
             await message.answer("📊 В демо-режиме позиции пока не реализованы")
             return
         
-        api = BingXAPI(
-            api_key=data.get('api_key'),
-            secret_key=data.get('secret_key'),
-            sandbox=False
-        )
+        api = _get_api(user_id, data)
         
         positions = await api.get_positions()
         
@@ -307,31 +393,18 @@ async def list_positions(message: Message):
             await message.answer("📊 Нет открытых позиций")
             return
         
-        positions_text = "📊 Открытые позиции:\n\n"
-        for i, pos in enumerate(positions, 1):
-            symbol = pos.get('symbol', 'N/A')
-            side = pos.get('side', 'N/A')
-            size = pos.get('contracts', 0)
-            entry = pos.get('entryPrice', 0)
-            mark = pos.get('markPrice', 0)
-            pnl = pos.get('unrealizedPnl', 0)
-            pnl_percent = pos.get('percentage', 0)
-            
-            pnl_sign = "📈" if pnl > 0 else "📉" if pnl < 0 else "➖"
-            
-            positions_text += f"{i}. {symbol} {side.upper()}\n"
-            positions_text += f"   Размер: {abs(size)}\n"
-            positions_text += f"   Вход: {entry:.2f}\n"
-            positions_text += f"   Текущая: {mark:.2f}\n"
-            positions_text += f"   {pnl_sign} P&L: {pnl:.2f} USDT ({pnl_percent:.2f}%)\n\n"
-        
-        await message.answer(positions_text)
+        # По POSITIONS_PER_MESSAGE позиций в сообщении: лимит Telegram 4096 символов
+        for start in range(0, len(positions), POSITIONS_PER_MESSAGE):
+            batch = positions[start:start + POSITIONS_PER_MESSAGE]
+            header = "📊 Открытые позиции:\n\n" if start == 0 else ""
+            await message.answer(header + "".join(
+                _format_position_row(i, pos) for i, pos in enumerate(batch, start + 1)
+            ))
         
     except Exception as e:
         await message.answer(f"❌ Ошибка получения позиций: {str(e)}")
 
 
-@router.message(F.text.in_(["❌ Закрыть все позиции", "❌ Закрыть все"]))
 async def close_all_positions(message: Message):
     """Закрыть все позиции"""
     user_id = message.from_user.id
@@ -342,18 +415,14 @@ async def close_all_positions(message: Message):
         await message.answer("✅ В демо-режиме все позиции закрыты (виртуально)")
         return
     
-    if not data.get('api_key') or not data.get('secret_key'):
+    if not data.get('has_valid_api', False):
         await message.answer("❌ Сначала подключите API BingX в настройках")
         return
     
     await message.answer("⏳ Закрываю все позиции...")
     
     try:
-        api = BingXAPI(
-            api_key=data.get('api_key'),
-            secret_key=data.get('secret_key'),
-            sandbox=False
-        )
+        api = _get_api(user_id, data)
         
         closed = await api.close_all_positions()
         
@@ -366,7 +435,6 @@ async def close_all_positions(message: Message):
         await message.answer(f"❌ Ошибка закрытия позиций: {str(e)}")
 
 
-@router.message(F.text.in_(["✅ Открыть по сигналу", "✅ Открыть"]))
 async def open_by_signal(message: Message):
     """Открыть позицию по сигналу"""
     await message.answer(
@@ -375,112 +443,147 @@ async def open_by_signal(message: Message):
     )
 
 
+# Кнопки меню с точным текстом -> обработчик (один поиск по dict вместо цепочки фильтров).
+# Обработчики по шаблону (авто-торговля, профили, выбор пары с FSM) регистрируются отдельно.
+BUTTON_HANDLERS: dict[str, Callable[[Message], Awaitable[None]]] = {
+    "📊 Торговля": trading_menu,
+    "🧠 Профиль": choose_profile_menu,
+    "🧠 Стратегия": choose_profile_menu,
+    "🧪 Сканер": scan_market,
+    "🧪 Сканер рынка": scan_market,
+    "✋ Ручная торговля": manual_trading_menu,
+    "✋ Ручная": manual_trading_menu,
+    "📋 Мои позиции": positions_menu,
+    "📋 Позиции": positions_menu,
+    "📈 Сигналы сейчас": show_signals,
+    "📈 Сигналы": show_signals,
+    "📊 Список позиций": list_positions,
+    "📊 Список": list_positions,
+    "❌ Закрыть все позиции": close_all_positions,
+    "❌ Закрыть все": close_all_positions,
+    "✅ Открыть по сигналу": open_by_signal,
+    "✅ Открыть": open_by_signal,
+}
+
+
+@router.message(F.text.in_(frozenset(BUTTON_HANDLERS)))
+async def dispatch_menu_button(message: Message):
+    """Единая точка входа для кнопок меню торговли"""
+    await BUTTON_HANDLERS[message.text](message)
+
+
 def format_analysis_report(analysis: dict, symbol: str) -> str:
     """Форматирует отчёт анализа с расширенными техниками"""
+    # Вложенные словари достаём один раз, дальше работаем с локальными переменными
     current_price = analysis.get('current_price', 0)
-    indicators = analysis.get('indicators', {})
-    candle_analysis = analysis.get('candle_analysis', {})
-    advanced_analysis = analysis.get('advanced_analysis', {})
+    indicators = analysis.get('indicators') or {}
+    candle_analysis = analysis.get('candle_analysis') or {}
+    advanced_analysis = analysis.get('advanced_analysis') or {}
     final_signal = analysis.get('final_signal', 'neutral')
     probability = analysis.get('probability', 0)
     recommendation = analysis.get('recommendation')
+    rsi = indicators.get('rsi') or {}
+    vwap = indicators.get('vwap') or {}
+    mfi = indicators.get('mfi') or {}
+    obv = indicators.get('obv') or {}
+    ichi = indicators.get('ichimoku') or {}
     
-    report = f"📊 Анализ {symbol}\n\n"
-    report += f"💰 Текущая цена: {current_price:.2f} USDT\n\n"
+    parts: list[str] = [f"📊 Анализ {symbol}\n\n"]
+    parts.append(f"💰 Текущая цена: {current_price:.2f} USDT\n\n")
     
     # RSI
-    rsi = indicators.get('rsi', {})
-    if rsi.get('value'):
-        rsi_signal = rsi.get('signal', 'neutral')
-        signal_text = {
-            'oversold': '→ перепроданность',
-            'overbought': '→ перекупленность',
-            'neutral': '→ нейтрально'
-        }.get(rsi_signal, '')
-        report += f"📈 RSI(14): {rsi['value']:.2f} {signal_text}\n"
+    rsi_value = rsi.get('value')
+    if rsi_value:
+        signal_text = _RSI_SIGNAL_TEXT.get(rsi.get('signal', 'neutral'), '')
+        parts.append(f"📈 RSI(14): {rsi_value:.2f} {signal_text}\n")
 
     # VWAP / MFI / OBV / Ichimoku (как в Crypto-Signal)
-    vwap = indicators.get("vwap")
-    if vwap and vwap.get("value"):
-        report += f"📏 VWAP: {vwap['value']:.2f} ({vwap.get('position', 'unknown')})\n"
+    vwap_value = vwap.get("value")
+    if vwap_value:
+        parts.append(f"📏 VWAP: {vwap_value:.2f} ({vwap.get('position', 'unknown')})\n")
 
-    mfi = indicators.get("mfi")
-    if mfi and mfi.get("value") is not None:
-        report += f"💧 MFI(14): {mfi['value']:.2f} ({mfi.get('signal', 'neutral')})\n"
+    mfi_value = mfi.get("value")
+    if mfi_value is not None:
+        parts.append(f"💧 MFI(14): {mfi_value:.2f} ({mfi.get('signal', 'neutral')})\n")
 
-    obv = indicators.get("obv")
-    if obv and obv.get("value") is not None:
-        report += f"🧱 OBV: {obv.get('trend', 'unknown')}\n"
+    if obv.get("value") is not None:
+        parts.append(f"🧱 OBV: {obv.get('trend', 'unknown')}\n")
 
-    ichi = indicators.get("ichimoku")
-    if ichi and ichi.get("position") and ichi.get("position") != "unknown":
-        report += f"☁️ Ichimoku: {ichi.get('position')}\n"
+    ichi_position = ichi.get("position")
+    if ichi_position and ichi_position != "unknown":
+        parts.append(f"☁️ Ichimoku: {ichi_position}\n")
     
     # Свечные паттерны
-    patterns = candle_analysis.get('patterns', [])
+    patterns = candle_analysis.get('patterns')
     if patterns:
-        report += f"🕯️ Паттерны: {', '.join(patterns[:3])}\n"  # Показываем только первые 3
+        parts.append(f"🕯️ Паттерны: {', '.join(patterns[:3])}\n")  # Показываем только первые 3
     
     # Расширенный анализ
     if advanced_analysis:
+        order_flow = advanced_analysis.get('order_flow') or {}
+        pools = advanced_analysis.get('liquidity_pools') or {}
+        structure = advanced_analysis.get('structure') or {}
+        
         # Order Flow
-        order_flow = advanced_analysis.get('order_flow', {})
-        if order_flow.get('direction') != 'neutral':
-            of_direction = order_flow.get('direction', 'neutral')
-            of_strength = order_flow.get('strength', 1)
-            report += f"🔄 Order Flow: {of_direction.upper()} (сила: {of_strength})\n"
+        of_direction = order_flow.get('direction')
+        if of_direction != 'neutral':
+            of_direction = of_direction or 'neutral'
+            parts.append(f"🔄 Order Flow: {of_direction.upper()} (сила: {order_flow.get('strength', 1)})\n")
         
         # IMB зоны
-        imbalances = advanced_analysis.get('imbalances', [])
+        imbalances = advanced_analysis.get('imbalances')
         if imbalances:
             latest_imb = imbalances[-1]
-            report += f"⚖️ IMB: {latest_imb.get('type', 'unknown')} ({latest_imb.get('direction', '')})\n"
+            parts.append(f"⚖️ IMB: {latest_imb.get('type', 'unknown')} ({latest_imb.get('direction', '')})\n")
         
         # FVG
-        fvgs = advanced_analysis.get('fvgs', [])
+        fvgs = advanced_analysis.get('fvgs')
         if fvgs:
             latest_fvg = fvgs[-1]
-            report += f"📊 FVG: {latest_fvg.get('type', 'unknown')} на {latest_fvg.get('mid_point', 0):.2f}\n"
+            parts.append(f"📊 FVG: {latest_fvg.get('type', 'unknown')} на {latest_fvg.get('mid_point', 0):.2f}\n")
         
         # Свипы ликвидности
-        sweeps = advanced_analysis.get('liquidity_sweeps', [])
+        sweeps = advanced_analysis.get('liquidity_sweeps')
         if sweeps:
-            latest_sweep = sweeps[-1]
-            report += f"💧 Свип: {latest_sweep.get('type', 'unknown')}\n"
+            parts.append(f"💧 Свип: {sweeps[-1].get('type', 'unknown')}\n")
         
         # Пулы ликвидности
-        pools = advanced_analysis.get('liquidity_pools', {})
-        if pools.get('poc'):
-            poc = pools.get('poc', 0)
-            position = pools.get('analysis', {}).get('position', 'unknown')
-            report += f"🏊 POC: {poc:.2f} (позиция: {position})\n"
+        poc = pools.get('poc')
+        if poc:
+            position = (pools.get('analysis') or {}).get('position', 'unknown')
+            parts.append(f"🏊 POC: {poc:.2f} (позиция: {position})\n")
         
         # BOS/CHOCH
-        structure = advanced_analysis.get('structure', {})
-        if structure.get('bos'):
-            report += f"📈 BOS: {structure['bos'].get('type', 'unknown')}\n"
-        if structure.get('choch'):
-            report += f"🔄 CHOCH: {structure['choch'].get('type', 'unknown')}\n"
+        bos = structure.get('bos')
+        if bos:
+            parts.append(f"📈 BOS: {bos.get('type', 'unknown')}\n")
+        choch = structure.get('choch')
+        if choch:
+            parts.append(f"🔄 CHOCH: {choch.get('type', 'unknown')}\n")
     
     # Стакан
     orderbook_analysis = analysis.get('orderbook_analysis')
     if orderbook_analysis:
         summary = orderbook_analysis.get('summary', '')
         if summary:
-            report += f"📚 Стакан: {summary}\n"
+            parts.append(f"📚 Стакан: {summary}\n")
     
-    report += f"\n🎯 Общий сигнал: {final_signal.upper()} (вероятность ~{probability}%)\n"
+    parts.append(f"\n🎯 Общий сигнал: {final_signal.upper()} (вероятность ~{probability}%)\n")
     
     if recommendation:
-        report += f"\n💡 Рекомендация:\n"
-        report += f"Направление: {recommendation.get('direction', 'N/A')}\n"
-        if recommendation.get('entry'):
-            report += f"Вход: {recommendation['entry']:.2f}\n"
-        if recommendation.get('stop_loss'):
-            report += f"Стоп-лосс: {recommendation['stop_loss']:.2f}\n"
-        if recommendation.get('take_profit'):
-            report += f"Тейк-профит: {recommendation['take_profit']:.2f}\n"
-        if recommendation.get('reason'):
-            report += f"Причина: {recommendation['reason']}\n"
+        entry = recommendation.get('entry')
+        stop_loss = recommendation.get('stop_loss')
+        take_profit = recommendation.get('take_profit')
+        reason = recommendation.get('reason')
+        parts.append("\n💡 Рекомендация:\n")
+        parts.append(f"Направление: {recommendation.get('direction', 'N/A')}\n")
+        if entry:
+            parts.append(f"Вход: {entry:.2f}\n")
+        if stop_loss:
+            parts.append(f"Стоп-лосс: {stop_loss:.2f}\n")
+        if take_profit:
+            parts.append(f"Тейк-профит: {take_profit:.2f}\n")
+        if reason:
+            parts.append(f"Причина: {reason}\n")
     
-    return report
+    return "".join(parts)
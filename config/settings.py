@@ -21,6 +21,12 @@ BINGX_PROXY = BINGX_PROXY_LIST[0] if BINGX_PROXY_LIST else None
 # Опционально: отключить проверку SSL сертификатов (небезопасно, только для тестирования)
 BINGX_SSL_VERIFY = os.getenv("BINGX_SSL_VERIFY", "true").lower() == "true"
 
+# Сколько пар сканер анализирует одновременно (ограничение нагрузки на API BingX)
+SCAN_MAX_CONCURRENCY = 8
+
+# Сколько пар авто-торговля анализирует одновременно для одного пользователя
+AUTO_TRADING_MAX_CONCURRENCY = 5
+
 # Настройки по умолчанию
 DEFAULT_RISK_PER_TRADE = 1.5  # % от баланса на одну позицию
 DEFAULT_TAKE_PROFIT = 3.0  # % прибыли
@@ -29,15 +35,16 @@ DEFAULT_LEVERAGE = 5  # Плечо
 MAX_OPEN_POSITIONS = 5  # Максимум открытых позиций
 
 # Торговые пары для скальпинга - только выбранные пользователем
-DEFAULT_PAIRS = [
+# Кортеж: защищает от случайной мутации, срезы тоже дают кортеж (без копии списка)
+DEFAULT_PAIRS = (
     "ZEC/USDT:USDT",   # Zcash - высокая волатильность
-    "WIF/USDT:USDT"    # dogwifhat - мемкоин с высокой активностью
-]
+    "WIF/USDT:USDT",   # dogwifhat - мемкоин с высокой активностью
+)
 
 # Отдельный список пар, которые считаются ПРОБЛЕМНЫМИ для скальпинга по результатам анализа.
 # Эти пары принудительно исключаются из авто-торговли (но могут использоваться вручную при желании).
 # ПРИМЕЧАНИЕ: ZEC/USDT:USDT и WIF/USDT:USDT теперь в DEFAULT_PAIRS, поэтому не блокируются
-SCALPING_BLOCKED_PAIRS = {
+SCALPING_BLOCKED_PAIRS = frozenset({
     "DOGE/USDT:USDT",
     "ETH/USDT:USDT",
     "SUI/USDT:USDT",
@@ -46,16 +53,16 @@ SCALPING_BLOCKED_PAIRS = {
     "LTC/USDT:USDT",
     "SKR/USDT:USDT",   # Сильный отрицательный PnL по внутреннему тикеру
     # ZEC/USDT:USDT удалён из блокировки, так как теперь в DEFAULT_PAIRS
-}
+})
 
 # Ограничения по времени для скальпинга (по результатам анализа)
 # ВРЕМЯ УКАЗАНО В UTC!
 # Проблемные часы: 06:00 (WR 0%, сильный минус), 11:00 (WR 0%, отрицательный PnL)
-SCALPING_BLOCKED_HOURS = {6, 11}
+SCALPING_BLOCKED_HOURS = frozenset({6, 11})
 
 # Дополнительно: ограничиваем торговлю по дням недели (0 = Понедельник, 6 = Воскресенье)
 # Понедельник показал очень слабые результаты по WinRate и PnL.
-SCALPING_BLOCKED_WEEKDAYS = {0}
+SCALPING_BLOCKED_WEEKDAYS = frozenset({0})
 
 # Таймфреймы
 TIMEFRAMES = {
@@ -4,24 +4,334 @@
 """
 import sqlite3
 import json
+import logging
 import os
-from typing import Dict, List, Optional, Any, Tuple
+import queue
+import threading
+import time
+from typing import Dict, Iterable, Iterator, List, Optional, Any, Tuple, Union
 from datetime import datetime
 from pathlib import Path
 from contextlib import contextmanager
 from cryptography.fernet import Fernet
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
 import base64
+import functools
 from hashlib import sha256
 
+logger = logging.getLogger(__name__)
+
 # Допустимые колонки таблицы trades (для валидации в update_trade)
 _TRADES_COLUMNS = frozenset({
     'symbol', 'direction', 'amount', 'entry_price', 'stop_loss', 'take_profit',
     'leverage', 'status', 'pnl', 'close_price', 'close_reason', 'close_time',
-    'entry_time', 'position_value', 'risk_amount', 'potential_profit',
+    'entry_time', 'entry_time_ts', 'close_time_ts', 'position_value', 'risk_amount', 'potential_profit',
     'risk_reward_ratio', 'probability', 'quality_score', 'signal_strength',
     'scale_factor', 'order_id', 'is_demo',
 })
 
+# Белый список колонок для update_trade: имя колонки -> готовый фрагмент SET
+_TRADE_SET_CLAUSES: Dict[str, str] = {column: f"{column} = ?" for column in _TRADES_COLUMNS}
+
+# Готовые UPDATE для update_trade по набору полей (в порядке ключей словаря)
+_UPDATE_TRADE_SQL_CACHE: Dict[Tuple[str, ...], str] = {}
+
+
+# Файл с отпечатком ключа шифрования (в каталоге данных); сам ключ на диск не пишется
+ENCRYPTION_KEY_FINGERPRINT_FILENAME = ".encryption_key.sha256"
+# Секрет по умолчанию (только для разработки)
+_DEFAULT_ENCRYPTION_SECRET = "default_secret_key_change_in_production"
+
+
+def _key_fingerprint(key: bytes) -> str:
+    """Отпечаток ключа: по нему видно смену ключа, но ключ не восстановить"""
+    return sha256(b"fingerprint:" + key).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def load_encryption_key(data_dir: Path) -> bytes:
+    """
+    Ключ шифрования в base64 (формат Fernet), выведенный из ENCRYPTION_KEY (sha256)
+    
+    В data_dir хранится только отпечаток ключа, которым зашифрованы данные. Если
+    ENCRYPTION_KEY изменился или пропал, запуск прерывается с ошибкой — иначе
+    сохранённые API ключи молча перестали бы расшифровываться. Отпечаток пишется
+    и для секрета по умолчанию: иначе последующая установка ENCRYPTION_KEY
+    прошла бы незамеченной (сам секрет по умолчанию и так публичен).
+    """
+    secret = os.getenv("ENCRYPTION_KEY")
+    if not secret:
+        logger.warning("⚠️ ENCRYPTION_KEY не задан — используется небезопасный ключ по умолчанию")
+        secret = _DEFAULT_ENCRYPTION_SECRET
+    key = base64.urlsafe_b64encode(sha256(secret.encode()).digest())
+    fingerprint = _key_fingerprint(key)
+    
+    fingerprint_file = data_dir / ENCRYPTION_KEY_FINGERPRINT_FILENAME
+    if fingerprint_file.exists():
+        stored = fingerprint_file.read_text().strip()
+        if stored != fingerprint:
+            raise RuntimeError(
+                f"ENCRYPTION_KEY не совпадает с ключом, которым зашифрованы данные в {data_dir}. "
+                f"Верните прежнее значение ENCRYPTION_KEY (для смены ключа данные нужно "
+                f"перешифровать, после чего удалить {fingerprint_file})"
+            )
+    else:
+        data_dir.mkdir(parents=True, exist_ok=True)
+        fingerprint_file.write_text(fingerprint)
+        os.chmod(fingerprint_file, 0o600)
+    return key
+
+
+class DbRow(sqlite3.Row):
+    """
+    Строка результата без копирования в dict.
+    
+    Доступ как у sqlite3.Row (row['symbol'], row[3]) плюс dict-подобный .get(),
+    чтобы существующий код вида trade.get('pnl', 0) работал без изменений.
+    """
+    __slots__ = ()
+    
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except (IndexError, KeyError):
+            return default
+
+
+def row_to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+    """Преобразовать строку в dict (для кода, которому нужна изменяемая копия)"""
+    return dict(row)
+
+
+# Граница, раньше которой даты приводятся к 0 (сутки запаса на часовой пояс)
+_EPOCH_FLOOR = datetime(1970, 1, 2)
+
+
+def _epoch_seconds(dt: datetime) -> int:
+    """
+    Unix-время для колонок *_ts.
+
+    Даты до эпохи (например, datetime.min для периода 'all') дают 0 —
+    datetime.timestamp() на них падает с ValueError.
+    """
+    if dt.tzinfo is None and dt <= _EPOCH_FLOOR:
+        return 0
+    return max(0, int(dt.timestamp()))
+
+# Время жизни кэша get_user (секунды)
+USER_CACHE_TTL = 5.0
+
+# Число соединений только для чтения в пуле
+READER_POOL_SIZE = 4
+
+# Отложенная запись уведомлений: размер пачки и максимальная задержка (секунды)
+NOTIFICATION_BATCH_SIZE = 100
+NOTIFICATION_FLUSH_INTERVAL = 1.0
+
+# Длина случайного nonce AES-GCM (хранится перед шифротекстом)
+_NONCE_SIZE = 12
+
+# Максимум запомненных расшифровок (по два ключа на пользователя)
+_DECRYPT_CACHE_MAXSIZE = 4096
+
+# Настройки соединения: WAL позволяет читать параллельно с записью,
+# остальное — кэш страниц и временные таблицы в памяти
+_CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-64000",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA busy_timeout=30000",
+)
+
+# Колонки для списков сделок (то, что читают статистика и демо-позиции)
+_TRADE_LIST_COLUMNS = (
+    "trade_id, symbol, direction, amount, entry_price, stop_loss, take_profit, "
+    "leverage, status, pnl, close_price, close_reason, close_time, entry_time, is_demo, "
+    "entry_time_ts, close_time_ts"
+)
+_NOTIFICATION_COLUMNS = "notification_id, trade_id, notification_type, message_text, sent_at, is_sent"
+
+# SQL-запросы вынесены в константы: одна и та же строка на каждый вызов,
+# поэтому кэш подготовленных выражений sqlite3 на долгоживущем соединении срабатывает
+_SELECT_USER_SQL = "SELECT * FROM users WHERE user_id = ?"
+
+_SELECT_ALL_USERS_SQL = "SELECT * FROM users"
+
+_CLOSE_TRADE_SQL = """
+    UPDATE trades SET
+        status = 'closed',
+        close_price = ?,
+        close_reason = ?,
+        close_time = CURRENT_TIMESTAMP,
+        close_time_ts = CAST(strftime('%s', 'now') AS INTEGER),
+        pnl = ?
+    WHERE trade_id = ?
+"""
+
+_SELECT_OPEN_TRADES_BY_SYMBOL_SQL = f"""
+    SELECT {_TRADE_LIST_COLUMNS} FROM trades
+    WHERE user_id = ? AND status = 'open' AND symbol = ?
+    ORDER BY entry_time_ts DESC
+"""
+
+_SELECT_OPEN_TRADES_SQL = f"""
+    SELECT {_TRADE_LIST_COLUMNS} FROM trades
+    WHERE user_id = ? AND status = 'open'
+    ORDER BY entry_time_ts DESC
+"""
+
+# Списки сделок с keyset-пагинацией: курсор (entry_time_ts, trade_id) последней строки страницы
+_SELECT_TRADES_BY_STATUS_SQL = f"""
+    SELECT {_TRADE_LIST_COLUMNS} FROM trades
+    WHERE user_id = ? AND status = ?
+    ORDER BY entry_time_ts DESC, trade_id DESC
+    LIMIT ?
+"""
+
+_SELECT_TRADES_BY_STATUS_PAGE_SQL = f"""
+    SELECT {_TRADE_LIST_COLUMNS} FROM trades
+    WHERE user_id = ? AND status = ? AND (entry_time_ts, trade_id) < (?, ?)
+    ORDER BY entry_time_ts DESC, trade_id DESC
+    LIMIT ?
+"""
+
+_SELECT_ALL_TRADES_SQL = f"""
+    SELECT {_TRADE_LIST_COLUMNS} FROM trades
+    WHERE user_id = ?
+    ORDER BY entry_time_ts DESC, trade_id DESC
+    LIMIT ?
+"""
+
+_SELECT_ALL_TRADES_PAGE_SQL = f"""
+    SELECT {_TRADE_LIST_COLUMNS} FROM trades
+    WHERE user_id = ? AND (entry_time_ts, trade_id) < (?, ?)
+    ORDER BY entry_time_ts DESC, trade_id DESC
+    LIMIT ?
+"""
+
+_SELECT_TRADE_BY_ID_SQL = "SELECT * FROM trades WHERE trade_id = ?"
+
+# Закрытые сделки без pnl (например, закрытые через update_trade без результата)
+# в статистику не входят — ни в агрегаты, ни в ряд для просадки
+_TRADE_AGGREGATES_SQL = """
+    SELECT
+        COUNT(*) AS total_trades,
+        SUM(CASE WHEN pnl > 0 THEN 1 ELSE 0 END) AS winning_trades,
+        SUM(CASE WHEN pnl < 0 THEN 1 ELSE 0 END) AS losing_trades,
+        SUM(CASE WHEN pnl > 0 THEN pnl END) AS total_profit,
+        SUM(CASE WHEN pnl < 0 THEN pnl END) AS total_loss,
+        SUM(pnl) AS sum_pnl,
+        SUM(pnl * pnl) AS sum_pnl_sq,
+        MAX(pnl) AS best_trade,
+        MIN(pnl) AS worst_trade
+    FROM trades
+    WHERE user_id = ? AND status = 'closed' AND pnl IS NOT NULL
+      AND close_time_ts BETWEEN ? AND ?
+"""
+
+_TRADE_PNL_SERIES_SQL = """
+    SELECT pnl FROM trades
+    WHERE user_id = ? AND status = 'closed' AND pnl IS NOT NULL
+      AND close_time_ts BETWEEN ? AND ?
+    ORDER BY close_time_ts, trade_id
+"""
+
+_INSERT_TRADE_STATISTICS_SQL = """
+    INSERT INTO trade_statistics (
+        user_id, period_start, period_end, period_type,
+        total_trades, winning_trades, losing_trades,
+        total_profit, total_loss, net_profit, win_rate,
+        profit_factor, max_drawdown, sharpe_ratio, sortino_ratio,
+        avg_win, avg_loss, max_losing_streak, max_winning_streak,
+        recovery_factor, var_95, cvar_95
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+_SAVE_PAIR_STATISTICS_SQL = """
+    INSERT INTO pair_statistics (
+        user_id, symbol, period_start, period_end,
+        total_trades, winning_trades, losing_trades,
+        total_pnl, win_rate, profit_factor, avg_pnl,
+        best_trade, worst_trade
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(user_id, symbol, period_start) DO UPDATE SET
+        period_end = excluded.period_end,
+        total_trades = excluded.total_trades,
+        winning_trades = excluded.winning_trades,
+        losing_trades = excluded.losing_trades,
+        total_pnl = excluded.total_pnl,
+        win_rate = excluded.win_rate,
+        profit_factor = excluded.profit_factor,
+        avg_pnl = excluded.avg_pnl,
+        best_trade = excluded.best_trade,
+        worst_trade = excluded.worst_trade
+"""
+
+_SELECT_NOTIFICATIONS_BY_TYPE_SQL = f"""
+    SELECT {_NOTIFICATION_COLUMNS} FROM notifications
+    WHERE user_id = ? AND notification_type = ?
+    ORDER BY sent_at DESC
+    LIMIT ?
+"""
+
+_SELECT_NOTIFICATIONS_SQL = f"""
+    SELECT {_NOTIFICATION_COLUMNS} FROM notifications
+    WHERE user_id = ?
+    ORDER BY sent_at DESC
+    LIMIT ?
+"""
+
+_UPSERT_USER_SQL = """
+    INSERT INTO users (
+        user_id, api_key_encrypted, secret_key_encrypted,
+        is_demo_mode, risk_per_trade, take_profit_percent,
+        stop_loss_percent, leverage, max_open_positions,
+        trading_pairs, auto_trading_enabled, notifications_enabled,
+        demo_balance, max_drawdown_percent, strategy_profile,
+        sl_cooldown_minutes, atr_min_percent, timeframe, htf_timeframe
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET
+        api_key_encrypted = COALESCE(excluded.api_key_encrypted, users.api_key_encrypted),
+        secret_key_encrypted = COALESCE(excluded.secret_key_encrypted, users.secret_key_encrypted),
+        is_demo_mode = excluded.is_demo_mode,
+        risk_per_trade = excluded.risk_per_trade,
+        take_profit_percent = excluded.take_profit_percent,
+        stop_loss_percent = excluded.stop_loss_percent,
+        leverage = excluded.leverage,
+        max_open_positions = excluded.max_open_positions,
+        trading_pairs = COALESCE(excluded.trading_pairs, users.trading_pairs),
+        auto_trading_enabled = excluded.auto_trading_enabled,
+        notifications_enabled = excluded.notifications_enabled,
+        demo_balance = excluded.demo_balance,
+        max_drawdown_percent = excluded.max_drawdown_percent,
+        strategy_profile = excluded.strategy_profile,
+        sl_cooldown_minutes = excluded.sl_cooldown_minutes,
+        atr_min_percent = excluded.atr_min_percent,
+        timeframe = excluded.timeframe,
+        htf_timeframe = excluded.htf_timeframe,
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+_INSERT_TRADE_SQL = """
+    INSERT INTO trades (
+        user_id, symbol, direction, amount, entry_price,
+        stop_loss, take_profit, leverage, status, pnl,
+        close_price, close_reason, close_time, close_time_ts,
+        position_value, risk_amount, potential_profit,
+        risk_reward_ratio, probability, quality_score,
+        signal_strength, scale_factor, order_id, is_demo, entry_time_ts
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?,
+              CAST(strftime('%s', 'now') AS INTEGER))
+"""
+
+_INSERT_NOTIFICATION_SQL = """
+    INSERT INTO notifications (
+        user_id, trade_id, notification_type, message_text
+    ) VALUES (?, ?, ?, ?)
+"""
+
 
 class Database:
     """Профессиональный менеджер базы данных с поддержкой транзакций"""
@@ -30,44 +340,155 @@ class Database:
         self.db_path = Path(db_path)
         self.db_path.parent.mkdir(exist_ok=True)
         
-        # Генерируем ключ шифрования
-        secret = os.getenv("ENCRYPTION_KEY", "default_secret_key_change_in_production")
-        key = sha256(secret.encode()).digest()
-        self.cipher = Fernet(base64.urlsafe_b64encode(key))
+        # Ключ шифрования (см. load_encryption_key)
+        fernet_key = load_encryption_key(self.db_path.parent)
+        key = base64.urlsafe_b64decode(fernet_key)
+        # AES-GCM: nonce + шифротекст хранятся как BLOB (без base64 и отдельного HMAC)
+        self._aead = AESGCM(key)
+        # Fernet — только для чтения старых записей (TEXT), перешифровываются при инициализации
+        self.cipher = Fernet(fernet_key)
+        # Связанные методы шифра — без поиска атрибутов на каждом вызове
+        self._aead_encrypt = self._aead.encrypt
+        self._aead_decrypt = self._aead.decrypt
+        self._cipher_decrypt = self.cipher.decrypt
+        
+        # Расшифрованные ключи: шифротекст -> открытый текст
+        self._decrypted: Dict[Union[bytes, str], str] = {}
+        
+        # Кэш get_user: user_id -> (monotonic timestamp, данные); epoch растёт при каждой записи
+        self._user_cache: Dict[int, Tuple[float, Dict[str, Any]]] = {}
+        self._user_cache_epoch = 0
+        self._user_cache_lock = threading.Lock()
+        
+        # Один писатель (под блокировкой) и пул читателей: в режиме WAL чтения
+        # идут параллельно с записью и не ждут друг друга
+        self._writer_conn: Optional[sqlite3.Connection] = None
+        self._writer_lock = threading.RLock()
+        self._savepoint_depth = 0
+        self._reader_pool: "queue.Queue[sqlite3.Connection]" = queue.Queue()
+        self._reader_count = 0
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        
+        # Очередь уведомлений для фоновой записи пачками (поток стартует при первом уведомлении)
+        self._notif_q: "queue.Queue[tuple]" = queue.Queue()
+        self._notif_thread: Optional[threading.Thread] = None
+        self._notif_thread_lock = threading.Lock()
         
         # Инициализируем БД (индексы создаются внутри _init_database)
         self._init_database()
     
+    def _open_connection(self, read_only: bool = False) -> sqlite3.Connection:
+        """Открыть соединение с настройками PRAGMA и зарегистрировать его для close()"""
+        if read_only:
+            conn = sqlite3.connect(
+                f"{self.db_path.resolve().as_uri()}?mode=ro",
+                uri=True,
+                timeout=30.0,
+                check_same_thread=False
+            )
+        else:
+            # Автокоммит: транзакции открываются явно (см. transaction())
+            conn = sqlite3.connect(
+                str(self.db_path),
+                timeout=30.0,
+                check_same_thread=False,
+                isolation_level=None
+            )
+        conn.row_factory = DbRow  # Доступ к колонкам по имени и .get()
+        for pragma in _CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        with self._connections_lock:
+            self._connections.append(conn)
+        return conn
+    
     @contextmanager
-    def _get_connection(self):
-        """Контекстный менеджер для работы с БД"""
-        conn = sqlite3.connect(
-            str(self.db_path),
-            timeout=30.0,
-            check_same_thread=False
-        )
-        conn.row_factory = sqlite3.Row  # Для доступа к колонкам по имени
+    def _get_write_connection(self):
+        """
+        Единственное пишущее соединение (в режиме автокоммита)
+        
+        Одиночный оператор выполняется своей неявной транзакцией; внутри
+        transaction() операторы попадают в открытую транзакцию.
+        """
+        with self._writer_lock:
+            if self._writer_conn is None:
+                self._writer_conn = self._open_connection()
+            yield self._writer_conn
+    
+    @contextmanager
+    def transaction(self):
+        """
+        Явная транзакция записи: BEGIN IMMEDIATE на входе, COMMIT/ROLLBACK на выходе
+        
+        Методы записи внутри блока присоединяются к внешней транзакции; вложенный
+        transaction() — это SAVEPOINT: при ошибке откатывается только его часть.
+        """
+        with self._get_write_connection() as conn:
+            if conn.in_transaction:
+                self._savepoint_depth += 1
+                savepoint = f"sp_{self._savepoint_depth}"
+                conn.execute(f"SAVEPOINT {savepoint}")
+                try:
+                    yield conn
+                except Exception as e:
+                    conn.execute(f"ROLLBACK TO {savepoint}")
+                    raise e
+                finally:
+                    conn.execute(f"RELEASE {savepoint}")
+                    self._savepoint_depth -= 1
+                return
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+                conn.execute("COMMIT")
+            except Exception as e:
+                conn.execute("ROLLBACK")
+                raise e
+    
+    @contextmanager
+    def _get_read_connection(self):
+        """Соединение только для чтения из пула (до READER_POOL_SIZE штук)"""
+        try:
+            conn = self._reader_pool.get_nowait()
+        except queue.Empty:
+            with self._connections_lock:
+                can_open = self._reader_count < READER_POOL_SIZE
+                if can_open:
+                    self._reader_count += 1
+            conn = self._open_connection(read_only=True) if can_open else self._reader_pool.get()
         try:
             yield conn
-            conn.commit()
-        except Exception as e:
-            conn.rollback()
-            raise e
         finally:
-            conn.close()
+            if conn.in_transaction:
+                conn.rollback()
+            self._reader_pool.put(conn)
+    
+    def close(self):
+        """Закрыть все открытые соединения (при остановке бота)"""
+        self.flush()
+        with self._writer_lock, self._connections_lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except sqlite3.Error:
+                    pass
+            self._connections.clear()
+            self._writer_conn = None
+            self._reader_pool = queue.Queue()
+            self._reader_count = 0
     
     
     def _init_database(self):
         """Инициализация БД с созданием всех таблиц"""
-        with self._get_connection() as conn:
+        with self.transaction() as conn:
             cursor = conn.cursor()
             
             # Таблица пользователей
             cursor.execute("""
                 CREATE TABLE IF NOT EXISTS users (
                     user_id INTEGER PRIMARY KEY,
-                    api_key_encrypted TEXT,
-                    secret_key_encrypted TEXT,
+                    api_key_encrypted BLOB,
+                    secret_key_encrypted BLOB,
                     is_demo_mode BOOLEAN DEFAULT 1,
                     risk_per_trade REAL DEFAULT 1.5,
                     take_profit_percent REAL DEFAULT 3.0,
@@ -107,6 +528,8 @@ class Database:
                     close_reason TEXT,
                     close_time TIMESTAMP,
                     entry_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    entry_time_ts INTEGER,  -- Unix-секунды (для фильтров/сортировки/индексов)
+                    close_time_ts INTEGER,
                     position_value REAL,  -- Номинальный размер позиции
                     risk_amount REAL,  -- Риск в USDT
                     potential_profit REAL,  -- Потенциальная прибыль
@@ -121,11 +544,21 @@ class Database:
                 )
             """)
             
+            # Числовые колонки времени для старых БД (до индексов по ним)
+            self._migrate_trade_time_columns(cursor)
+            self._migrate_legacy_ciphertexts(cursor)
+            
             # Создаем индексы для trades
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_trades_user_status ON trades(user_id, status)")
+            # Составные индексы покрывают и фильтр (user_id, status), и сортировку по времени;
+            # время индексируется по INTEGER-колонкам (8 байт вместо ~20 байт текста)
+            for old_index in ("idx_trades_user_status", "idx_trades_user_status_entry",
+                              "idx_trades_user_status_close", "idx_trades_entry_time", "idx_trades_close_time"):
+                cursor.execute(f"DROP INDEX IF EXISTS {old_index}")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_trades_user_status_entry_ts ON trades(user_id, status, entry_time_ts DESC)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_trades_user_status_close_ts ON trades(user_id, status, close_time_ts DESC)")
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_trades_symbol_status ON trades(symbol, status)")
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_trades_entry_time ON trades(entry_time)")
-            cursor.execute("CREATE INDEX IF NOT EXISTS idx_trades_close_time ON trades(close_time)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_trades_entry_time_ts ON trades(entry_time_ts)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_trades_close_time_ts ON trades(close_time_ts)")
             
             # Таблица статистики (агрегированная статистика по периодам)
             cursor.execute("""
@@ -205,166 +638,205 @@ class Database:
             # Индекс для notifications
             cursor.execute("CREATE INDEX IF NOT EXISTS idx_notif_user_sent ON notifications(user_id, is_sent, sent_at)")
     
-    def _encrypt(self, data: str) -> str:
-        """Зашифровать данные"""
+    @staticmethod
+    def _migrate_trade_time_columns(cursor: sqlite3.Cursor):
+        """Добавить entry_time_ts/close_time_ts в старые БД и заполнить из текстовых колонок"""
+        cursor.execute("PRAGMA table_info(trades)")
+        columns = {row[1] for row in cursor.fetchall()}
+        for column in ("entry_time_ts", "close_time_ts"):
+            if column not in columns:
+                cursor.execute(f"ALTER TABLE trades ADD COLUMN {column} INTEGER")
+        cursor.execute("""
+            UPDATE trades SET entry_time_ts = CAST(strftime('%s', entry_time) AS INTEGER)
+            WHERE entry_time_ts IS NULL AND entry_time IS NOT NULL
+        """)
+        cursor.execute("""
+            UPDATE trades SET close_time_ts = CAST(strftime('%s', close_time) AS INTEGER)
+            WHERE close_time_ts IS NULL AND close_time IS NOT NULL
+        """)
+    
+    def _migrate_legacy_ciphertexts(self, cursor: sqlite3.Cursor):
+        """Перешифровать ключи из старого формата Fernet (TEXT) в AES-GCM (BLOB)"""
+        cursor.execute("""
+            SELECT user_id, api_key_encrypted, secret_key_encrypted FROM users
+            WHERE typeof(api_key_encrypted) = 'text' OR typeof(secret_key_encrypted) = 'text'
+        """)
+        for user_id, *ciphertexts in cursor.fetchall():
+            try:
+                migrated = [
+                    self._encrypt(self._decrypt(value)) if isinstance(value, str) else value
+                    for value in ciphertexts
+                ]
+            except Exception as e:
+                # Другой ENCRYPTION_KEY: оставляем как есть, _load_user сообщит об ошибке
+                logger.warning("Не удалось перешифровать API ключи пользователя %s: %s", user_id, e)
+                continue
+            cursor.execute(
+                "UPDATE users SET api_key_encrypted = ?, secret_key_encrypted = ? WHERE user_id = ?",
+                (*(value or None for value in migrated), user_id)
+            )
+    
+    def _encrypt(self, data: str) -> bytes:
+        """Зашифровать данные (AES-GCM, результат: nonce + шифротекст)"""
         if not data:
-            return ""
-        return self.cipher.encrypt(data.encode()).decode()
+            return b""
+        nonce = os.urandom(_NONCE_SIZE)
+        return nonce + self._aead_encrypt(nonce, data.encode(), None)
     
-    def _decrypt(self, encrypted_data: str) -> str:
-        """Расшифровать данные"""
+    def _decrypt(self, encrypted_data: Union[bytes, str]) -> str:
+        """
+        Расшифровать данные (bytes — AES-GCM, str — старый формат Fernet)
+        
+        Результат — чистая функция шифротекста, поэтому запоминается: повторные чтения
+        того же ключа не выполняют расшифровку заново.
+        """
         if not encrypted_data:
             return ""
-        return self.cipher.decrypt(encrypted_data.encode()).decode()
+        decrypted = self._decrypted.get(encrypted_data)
+        if decrypted is None:
+            if isinstance(encrypted_data, str):
+                decrypted = self._cipher_decrypt(encrypted_data.encode()).decode()
+            else:
+                decrypted = self._aead_decrypt(
+                    encrypted_data[:_NONCE_SIZE], encrypted_data[_NONCE_SIZE:], None
+                ).decode()
+            if len(self._decrypted) >= _DECRYPT_CACHE_MAXSIZE:
+                self._decrypted.clear()
+            self._decrypted[encrypted_data] = decrypted
+        return decrypted
     
     # ========== МЕТОДЫ ДЛЯ ПОЛЬЗОВАТЕЛЕЙ ==========
     
+    @staticmethod
+    def _copy_user(data: Dict[str, Any]) -> Dict[str, Any]:
+        """Копия данных пользователя, которую вызывающий код может свободно менять"""
+        copied = dict(data)
+        copied['trading_pairs'] = list(data.get('trading_pairs') or [])
+        return copied
+    
+    def _invalidate_user(self, user_id: int):
+        """Сбросить кэш пользователя после записи"""
+        with self._user_cache_lock:
+            self._user_cache.pop(user_id, None)
+            self._user_cache_epoch += 1
+    
     def get_user(self, user_id: int) -> Optional[Dict[str, Any]]:
-        """Получить данные пользователя"""
-        with self._get_connection() as conn:
+        """Получить данные пользователя (с коротким TTL-кэшем, без повторной расшифровки ключей)"""
+        with self._user_cache_lock:
+            cached = self._user_cache.get(user_id)
+            epoch = self._user_cache_epoch
+        if cached and time.monotonic() - cached[0] < USER_CACHE_TTL:
+            return self._copy_user(cached[1])
+        
+        data = self._load_user(user_id)
+        if data is not None:
+            with self._user_cache_lock:
+                # Не кэшируем, если между чтением и сохранением была запись
+                if epoch == self._user_cache_epoch:
+                    self._user_cache[user_id] = (time.monotonic(), data)
+            return self._copy_user(data)
+        return None
+    
+    def _load_user(self, user_id: int) -> Optional[Dict[str, Any]]:
+        """Прочитать пользователя из БД и расшифровать ключи"""
+        with self._get_read_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+            cursor.execute(_SELECT_USER_SQL, (user_id,))
             row = cursor.fetchone()
-            
-            if not row:
-                return None
-            
-            data = dict(row)
-            
-            # Расшифровываем API ключи
+        
+        if not row:
+            return None
+        return self._user_from_row(row)
+    
+    def get_all_users(self) -> List[Dict[str, Any]]:
+        """Все пользователи одним запросом (для прогрева кэшей при запуске)"""
+        with self._get_read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(_SELECT_ALL_USERS_SQL)
+            rows = cursor.fetchall()
+        return [self._user_from_row(row) for row in rows]
+    
+    def _user_from_row(self, row: DbRow) -> Dict[str, Any]:
+        """Строка users -> словарь с расшифрованными ключами и разобранными JSON-полями"""
+        data = dict(row)
+        
+        # Расшифровываем API ключи (шифротекст — внутренний формат БД, наружу не отдаём)
+        api_key_encrypted = data.pop('api_key_encrypted', None)
+        secret_key_encrypted = data.pop('secret_key_encrypted', None)
+        try:
+            if api_key_encrypted:
+                decrypted = self._decrypt(api_key_encrypted)
+                if decrypted:
+                    data['api_key'] = decrypted
+            if secret_key_encrypted:
+                decrypted = self._decrypt(secret_key_encrypted)
+                if decrypted:
+                    data['secret_key'] = decrypted
+        except Exception as e:
+            logger.warning("Ошибка расшифровки API ключей для пользователя %s: %s", data.get('user_id'), e)
+            # Оставляем ключи пустыми если не удалось расшифровать
+        
+        # Парсим JSON поля
+        if data.get('trading_pairs'):
             try:
-                if data.get('api_key_encrypted'):
-                    decrypted = self._decrypt(data['api_key_encrypted'])
-                    if decrypted:
-                        data['api_key'] = decrypted
-                if data.get('secret_key_encrypted'):
-                    decrypted = self._decrypt(data['secret_key_encrypted'])
-                    if decrypted:
-                        data['secret_key'] = decrypted
-            except Exception as e:
-                print(f"Ошибка расшифровки API ключей для пользователя {user_id}: {e}")
-                # Оставляем ключи пустыми если не удалось расшифровать
-            
-            # Парсим JSON поля
-            if data.get('trading_pairs'):
-                try:
-                    data['trading_pairs'] = json.loads(data['trading_pairs'])
-                except:
-                    data['trading_pairs'] = []
-            else:
+                data['trading_pairs'] = json.loads(data['trading_pairs'])
+            except:
                 data['trading_pairs'] = []
-            
-            return data
+        else:
+            data['trading_pairs'] = []
+        
+        return data
     
     def create_or_update_user(self, user_id: int, data: Dict[str, Any]) -> bool:
         """Создать или обновить пользователя"""
-        with self._get_connection() as conn:
+        # Текущее состояние из кэша get_user: неизменённые поля не сериализуем/не шифруем
+        # заново — NULL в UPSERT оставляет значение в БД как есть (COALESCE)
+        with self._user_cache_lock:
+            cached = self._user_cache.get(user_id)
+        current = cached[1] if cached else {}
+        
+        with self._get_write_connection() as conn:
             cursor = conn.cursor()
             
-            # Проверяем существование пользователя
-            cursor.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
-            exists = cursor.fetchone() is not None
-            
             # Подготовка данных
             api_key_encrypted = None
             secret_key_encrypted = None
-            if data.get('api_key'):
+            if data.get('api_key') and data['api_key'] != current.get('api_key'):
                 api_key_encrypted = self._encrypt(data['api_key'])
-            if data.get('secret_key'):
+            if data.get('secret_key') and data['secret_key'] != current.get('secret_key'):
                 secret_key_encrypted = self._encrypt(data['secret_key'])
             
-            trading_pairs_json = json.dumps(data.get('trading_pairs', []))
-            
-            if exists:
-                # Обновление - обновляем ключи только если они указаны
-                # Строим SQL запрос динамически в зависимости от наличия ключей
-                update_fields = []
-                update_values = []
-                
-                if api_key_encrypted is not None:
-                    update_fields.append("api_key_encrypted = ?")
-                    update_values.append(api_key_encrypted)
-                if secret_key_encrypted is not None:
-                    update_fields.append("secret_key_encrypted = ?")
-                    update_values.append(secret_key_encrypted)
-                
-                # Всегда обновляем остальные поля
-                update_fields.extend([
-                    "is_demo_mode = ?",
-                    "risk_per_trade = ?",
-                    "take_profit_percent = ?",
-                    "stop_loss_percent = ?",
-                    "leverage = ?",
-                    "max_open_positions = ?",
-                    "trading_pairs = ?",
-                    "auto_trading_enabled = ?",
-                    "notifications_enabled = ?",
-                    "demo_balance = ?",
-                    "max_drawdown_percent = ?",
-                    "strategy_profile = ?",
-                    "sl_cooldown_minutes = ?",
-                    "atr_min_percent = ?",
-                    "timeframe = ?",
-                    "htf_timeframe = ?",
-                    "updated_at = CURRENT_TIMESTAMP"
-                ])
-                
-                update_values.extend([
-                    data.get('is_demo_mode', True),
-                    data.get('risk_per_trade', 1.5),
-                    data.get('take_profit_percent', 3.0),
-                    data.get('stop_loss_percent', 1.5),
-                    data.get('leverage', 5),
-                    data.get('max_open_positions', 5),
-                    trading_pairs_json,
-                    data.get('auto_trading_enabled', False),
-                    data.get('notifications_enabled', True),
-                    data.get('demo_balance', 10000.0),
-                    data.get('max_drawdown_percent', 20.0),
-                    data.get('strategy_profile', 'scalp_smc_v2'),
-                    data.get('sl_cooldown_minutes', 15),
-                    data.get('atr_min_percent', 0.25),
-                    data.get('timeframe', '5m'),
-                    data.get('htf_timeframe', '1h'),
-                    user_id
-                ])
-                
-                sql = f"UPDATE users SET {', '.join(update_fields)} WHERE user_id = ?"
-                cursor.execute(sql, update_values)
+            trading_pairs = data.get('trading_pairs', [])
+            if cached and trading_pairs == current.get('trading_pairs'):
+                trading_pairs_json = None
             else:
-                # Создание
-                cursor.execute("""
-                    INSERT INTO users (
-                        user_id, api_key_encrypted, secret_key_encrypted,
-                        is_demo_mode, risk_per_trade, take_profit_percent,
-                        stop_loss_percent, leverage, max_open_positions,
-                        trading_pairs, auto_trading_enabled, notifications_enabled,
-                        demo_balance, max_drawdown_percent, strategy_profile,
-                        sl_cooldown_minutes, atr_min_percent, timeframe, htf_timeframe
-                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    user_id,
-                    api_key_encrypted,
-                    secret_key_encrypted,
-                    data.get('is_demo_mode', True),
-                    data.get('risk_per_trade', 1.5),
-                    data.get('take_profit_percent', 3.0),
-                    data.get('stop_loss_percent', 1.5),
-                    data.get('leverage', 5),
-                    data.get('max_open_positions', 5),
-                    trading_pairs_json,
-                    data.get('auto_trading_enabled', False),
-                    data.get('notifications_enabled', True),
-                    data.get('demo_balance', 10000.0),
-                    data.get('max_drawdown_percent', 20.0),
-                    data.get('strategy_profile', 'scalp_smc_v2'),
-                    data.get('sl_cooldown_minutes', 15),
-                    data.get('atr_min_percent', 0.25),
-                    data.get('timeframe', '5m'),
-                    data.get('htf_timeframe', '1h')
-                ))
+                trading_pairs_json = json.dumps(trading_pairs)
             
-            return True
+            # Один UPSERT вместо SELECT + INSERT/UPDATE; ключи обновляются только если указаны
+            cursor.execute(_UPSERT_USER_SQL, (
+                user_id,
+                api_key_encrypted,
+                secret_key_encrypted,
+                data.get('is_demo_mode', True),
+                data.get('risk_per_trade', 1.5),
+                data.get('take_profit_percent', 3.0),
+                data.get('stop_loss_percent', 1.5),
+                data.get('leverage', 5),
+                data.get('max_open_positions', 5),
+                trading_pairs_json,
+                data.get('auto_trading_enabled', False),
+                data.get('notifications_enabled', True),
+                data.get('demo_balance', 10000.0),
+                data.get('max_drawdown_percent', 20.0),
+                data.get('strategy_profile', 'scalp_smc_v2'),
+                data.get('sl_cooldown_minutes', 15),
+                data.get('atr_min_percent', 0.25),
+                data.get('timeframe', '5m'),
+                data.get('htf_timeframe', '1h')
+            ))
+        
+        self._invalidate_user(user_id)
+        return True
     
     def update_user_setting(self, user_id: int, key: str, value: Any) -> bool:
         """Обновить настройку пользователя"""
@@ -377,76 +849,79 @@ class Database:
     
     # ========== МЕТОДЫ ДЛЯ СДЕЛОК ==========
     
+    @staticmethod
+    def _trade_row(user_id: int, trade_data: Dict[str, Any]) -> tuple:
+        """Параметры для _INSERT_TRADE_SQL из словаря сделки"""
+        return (
+            user_id,
+            trade_data.get('symbol'),
+            trade_data.get('direction'),
+            trade_data.get('amount'),
+            trade_data.get('entry'),
+            trade_data.get('stop_loss'),
+            trade_data.get('take_profit'),
+            trade_data.get('leverage', 5),
+            trade_data.get('status', 'open'),
+            trade_data.get('pnl', 0),
+            trade_data.get('close_price'),
+            trade_data.get('close_reason'),
+            trade_data.get('close_time'),
+            trade_data.get('close_time_ts'),
+            trade_data.get('position_value'),
+            trade_data.get('risk_amount'),
+            trade_data.get('potential_profit'),
+            trade_data.get('risk_reward_ratio'),
+            trade_data.get('probability'),
+            trade_data.get('quality_score'),
+            trade_data.get('signal_strength'),
+            trade_data.get('scale_factor'),
+            trade_data.get('order_id'),
+            trade_data.get('is_demo', True)
+        )
+    
     def create_trade(self, user_id: int, trade_data: Dict[str, Any]) -> int:
         """Создать новую сделку и вернуть её ID"""
-        with self._get_connection() as conn:
+        with self._get_write_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO trades (
-                    user_id, symbol, direction, amount, entry_price,
-                    stop_loss, take_profit, leverage, status, pnl,
-                    position_value, risk_amount, potential_profit,
-                    risk_reward_ratio, probability, quality_score,
-                    signal_strength, scale_factor, order_id, is_demo
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                user_id,
-                trade_data.get('symbol'),
-                trade_data.get('direction'),
-                trade_data.get('amount'),
-                trade_data.get('entry'),
-                trade_data.get('stop_loss'),
-                trade_data.get('take_profit'),
-                trade_data.get('leverage', 5),
-                'open',
-                0,
-                trade_data.get('position_value'),
-                trade_data.get('risk_amount'),
-                trade_data.get('potential_profit'),
-                trade_data.get('risk_reward_ratio'),
-                trade_data.get('probability'),
-                trade_data.get('quality_score'),
-                trade_data.get('signal_strength'),
-                trade_data.get('scale_factor'),
-                trade_data.get('order_id'),
-                trade_data.get('is_demo', True)
-            ))
+            cursor.execute(_INSERT_TRADE_SQL, self._trade_row(user_id, trade_data))
             return cursor.lastrowid
     
+    def create_trades_bulk(self, user_id: int, trades: Iterable[Dict[str, Any]]) -> int:
+        """
+        Создать несколько сделок одной транзакцией (executemany), вернуть их количество
+        
+        trades может быть генератором: строки передаются в executemany потоково,
+        без промежуточного списка.
+        """
+        count = 0
+        
+        def rows() -> Iterator[tuple]:
+            nonlocal count
+            for trade_data in trades:
+                count += 1
+                yield self._trade_row(user_id, trade_data)
+        
+        with self.transaction() as conn:
+            conn.executemany(_INSERT_TRADE_SQL, rows())
+        return count
+    
     def close_trade(self, trade_id: int, close_price: float, close_reason: str, pnl: float) -> bool:
         """Закрыть сделку"""
-        with self._get_connection() as conn:
+        with self._get_write_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                UPDATE trades SET
-                    status = 'closed',
-                    close_price = ?,
-                    close_reason = ?,
-                    close_time = CURRENT_TIMESTAMP,
-                    pnl = ?
-                WHERE trade_id = ?
-            """, (close_price, close_reason, pnl, trade_id))
+            cursor.execute(_CLOSE_TRADE_SQL, (close_price, close_reason, pnl, trade_id))
             return cursor.rowcount > 0
     
-    def get_open_trades(self, user_id: int, symbol: Optional[str] = None) -> List[Dict[str, Any]]:
+    def get_open_trades(self, user_id: int, symbol: Optional[str] = None) -> List[DbRow]:
         """Получить открытые сделки"""
-        with self._get_connection() as conn:
+        with self._get_read_connection() as conn:
             cursor = conn.cursor()
             if symbol:
-                cursor.execute("""
-                    SELECT * FROM trades 
-                    WHERE user_id = ? AND status = 'open' AND symbol = ?
-                    ORDER BY entry_time DESC
-                """, (user_id, symbol))
+                cursor.execute(_SELECT_OPEN_TRADES_BY_SYMBOL_SQL, (user_id, symbol))
             else:
-                cursor.execute("""
-                    SELECT * FROM trades 
-                    WHERE user_id = ? AND status = 'open'
-                    ORDER BY entry_time DESC
-                """, (user_id,))
+                cursor.execute(_SELECT_OPEN_TRADES_SQL, (user_id,))
             
-            rows = cursor.fetchall()
-            return [dict(row) for row in rows]
+            return cursor.fetchall()
     
     def get_closed_trades(
         self, 
@@ -454,13 +929,22 @@ class Database:
         limit: int = 100,
         symbol: Optional[str] = None,
         start_date: Optional[datetime] = None,
-        end_date: Optional[datetime] = None
-    ) -> List[Dict[str, Any]]:
-        """Получить закрытые сделки с фильтрацией"""
-        with self._get_connection() as conn:
+        end_date: Optional[datetime] = None,
+        full: bool = False,
+        before: Optional[Tuple[int, int]] = None
+    ) -> List[DbRow]:
+        """
+        Получить закрытые сделки с фильтрацией
+        
+        full=True — все колонки (для аналитики по probability/quality_score и т.п.),
+        иначе только колонки списка сделок.
+        before — курсор следующей страницы: page_cursor(предыдущая_страница, 'close_time_ts').
+        """
+        columns = "*" if full else _TRADE_LIST_COLUMNS
+        with self._get_read_connection() as conn:
             cursor = conn.cursor()
             
-            query = "SELECT * FROM trades WHERE user_id = ? AND status = 'closed'"
+            query = f"SELECT {columns} FROM trades WHERE user_id = ? AND status = 'closed'"
             params = [user_id]
             
             if symbol:
@@ -468,53 +952,62 @@ class Database:
                 params.append(symbol)
             
             if start_date:
-                query += " AND close_time >= ?"
-                params.append(start_date.isoformat())
+                query += " AND close_time_ts >= ?"
+                params.append(_epoch_seconds(start_date))
             
             if end_date:
-                query += " AND close_time <= ?"
-                params.append(end_date.isoformat())
+                query += " AND close_time_ts <= ?"
+                params.append(_epoch_seconds(end_date))
             
-            query += " ORDER BY close_time DESC LIMIT ?"
+            if before:
+                query += " AND (close_time_ts, trade_id) < (?, ?)"
+                params.extend(before)
+            
+            query += " ORDER BY close_time_ts DESC, trade_id DESC LIMIT ?"
             params.append(limit)
             
             cursor.execute(query, params)
-            rows = cursor.fetchall()
-            return [dict(row) for row in rows]
+            return cursor.fetchall()
     
     def get_all_trades(
         self,
         user_id: int,
         limit: int = 1000,
-        status: Optional[str] = None
-    ) -> List[Dict[str, Any]]:
-        """Получить все сделки (открытые и закрытые)"""
-        with self._get_connection() as conn:
+        status: Optional[str] = None,
+        before: Optional[Tuple[int, int]] = None
+    ) -> List[DbRow]:
+        """
+        Получить все сделки (открытые и закрытые)
+        
+        before — курсор следующей страницы: page_cursor(предыдущая_страница).
+        """
+        with self._get_read_connection() as conn:
             cursor = conn.cursor()
             
-            if status:
-                cursor.execute("""
-                    SELECT * FROM trades 
-                    WHERE user_id = ? AND status = ?
-                    ORDER BY entry_time DESC
-                    LIMIT ?
-                """, (user_id, status, limit))
+            if status and before:
+                cursor.execute(_SELECT_TRADES_BY_STATUS_PAGE_SQL, (user_id, status, *before, limit))
+            elif status:
+                cursor.execute(_SELECT_TRADES_BY_STATUS_SQL, (user_id, status, limit))
+            elif before:
+                cursor.execute(_SELECT_ALL_TRADES_PAGE_SQL, (user_id, *before, limit))
             else:
-                cursor.execute("""
-                    SELECT * FROM trades 
-                    WHERE user_id = ?
-                    ORDER BY entry_time DESC
-                    LIMIT ?
-                """, (user_id, limit))
+                cursor.execute(_SELECT_ALL_TRADES_SQL, (user_id, limit))
             
-            rows = cursor.fetchall()
-            return [dict(row) for row in rows]
+            return cursor.fetchall()
+    
+    @staticmethod
+    def page_cursor(rows: List[DbRow], time_column: str = 'entry_time_ts') -> Optional[Tuple[int, int]]:
+        """Курсор для следующей страницы: (время, trade_id) последней строки или None"""
+        if not rows:
+            return None
+        last = rows[-1]
+        return (last[time_column], last['trade_id'])
     
     def get_trade_by_id(self, trade_id: int) -> Optional[Dict[str, Any]]:
         """Получить сделку по ID"""
-        with self._get_connection() as conn:
+        with self._get_read_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT * FROM trades WHERE trade_id = ?", (trade_id,))
+            cursor.execute(_SELECT_TRADE_BY_ID_SQL, (trade_id,))
             row = cursor.fetchone()
             return dict(row) if row else None
     
@@ -523,42 +1016,94 @@ class Database:
         if not updates:
             return False
 
-        invalid = set(updates.keys()) - _TRADES_COLUMNS
-        if invalid:
-            raise ValueError(f"Недопустимые поля trades: {invalid}")
-
-        set_clauses = []
-        params = []
-        for key, value in updates.items():
-            set_clauses.append(f"{key} = ?")
-            params.append(value)
+        keys = tuple(updates)
+        sql = _UPDATE_TRADE_SQL_CACHE.get(keys)
+        if sql is None:
+            # Валидация только при построении нового запроса: закэшированные наборы уже проверены
+            invalid = updates.keys() - _TRADES_COLUMNS
+            if invalid:
+                raise ValueError(f"Недопустимые поля trades: {invalid}")
+            sql = f"UPDATE trades SET {', '.join(_TRADE_SET_CLAUSES[key] for key in keys)} WHERE trade_id = ?"
+            _UPDATE_TRADE_SQL_CACHE[keys] = sql
         
-        params.append(trade_id)
-        
-        with self._get_connection() as conn:
+        with self._get_write_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute(
-                f"UPDATE trades SET {', '.join(set_clauses)} WHERE trade_id = ?",
-                params
-            )
+            cursor.execute(sql, (*updates.values(), trade_id))
             return cursor.rowcount > 0
     
     # ========== МЕТОДЫ ДЛЯ СТАТИСТИКИ ==========
     
+    def compute_trade_statistics(self, user_id: int, period_start: datetime, period_end: datetime,
+                                 period_type: str = 'all') -> Dict[str, Any]:
+        """
+        Посчитать статистику закрытых сделок за период средствами SQL.
+        
+        Суммы/количества считаются агрегатами в одном проходе по индексу; для просадки
+        и серий в Python читается только колонка pnl. Результат подходит для
+        save_trade_statistics.
+        """
+        params = (user_id, _epoch_seconds(period_start), _epoch_seconds(period_end))
+        with self._get_read_connection() as conn:
+            agg = conn.execute(_TRADE_AGGREGATES_SQL, params).fetchone()
+            pnls = [row[0] for row in conn.execute(_TRADE_PNL_SERIES_SQL, params)]
+        
+        total_trades = agg['total_trades'] or 0
+        winning_trades = agg['winning_trades'] or 0
+        losing_trades = agg['losing_trades'] or 0
+        total_profit = agg['total_profit'] or 0.0
+        total_loss = abs(agg['total_loss'] or 0.0)
+        
+        # Просадка и серии — по хронологической последовательности PnL
+        cumulative = peak = max_drawdown = 0.0
+        win_streak = loss_streak = max_win_streak = max_loss_streak = 0
+        for pnl in pnls:
+            cumulative += pnl
+            peak = max(peak, cumulative)
+            max_drawdown = max(max_drawdown, peak - cumulative)
+            if pnl > 0:
+                win_streak, loss_streak = win_streak + 1, 0
+            elif pnl < 0:
+                win_streak, loss_streak = 0, loss_streak + 1
+            max_win_streak = max(max_win_streak, win_streak)
+            max_loss_streak = max(max_loss_streak, loss_streak)
+        
+        # Упрощённый Sharpe на сделку из SUM(pnl) и SUM(pnl^2)
+        sharpe = 0.0
+        if total_trades >= 2:
+            mean = (agg['sum_pnl'] or 0.0) / total_trades
+            var = ((agg['sum_pnl_sq'] or 0.0) - total_trades * mean * mean) / (total_trades - 1)
+            if var > 0:
+                sharpe = round(mean / var ** 0.5, 3)
+        
+        net_profit = total_profit - total_loss
+        return {
+            'period_start': period_start.isoformat(),
+            'period_end': period_end.isoformat(),
+            'period_type': period_type,
+            'total_trades': total_trades,
+            'winning_trades': winning_trades,
+            'losing_trades': losing_trades,
+            'total_profit': round(total_profit, 2),
+            'total_loss': round(total_loss, 2),
+            'net_profit': round(net_profit, 2),
+            'win_rate': round(winning_trades / total_trades * 100, 2) if total_trades else 0,
+            'profit_factor': round(total_profit / total_loss, 2) if total_loss > 0 else 0,
+            'max_drawdown': round(max_drawdown, 2),
+            'sharpe': sharpe,
+            'avg_win': round(total_profit / winning_trades, 2) if winning_trades else 0,
+            'avg_loss': round(total_loss / losing_trades, 2) if losing_trades else 0,
+            'best_trade': agg['best_trade'] or 0,
+            'worst_trade': agg['worst_trade'] or 0,
+            'max_winning_streak': max_win_streak,
+            'max_losing_streak': max_loss_streak,
+            'recovery_factor': round(net_profit / max_drawdown, 2) if max_drawdown > 0 else 0,
+        }
+    
     def save_trade_statistics(self, user_id: int, stats: Dict[str, Any]) -> int:
         """Сохранить агрегированную статистику"""
-        with self._get_connection() as conn:
+        with self._get_write_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO trade_statistics (
-                    user_id, period_start, period_end, period_type,
-                    total_trades, winning_trades, losing_trades,
-                    total_profit, total_loss, net_profit, win_rate,
-                    profit_factor, max_drawdown, sharpe_ratio, sortino_ratio,
-                    avg_win, avg_loss, max_losing_streak, max_winning_streak,
-                    recovery_factor, var_95, cvar_95
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
+            cursor.execute(_INSERT_TRADE_STATISTICS_SQL, (
                 user_id,
                 stats.get('period_start'),
                 stats.get('period_end'),
@@ -587,16 +1132,9 @@ class Database:
     def save_pair_statistics(self, user_id: int, symbol: str, stats: Dict[str, Any], 
                             period_start: datetime, period_end: datetime) -> bool:
         """Сохранить статистику по паре"""
-        with self._get_connection() as conn:
+        with self._get_write_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("""
-                INSERT OR REPLACE INTO pair_statistics (
-                    user_id, symbol, period_start, period_end,
-                    total_trades, winning_trades, losing_trades,
-                    total_pnl, win_rate, profit_factor, avg_pnl,
-                    best_trade, worst_trade
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
+            cursor.execute(_SAVE_PAIR_STATISTICS_SQL, (
                 user_id, symbol, period_start.isoformat(), period_end.isoformat(),
                 stats.get('total_trades', 0),
                 stats.get('winning_trades', 0),
@@ -613,51 +1151,108 @@ class Database:
     # ========== МЕТОДЫ ДЛЯ УВЕДОМЛЕНИЙ ==========
     
     def log_notification(self, user_id: int, notification_type: str, 
-                        message_text: str, trade_id: Optional[int] = None) -> int:
-        """Записать уведомление в БД"""
-        with self._get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                INSERT INTO notifications (
-                    user_id, trade_id, notification_type, message_text
-                ) VALUES (?, ?, ?, ?)
-            """, (user_id, trade_id, notification_type, message_text))
-            return cursor.lastrowid
+                        message_text: str, trade_id: Optional[int] = None,
+                        wait: bool = False) -> Optional[int]:
+        """
+        Записать уведомление в БД
+        
+        По умолчанию запись отложенная: уведомление ставится в очередь и пишется фоновым
+        потоком пачкой (возвращается None). wait=True — синхронная запись с возвратом ID.
+        """
+        row = (user_id, trade_id, notification_type, message_text)
+        if wait:
+            with self._get_write_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute(_INSERT_NOTIFICATION_SQL, row)
+                return cursor.lastrowid
+        
+        self._ensure_notif_flusher()
+        self._notif_q.put_nowait(row)
+        return None
+    
+    def _ensure_notif_flusher(self):
+        """Запустить фоновый поток записи уведомлений, если он ещё не запущен"""
+        if self._notif_thread is not None:
+            return
+        with self._notif_thread_lock:
+            if self._notif_thread is None:
+                self._notif_thread = threading.Thread(
+                    target=self._notif_flusher, name="notifications-flusher", daemon=True
+                )
+                self._notif_thread.start()
+    
+    def _notif_flusher(self):
+        """Фоновый поток: собирает до NOTIFICATION_BATCH_SIZE уведомлений (не дольше
+        NOTIFICATION_FLUSH_INTERVAL) и пишет их одним executemany в одной транзакции"""
+        notif_q = self._notif_q
+        while True:
+            items = [notif_q.get()]
+            deadline = time.monotonic() + NOTIFICATION_FLUSH_INTERVAL
+            # None — сигнал flush(): пишем накопленное, не дожидаясь интервала
+            while items[-1] is not None and len(items) < NOTIFICATION_BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    items.append(notif_q.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            batch = [item for item in items if item is not None]
+            try:
+                if batch:
+                    with self.transaction() as conn:
+                        conn.executemany(_INSERT_NOTIFICATION_SQL, batch)
+            except Exception as e:
+                logger.error("Ошибка записи уведомлений (%d шт.): %s", len(batch), e, exc_info=True)
+            finally:
+                for _ in items:
+                    notif_q.task_done()
+    
+    def flush(self):
+        """Дождаться записи всех отложенных уведомлений (вызывать перед остановкой)"""
+        if self._notif_thread is not None:
+            self._notif_q.put_nowait(None)
+            self._notif_q.join()
+    
+    def log_notifications_bulk(self, notifications: List[Dict[str, Any]]) -> int:
+        """
+        Записать пачку уведомлений одной транзакцией.
+        
+        Каждый элемент: {'user_id', 'notification_type', 'message_text', 'trade_id' (опционально)}
+        """
+        if not notifications:
+            return 0
+        rows = [
+            (n['user_id'], n.get('trade_id'), n['notification_type'], n.get('message_text'))
+            for n in notifications
+        ]
+        with self.transaction() as conn:
+            conn.executemany(_INSERT_NOTIFICATION_SQL, rows)
+        return len(rows)
     
     def get_notifications(self, user_id: int, limit: int = 50, 
-                         notification_type: Optional[str] = None) -> List[Dict[str, Any]]:
+                         notification_type: Optional[str] = None) -> List[DbRow]:
         """Получить историю уведомлений"""
-        with self._get_connection() as conn:
+        with self._get_read_connection() as conn:
             cursor = conn.cursor()
             
             if notification_type:
-                cursor.execute("""
-                    SELECT * FROM notifications 
-                    WHERE user_id = ? AND notification_type = ?
-                    ORDER BY sent_at DESC
-                    LIMIT ?
-                """, (user_id, notification_type, limit))
+                cursor.execute(_SELECT_NOTIFICATIONS_BY_TYPE_SQL, (user_id, notification_type, limit))
             else:
-                cursor.execute("""
-                    SELECT * FROM notifications 
-                    WHERE user_id = ?
-                    ORDER BY sent_at DESC
-                    LIMIT ?
-                """, (user_id, limit))
+                cursor.execute(_SELECT_NOTIFICATIONS_SQL, (user_id, limit))
             
-            rows = cursor.fetchall()
-            return [dict(row) for row in rows]
+            return cursor.fetchall()
     
     # ========== МИГРАЦИЯ ДАННЫХ ==========
     
-    def migrate_from_json(self, user_id: int, json_file_path: Path) -> bool:
-        """Мигрировать данные из JSON файла в БД"""
+    def migrate_from_json(self, user_id: int, json_file_path: Path,
+                          json_data: Optional[Dict[str, Any]] = None) -> bool:
+        """Мигрировать данные из JSON файла в БД (json_data — уже прочитанное содержимое файла)"""
         try:
-            if not json_file_path.exists():
-                return False
-            
-            with open(json_file_path, 'r', encoding='utf-8') as f:
-                json_data = json.load(f)
+            if json_data is None:
+                if not json_file_path.exists():
+                    return False
+                json_data = json.loads(json_file_path.read_bytes())
             
             # Мигрируем данные пользователя
             user_data = {
@@ -685,57 +1280,93 @@ class Database:
                 user_data['api_key'] = None  # Будет расшифровано при чтении
                 user_data['secret_key'] = None
             
-            self.create_or_update_user(user_id, user_data)
-            
-            # Мигрируем сделки
-            demo_positions = json_data.get('demo_positions', [])
-            for pos in demo_positions:
-                trade_data = {
-                    'symbol': pos.get('symbol'),
-                    'direction': pos.get('direction', 'long'),
-                    'amount': pos.get('amount', 0),
-                    'entry': pos.get('entry', 0),
-                    'stop_loss': pos.get('stop_loss'),
-                    'take_profit': pos.get('take_profit'),
-                    'leverage': json_data.get('leverage', 5),
-                    'is_demo': True,
-                    'position_value': pos.get('entry', 0) * pos.get('amount', 0) if pos.get('entry') and pos.get('amount') else 0
-                }
-                
-                trade_id = self.create_trade(user_id, trade_data)
-                
-                # Если сделка закрыта - обновляем
-                if pos.get('status') == 'closed' and pos.get('close_price'):
-                    self.close_trade(
-                        trade_id,
-                        pos.get('close_price'),
-                        pos.get('close_reason', ''),
-                        pos.get('pnl', 0)
-                    )
+            # Мигрируем сделки одной пачкой (закрытые сразу вставляются закрытыми)
+            closed_at_ts = int(time.time())
+            closed_at = datetime.utcfromtimestamp(closed_at_ts).strftime('%Y-%m-%d %H:%M:%S')
+            
+            leverage = json_data.get('leverage', 5)
+            
+            def trades() -> Iterator[Dict[str, Any]]:
+                for pos in json_data.get('demo_positions', []):
+                    pget = pos.get
+                    entry = pget('entry', 0)
+                    amount = pget('amount', 0)
+                    trade_data = {
+                        'symbol': pget('symbol'),
+                        'direction': pget('direction', 'long'),
+                        'amount': amount,
+                        'entry': entry,
+                        'stop_loss': pget('stop_loss'),
+                        'take_profit': pget('take_profit'),
+                        'leverage': leverage,
+                        'is_demo': True,
+                        'position_value': entry * amount if entry and amount else 0
+                    }
+                    close_price = pget('close_price')
+                    if close_price and pget('status') == 'closed':
+                        trade_data.update({
+                            'status': 'closed',
+                            'close_price': close_price,
+                            'close_reason': pget('close_reason', ''),
+                            'close_time': closed_at,
+                            'close_time_ts': closed_at_ts,
+                            'pnl': pget('pnl', 0),
+                        })
+                    yield trade_data
+            
+            # Пользователь и его сделки — одной транзакцией
+            with self.transaction():
+                self.create_or_update_user(user_id, user_data)
+                self.create_trades_bulk(user_id, trades())
             
             return True
         except Exception as e:
-            print(f"Ошибка миграции данных для пользователя {user_id}: {e}")
+            logger.error("Ошибка миграции данных для пользователя %s: %s", user_id, e, exc_info=True)
             return False
     
-    def migrate_all_json_files(self, data_dir: str = "data") -> int:
-        """Мигрировать все JSON файлы в БД"""
+    def batch_migrate(self, entries: List[Tuple[int, Path]], retire: bool = True) -> int:
+        """
+        Мигрировать несколько JSON файлов одной транзакцией
+        
+        Каждый пользователь — отдельный SAVEPOINT (через transaction() в migrate_from_json):
+        ошибка в одном файле откатывает только его данные.
+        
+        При retire=True успешно мигрированные файлы после коммита переименовываются
+        в .json.migrated: иначе следующий запуск снова перезапишет настройки из БД
+        устаревшим снимком и повторно добавит демо-позиции как новые сделки.
+        """
+        migrated_files: List[Path] = []
+        with self.transaction():
+            for user_id, json_file in entries:
+                if self.migrate_from_json(user_id, json_file):
+                    migrated_files.append(json_file)
+                    logger.debug("✅ Мигрированы данные пользователя %s", user_id)
+        
+        if retire:
+            # Только после коммита: при откате транзакции файлы остаются на месте
+            for json_file in migrated_files:
+                try:
+                    json_file.replace(json_file.with_suffix('.json.migrated'))
+                except OSError as e:
+                    logger.error("❌ Не удалось переименовать %s после миграции: %s", json_file, e)
+        return len(migrated_files)
+    
+    def migrate_all_json_files(self, data_dir: str = "data", retire: bool = True) -> int:
+        """Мигрировать все JSON файлы в БД (retire — см. batch_migrate)"""
         data_path = Path(data_dir)
-        migrated = 0
+        entries = []
         
         for json_file in data_path.glob("user_*.json"):
             try:
                 # Извлекаем user_id из имени файла
                 user_id_str = json_file.stem.replace("user_", "")
-                user_id = int(user_id_str)
-                
-                if self.migrate_from_json(user_id, json_file):
-                    migrated += 1
-                    print(f"✅ Мигрированы данные пользователя {user_id}")
+                entries.append((int(user_id_str), json_file))
             except Exception as e:
-                print(f"❌ Ошибка миграции {json_file}: {e}")
+                logger.error("❌ Ошибка миграции %s: %s", json_file, e)
         
-        return migrated
+        if not entries:
+            return 0
+        return self.batch_migrate(entries, retire=retire)
 
 
 # Глобальный экземпляр БД
@@ -748,3 +1379,9 @@ def get_database() -> Database:
     if _db_instance is None:
         _db_instance = Database()
     return _db_instance
+
+
+def close_database():
+    """Закрыть соединения глобального экземпляра БД, если он создавался"""
+    if _db_instance is not None:
+        _db_instance.close()
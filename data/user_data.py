@@ -1,41 +1,97 @@
+import asyncio
+import atexit
+import functools
 import json
+import logging
 import os
-from typing import Dict, Optional, Any, List
+import threading
+from typing import Dict, Optional, Any, List, Tuple
 from pathlib import Path
-from cryptography.fernet import Fernet
 import base64
 from hashlib import sha256
 from datetime import datetime
 try:
-    from data.database import get_database
+    import orjson
+except ImportError:
+    # orjson не установлен — используем стандартный json
+    orjson = None
+try:
+    # Rust-реализация Fernet (совместимый формат токенов): токены — str
+    from rfernet import Fernet
+    _TEXT_TOKENS = True
+except ImportError:
+    # rfernet не установлен — используем cryptography: токены — bytes
+    from cryptography.fernet import Fernet
+    _TEXT_TOKENS = False
+try:
+    from data.database import get_database, load_encryption_key
 except ImportError:
     # Для обратной совместимости
     get_database = None
+    load_encryption_key = None
+
+logger = logging.getLogger(__name__)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_cipher(data_dir: Path) -> Fernet:
+    """Шифр для JSON-файлов: один на каталог данных за процесс"""
+    if load_encryption_key is not None:
+        # Тот же ключ (и та же проверка отпечатка), что и у БД
+        key = load_encryption_key(data_dir)
+    else:
+        # В продакшене секрет задаётся переменной окружения
+        secret = os.getenv("ENCRYPTION_KEY", "default_secret_key_change_in_production")
+        key = base64.urlsafe_b64encode(sha256(secret.encode()).digest())
+    return Fernet(key.decode())
+
+
+# Период фоновой записи отложенных JSON-файлов (секунды)
+JSON_FLUSH_INTERVAL = 0.5
 
 
 class UserDataManager:
     """Менеджер данных пользователей с поддержкой БД и JSON (обратная совместимость)"""
     
-    def __init__(self, data_dir: str = "data", use_database: bool = True):
+    # Кэш расшифрованных данных: user_id -> данные. Общий для всех экземпляров
+    # (менеджер создаётся в каждом модуле хендлеров), иначе запись через один
+    # экземпляр оставляла бы устаревшие данные в кэше другого
+    _cache: Dict[int, Dict[str, Any]] = {}
+    _cache_lock = threading.RLock()
+    
+    # Отложенные записи JSON: файл -> (менеджер, данные). Повторные сохранения
+    # одного пользователя до flush() схлопываются в одну запись файла
+    _dirty: Dict[Path, Tuple['UserDataManager', Dict[str, Any]]] = {}
+    
+    # Индекс открытых демо-позиций: user_id -> {symbol: индекс в demo_positions}.
+    # Сбрасывается любым save_user_data, кроме сохранений из save/update_demo_position
+    _position_index: Dict[int, Dict[str, int]] = {}
+    
+    # Отпечаток последних записанных данных: user_id -> hash сериализации.
+    # Совпадение означает, что запись ничего не изменит, и она пропускается
+    _last_written: Dict[int, int] = {}
+    
+    def __init__(self, data_dir: str = "data", use_database: bool = True,
+                 legacy_json_writes: bool = False):
         self.data_dir = Path(data_dir)
         self.data_dir.mkdir(exist_ok=True)
         self.use_database = use_database and get_database is not None
+        # Писать JSON-копии и при работающей БД (по умолчанию БД — единственный источник)
+        self.legacy_json_writes = legacy_json_writes
         
         # Инициализируем БД если используется
         if self.use_database:
             try:
                 self.db = get_database()
             except Exception as e:
-                print(f"[UserDataManager] ⚠️ Не удалось инициализировать БД: {e}, используем JSON")
+                logger.warning("[UserDataManager] ⚠️ Не удалось инициализировать БД: %s, используем JSON", e)
                 self.use_database = False
                 self.db = None
         else:
             self.db = None
         
-        # Генерируем ключ шифрования на основе секрета (в продакшене использовать переменную окружения)
-        secret = os.getenv("ENCRYPTION_KEY", "default_secret_key_change_in_production")
-        key = sha256(secret.encode()).digest()
-        self.cipher = Fernet(base64.urlsafe_b64encode(key))
+        # Общий для всех экземпляров шифр (см. _get_cipher)
+        self.cipher = _get_cipher(self.data_dir)
     
     def _get_user_file(self, user_id: int) -> Path:
         """Получить путь к файлу пользователя"""
@@ -43,11 +99,13 @@ class UserDataManager:
     
     def _encrypt(self, data: str) -> str:
         """Зашифровать данные"""
-        return self.cipher.encrypt(data.encode()).decode()
+        token = self.cipher.encrypt(data.encode())
+        return token if _TEXT_TOKENS else token.decode()
     
     def _decrypt(self, encrypted_data: str) -> str:
         """Расшифровать данные"""
-        return self.cipher.decrypt(encrypted_data.encode()).decode()
+        token = encrypted_data if _TEXT_TOKENS else encrypted_data.encode()
+        return bytes(self.cipher.decrypt(token)).decode()
     
     def _migrate_if_needed(self):
         """Автоматическая миграция данных из JSON в БД при первом запуске"""
@@ -55,15 +113,72 @@ class UserDataManager:
             # Проверяем, есть ли JSON файлы для миграции
             json_files = list(self.data_dir.glob("user_*.json"))
             if json_files:
-                print(f"[UserDataManager] Найдено {len(json_files)} JSON файлов для миграции...")
-                migrated = self.db.migrate_all_json_files(str(self.data_dir))
+                logger.info("[UserDataManager] Найдено %d JSON файлов для миграции...", len(json_files))
+                # С legacy_json_writes JSON остаётся актуальной копией — файлы не переименовываем
+                migrated = self.db.migrate_all_json_files(
+                    str(self.data_dir), retire=not self.legacy_json_writes
+                )
                 if migrated > 0:
-                    print(f"[UserDataManager] ✅ Мигрировано {migrated} пользователей в БД")
+                    logger.info("[UserDataManager] ✅ Мигрировано %d пользователей в БД", migrated)
         except Exception as e:
-            print(f"[UserDataManager] ⚠️ Ошибка миграции: {e}")
+            logger.error("[UserDataManager] ⚠️ Ошибка миграции: %s", e, exc_info=True)
+    
+    @staticmethod
+    def _has_valid_api(data: Dict[str, Any]) -> bool:
+        """Подключены ли API ключи (непустые, не из одних пробелов)"""
+        api_key = data.get('api_key')
+        secret_key = data.get('secret_key')
+        return bool(api_key and secret_key and api_key.strip() and secret_key.strip())
+    
+    @staticmethod
+    def _copy_data(data: Dict[str, Any]) -> Dict[str, Any]:
+        """Копия данных, которую вызывающий код может менять, не затрагивая кэш"""
+        copied = dict(data)
+        if 'trading_pairs' in copied:
+            copied['trading_pairs'] = list(copied['trading_pairs'] or [])
+        if 'demo_positions' in copied:
+            copied['demo_positions'] = [dict(pos) for pos in copied['demo_positions'] or []]
+        return copied
     
     def get_user_data(self, user_id: int) -> Dict[str, Any]:
-        """Получить данные пользователя (из БД или JSON)"""
+        """Получить данные пользователя (из кэша, БД или JSON) с флагом has_valid_api"""
+        with self._cache_lock:
+            cached = self._cache.get(user_id)
+            if cached is not None:
+                return self._copy_data(cached)
+        
+        data = self._load_user_data(user_id)
+        data['has_valid_api'] = self._has_valid_api(data)
+        with self._cache_lock:
+            self._cache[user_id] = self._copy_data(data)
+        return data
+    
+    def prefetch_all(self) -> int:
+        """Заполнить кэш всеми пользователями из БД одним запросом; вернуть их количество"""
+        if not self.use_database:
+            return 0
+        users = self.db.get_all_users()
+        with self._cache_lock:
+            for data in users:
+                data['has_valid_api'] = self._has_valid_api(data)
+                # Уже закэшированные (возможно, более свежие) данные не перезаписываем
+                self._cache.setdefault(data['user_id'], data)
+        return len(users)
+    
+    def invalidate(self, user_id: int):
+        """Сбросить кэш пользователя (если данные изменены в обход менеджера)"""
+        user_file = self._get_user_file(user_id)
+        with self._cache_lock:
+            self._cache.pop(user_id, None)
+            self._position_index.pop(user_id, None)
+            self._last_written.pop(user_id, None)
+            pending = self._dirty.pop(user_file, None)
+        # Иначе следующее чтение JSON увидело бы файл без последних изменений
+        if pending is not None:
+            pending[0]._write_json(user_file, pending[1])
+    
+    def _load_user_data(self, user_id: int) -> Dict[str, Any]:
+        """Прочитать данные пользователя из БД или JSON"""
         if self.use_database:
             user_data = self.db.get_user(user_id)
             if user_data:
@@ -80,8 +195,11 @@ class UserDataManager:
             return default_data
         
         try:
-            with open(user_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
+            if orjson is not None:
+                data = orjson.loads(user_file.read_bytes())
+            else:
+                with open(user_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
             
             # Расшифровываем API ключи
             if 'api_key_encrypted' in data:
@@ -89,48 +207,146 @@ class UserDataManager:
             if 'secret_key_encrypted' in data:
                 data['secret_key'] = self._decrypt(data['secret_key_encrypted'])
             
-            # Мигрируем в БД если используется
-            if self.use_database:
-                self.db.migrate_from_json(user_id, user_file)
+            # Мигрируем в БД если используется (файл уже разобран — не читаем повторно)
+            if self.use_database and self.db.migrate_from_json(user_id, user_file, data):
+                if not self.legacy_json_writes:
+                    # Дальше пользователь читается из БД; переименованный файл не попадёт
+                    # под маску user_*.json, поэтому не будет мигрирован повторно
+                    # (ни здесь, ни в migrate_all_json_files при следующем запуске)
+                    user_file.replace(user_file.with_suffix('.json.migrated'))
             
             return data
         except Exception as e:
-            print(f"Ошибка чтения данных пользователя {user_id}: {e}")
+            logger.error("Ошибка чтения данных пользователя %s: %s", user_id, e, exc_info=True)
             return self._get_default_data()
     
     def save_user_data(self, user_id: int, data: Dict[str, Any]):
-        """Сохранить данные пользователя (в БД и JSON для совместимости)"""
+        """Сохранить данные пользователя (в БД; в JSON — без БД или с legacy_json_writes)"""
+        self._cache_user_data(user_id, data)
+        self._write_through(user_id, data)
+    
+    async def save_user_data_async(self, user_id: int, data: Dict[str, Any]):
+        """То же, что save_user_data, но запись в БД/JSON — в отдельном потоке, не блокируя event loop"""
+        self._cache_user_data(user_id, data)
+        await asyncio.to_thread(self._write_through, user_id, data)
+    
+    def _cache_user_data(self, user_id: int, data: Dict[str, Any]):
+        """Обновить кэш сразу: последующие чтения видят новые данные ещё до записи в БД"""
+        data['has_valid_api'] = self._has_valid_api(data)
+        with self._cache_lock:
+            self._cache[user_id] = self._copy_data(data)
+            self._position_index.pop(user_id, None)
+    
+    def _write_through(self, user_id: int, data: Dict[str, Any]):
+        """Записать данные пользователя в БД (и при необходимости поставить JSON в очередь)"""
+        # Пишем актуальный снимок из кэша: если две фоновые записи выполнятся
+        # не по порядку, последней всё равно окажется самая свежая версия
+        with self._cache_lock:
+            cached = self._cache.get(user_id)
+            data = self._copy_data(cached if cached is not None else data)
+        
+        fingerprint = self._fingerprint(data)
+        if fingerprint is not None and self._last_written.get(user_id) == fingerprint:
+            return
+        
         # Сохраняем в БД если используется
         if self.use_database:
             try:
                 self.db.create_or_update_user(user_id, data)
+                if not self.legacy_json_writes:
+                    self._remember_written(user_id, fingerprint)
+                    return
             except Exception as e:
-                print(f"Ошибка сохранения в БД для пользователя {user_id}: {e}")
+                logger.error("Ошибка сохранения в БД для пользователя %s: %s", user_id, e, exc_info=True)
         
-        # Также сохраняем в JSON для обратной совместимости
-        user_file = self._get_user_file(user_id)
+        # JSON (без БД, при ошибке БД или legacy_json_writes) пишется отложенно (см. flush)
+        with self._cache_lock:
+            self._dirty[self._get_user_file(user_id)] = (self, data)
+        self._remember_written(user_id, fingerprint)
+    
+    @staticmethod
+    def _fingerprint(data: Dict[str, Any]) -> Optional[int]:
+        """Хэш канонической (с сортировкой ключей) сериализации; None — если не сериализуется"""
+        try:
+            if orjson is not None:
+                raw = orjson.dumps(data, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+            else:
+                raw = json.dumps(data, sort_keys=True, default=str).encode()
+        except (TypeError, ValueError):
+            return None
+        return hash(raw)
+    
+    def _remember_written(self, user_id: int, fingerprint: Optional[int]):
+        """Запомнить отпечаток записанных данных"""
+        with self._cache_lock:
+            if fingerprint is None:
+                self._last_written.pop(user_id, None)
+            else:
+                self._last_written[user_id] = fingerprint
+    
+    def _write_json(self, user_file: Path, data_copy: Dict[str, Any]):
+        """
+        Зашифровать API ключи и атомарно записать JSON-файл пользователя
         
-        # Шифруем API ключи перед сохранением
-        data_copy = data.copy()
-        if 'api_key' in data_copy and data_copy['api_key']:
-            data_copy['api_key_encrypted'] = self._encrypt(data_copy['api_key'])
-            del data_copy['api_key']
-        if 'secret_key' in data_copy and data_copy['secret_key']:
-            data_copy['secret_key_encrypted'] = self._encrypt(data_copy['secret_key'])
-            del data_copy['secret_key']
+        data_copy — собственная копия из очереди _dirty (снята в _write_through),
+        поэтому ключи заменяются на месте, без ещё одного копирования словаря.
+        """
+        if data_copy.get('api_key'):
+            data_copy['api_key_encrypted'] = self._encrypt(data_copy.pop('api_key'))
+        if data_copy.get('secret_key'):
+            data_copy['secret_key_encrypted'] = self._encrypt(data_copy.pop('secret_key'))
         
         try:
-            with open(user_file, 'w', encoding='utf-8') as f:
-                json.dump(data_copy, f, indent=2, ensure_ascii=False)
+            # Пишем во временный файл и атомарно подменяем, чтобы не оставить битый JSON
+            tmp_file = user_file.with_suffix('.json.tmp')
+            if orjson is not None:
+                tmp_file.write_bytes(
+                    orjson.dumps(data_copy, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+                )
+            else:
+                with open(tmp_file, 'w', encoding='utf-8') as f:
+                    json.dump(data_copy, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_file, user_file)
         except Exception as e:
-            print(f"Ошибка сохранения данных пользователя {user_id}: {e}")
+            logger.error("Ошибка сохранения данных пользователя (%s): %s", user_file.name, e, exc_info=True)
+    
+    @classmethod
+    def flush(cls):
+        """Записать все отложенные JSON-файлы (вызывать перед остановкой)"""
+        with cls._cache_lock:
+            pending = list(cls._dirty.items())
+            cls._dirty.clear()
+        for user_file, (manager, data) in pending:
+            manager._write_json(user_file, data)
+    
+    @classmethod
+    async def run_flusher(cls, interval: float = JSON_FLUSH_INTERVAL):
+        """Фоновая задача: раз в interval секунд записывает накопленные изменения"""
+        while True:
+            await asyncio.sleep(interval)
+            if cls._dirty:
+                await asyncio.to_thread(cls.flush)
     
     def update_user_setting(self, user_id: int, key: str, value: Any):
         """Обновить настройку пользователя"""
+        self.update_user_settings(user_id, **{key: value})
+    
+    def update_user_settings(self, user_id: int, **settings: Any):
+        """Обновить несколько настроек пользователя за одно чтение и одну запись"""
         data = self.get_user_data(user_id)
-        data[key] = value
+        data.update(settings)
         self.save_user_data(user_id, data)
     
+    async def update_user_setting_async(self, user_id: int, key: str, value: Any):
+        """Асинхронный вариант update_user_setting (для хендлеров и авто-торговли)"""
+        await self.update_user_settings_async(user_id, **{key: value})
+    
+    async def update_user_settings_async(self, user_id: int, **settings: Any):
+        """Асинхронный вариант update_user_settings"""
+        data = self.get_user_data(user_id)
+        data.update(settings)
+        await self.save_user_data_async(user_id, data)
+    
     def _get_default_data(self) -> Dict[str, Any]:
         """Получить данные по умолчанию"""
         from config.settings import (
@@ -147,7 +363,7 @@ class UserDataManager:
             'stop_loss_percent': DEFAULT_STOP_LOSS,
             'leverage': DEFAULT_LEVERAGE,
             'max_open_positions': MAX_OPEN_POSITIONS,
-            'trading_pairs': DEFAULT_PAIRS,
+            'trading_pairs': list(DEFAULT_PAIRS),
             'auto_trading_enabled': False,
             'notifications_enabled': True,
             'demo_balance': 10000.0,
@@ -158,6 +374,23 @@ class UserDataManager:
             'strategy_profile': 'scalp_smc_v2'  # Профиль стратегии (как в pycryptobot: конфиг-профили)
         }
     
+    def _get_position_index(self, user_id: int, positions: List[Dict[str, Any]]) -> Dict[str, int]:
+        """Индекс открытых позиций по символу (строится один раз за O(N), дальше поддерживается)"""
+        with self._cache_lock:
+            index = self._position_index.get(user_id)
+        if index is None:
+            index = {}
+            for i, pos in enumerate(positions):
+                if pos.get('status') == 'open':
+                    index.setdefault(pos.get('symbol'), i)
+        return index
+    
+    def _save_with_position_index(self, user_id: int, data: Dict[str, Any], index: Dict[str, int]):
+        """Сохранить данные, сохранив актуальный индекс открытых позиций"""
+        self.save_user_data(user_id, data)
+        with self._cache_lock:
+            self._position_index[user_id] = index
+    
     def get_demo_positions(self, user_id: int) -> List[Dict[str, Any]]:
         """Получить открытые демо-позиции (из БД или JSON)"""
         if self.use_database:
@@ -190,61 +423,67 @@ class UserDataManager:
         """Сохранить демо-позицию (в БД и JSON)"""
         if self.use_database:
             try:
+                pget = position.get
+                entry = pget('entry')
+                amount = pget('amount')
+                position_value = entry * amount if entry and amount else 0
                 # Проверяем, нет ли уже открытой позиции по этому символу
-                open_trades = self.db.get_open_trades(user_id, symbol=position.get('symbol'))
+                open_trades = self.db.get_open_trades(user_id, symbol=pget('symbol'))
                 if open_trades:
                     # Обновляем существующую
                     trade_id = open_trades[0].get('trade_id')
                     updates = {
-                        'amount': position.get('amount'),
-                        'entry_price': position.get('entry'),
-                        'stop_loss': position.get('stop_loss'),
-                        'take_profit': position.get('take_profit'),
-                        'position_value': position.get('entry', 0) * position.get('amount', 0) if position.get('entry') and position.get('amount') else 0
+                        'amount': amount,
+                        'entry_price': entry,
+                        'stop_loss': pget('stop_loss'),
+                        'take_profit': pget('take_profit'),
+                        'position_value': position_value
                     }
                     self.db.update_trade(trade_id, updates)
                 else:
                     # Создаём новую
                     trade_data = {
-                        'symbol': position.get('symbol'),
-                        'direction': position.get('direction', 'long'),
-                        'amount': position.get('amount', 0),
-                        'entry': position.get('entry', 0),
-                        'stop_loss': position.get('stop_loss'),
-                        'take_profit': position.get('take_profit'),
-                        'leverage': position.get('leverage', 5),
+                        'symbol': pget('symbol'),
+                        'direction': pget('direction', 'long'),
+                        'amount': pget('amount', 0),
+                        'entry': pget('entry', 0),
+                        'stop_loss': pget('stop_loss'),
+                        'take_profit': pget('take_profit'),
+                        'leverage': pget('leverage', 5),
                         'is_demo': True,
-                        'position_value': position.get('entry', 0) * position.get('amount', 0) if position.get('entry') and position.get('amount') else 0,
-                        'probability': position.get('probability'),
-                        'quality_score': position.get('quality_score'),
-                        'signal_strength': position.get('signal_strength'),
-                        'scale_factor': position.get('scale_factor'),
-                        'order_id': position.get('order_id')
+                        'position_value': position_value,
+                        'probability': pget('probability'),
+                        'quality_score': pget('quality_score'),
+                        'signal_strength': pget('signal_strength'),
+                        'scale_factor': pget('scale_factor'),
+                        'order_id': pget('order_id')
                     }
                     self.db.create_trade(user_id, trade_data)
+                if not self.legacy_json_writes:
+                    return
             except Exception as e:
-                print(f"Ошибка сохранения позиции в БД: {e}")
+                logger.error("Ошибка сохранения позиции в БД: %s", e, exc_info=True)
         
-        # Также сохраняем в JSON для совместимости
+        # JSON: без БД, при ошибке БД или с legacy_json_writes
         data = self.get_user_data(user_id)
         if 'demo_positions' not in data:
             data['demo_positions'] = []
         
         symbol = position.get('symbol')
-        existing_idx = None
-        for i, pos in enumerate(data['demo_positions']):
-            if pos.get('symbol') == symbol and pos.get('status') == 'open':
-                existing_idx = i
-                break
+        index = self._get_position_index(user_id, data['demo_positions'])
+        existing_idx = index.get(symbol)
         
         if existing_idx is not None:
             data['demo_positions'][existing_idx].update(position)
+            if data['demo_positions'][existing_idx].get('status') != 'open':
+                del index[symbol]
         else:
             position['timestamp'] = position.get('timestamp', datetime.now().isoformat())
             position['status'] = 'open'
+            index[symbol] = len(data['demo_positions'])
             data['demo_positions'].append(position)
         
-        self.save_user_data(user_id, data)
+        self._save_with_position_index(user_id, data, index)
     
     def update_demo_position(self, user_id: int, symbol: str, updates: Dict[str, Any]):
         """Обновить демо-позицию (например, при закрытии)"""
@@ -276,23 +515,33 @@ class UserDataManager:
                         
                         if db_updates:
                             self.db.update_trade(trade_id, db_updates)
+                if not self.legacy_json_writes:
+                    return
             except Exception as e:
-                print(f"Ошибка обновления позиции в БД: {e}")
+                logger.error("Ошибка обновления позиции в БД: %s", e, exc_info=True)
         
-        # Также обновляем в JSON
+        # JSON: без БД, при ошибке БД или с legacy_json_writes
         data = self.get_user_data(user_id)
         demo_positions = data.get('demo_positions', [])
+        index = self._get_position_index(user_id, demo_positions)
         
-        for pos in demo_positions:
-            if pos.get('symbol') == symbol and pos.get('status') == 'open':
-                pos.update(updates)
-                break
+        existing_idx = index.get(symbol)
+        if existing_idx is not None:
+            pos = demo_positions[existing_idx]
+            pos.update(updates)
+            if pos.get('status') != 'open' or pos.get('symbol') != symbol:
+                # Позиция закрыта: символ снова свободен для новой позиции
+                del index[symbol]
         
         data['demo_positions'] = demo_positions
-        self.save_user_data(user_id, data)
+        self._save_with_position_index(user_id, data, index)
     
     def update_demo_balance(self, user_id: int, new_balance: float):
         """Обновить демо-баланс"""
         data = self.get_user_data(user_id)
         data['demo_balance'] = new_balance
         self.save_user_data(user_id, data)
+
+
+# Скрипты без event loop (анализ и т.п.) не запускают run_flusher — дописываем при выходе
+atexit.register(UserDataManager.flush)
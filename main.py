@@ -1,6 +1,12 @@
 import asyncio
 import logging
-import socket
+from typing import Optional
+try:
+    # uvloop — более быстрый event loop (нет под Windows)
+    import uvloop
+except ImportError:
+    # uvloop не установлен — используем стандартный цикл asyncio
+    uvloop = None
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
 from config.settings import BOT_TOKEN, TELEGRAM_PROXY
@@ -12,6 +18,7 @@ from bot.handlers import (
     help_router
 )
 from bot.handlers.trading import auto_trading_manager
+from data.user_data import UserDataManager
 
 # Настройка логирования
 logging.basicConfig(
@@ -21,16 +28,25 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def check_internet_connection():
-    """Проверяет доступность интернета"""
+# Результат проверки соединения (на время жизни процесса)
+_internet_available: Optional[bool] = None
+
+
+async def check_internet_connection() -> bool:
+    """Проверяет доступность интернета (результат запоминается)"""
+    global _internet_available
+    if _internet_available is not None:
+        return _internet_available
     try:
         # Проверяем доступность интернета через подключение к публичному IP
-        socket.create_connection(("8.8.8.8", 53), timeout=3)
+        _, writer = await asyncio.wait_for(asyncio.open_connection("8.8.8.8", 53), timeout=1.0)
+        writer.close()
         logger.info("✓ Интернет-соединение доступно")
-        return True
-    except OSError:
+        _internet_available = True
+    except (OSError, asyncio.TimeoutError):
         logger.error("✗ Нет интернет-соединения")
-        return False
+        _internet_available = False
+    return _internet_available
 
 
 async def main():
@@ -50,12 +66,17 @@ async def main():
         migrated = db.migrate_all_json_files("data")
         if migrated > 0:
             logger.info(f"✅ Мигрировано {migrated} пользователей из JSON в БД")
+        
+        # Прогреваем кэш данных пользователей: первое сообщение не ждёт запроса к БД
+        cached = UserDataManager().prefetch_all()
+        logger.info(f"✅ Загружено в кэш пользователей: {cached}")
     except Exception as e:
         logger.warning(f"⚠️ БД недоступна, используется JSON: {e}")
     
-    # Проверяем соединение перед запуском
-    logger.info("Проверка интернет-соединения...")
-    if not check_internet_connection():
+    # Проверяем соединение перед запуском (через прокси прямой доступ не нужен)
+    if TELEGRAM_PROXY:
+        logger.info("Прокси задан — проверка интернет-соединения пропущена")
+    elif not await check_internet_connection():
         logger.error(
             "\n❌ Проблемы с интернет-соединением!\n\n"
             "Попробуйте:\n"
@@ -85,6 +106,9 @@ async def main():
     dp.include_router(settings_router)
     dp.include_router(help_router)
     
+    # Фоновая запись JSON-копий данных пользователей (изменения схлопываются)
+    json_flusher = asyncio.create_task(UserDataManager.run_flusher())
+    
     logger.info("Бот запущен и готов к работе!")
     
     # Запуск polling
@@ -108,11 +132,20 @@ async def main():
         else:
             logger.error(f"Ошибка при запуске бота: {error_msg}")
     finally:
+        json_flusher.cancel()
+        UserDataManager.flush()
+        from services.bingx_api import close_shared_session
+        await close_shared_session()
+        from data.database import close_database
+        close_database()
         await bot.session.close()
 
 
 if __name__ == "__main__":
     try:
-        asyncio.run(main())
+        if uvloop is not None:
+            uvloop.run(main())
+        else:
+            asyncio.run(main())
     except KeyboardInterrupt:
         logger.info("Бот остановлен пользователем")
@@ -1,7 +1,175 @@
-import pandas as pd
+import copy
+import functools
+import threading
 import numpy as np
-from typing import Dict, List, Optional, Any, Tuple
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Any, Tuple, Union
 from services.candle_analysis import CandleAnalyzer
+try:
+    from numba import njit
+    _HAS_NUMBA = True
+except ImportError:
+    # numba не установлен — функции выполняются как обычный Python
+    _HAS_NUMBA = False
+    
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+        return lambda func: func
+
+# Свечи: список списков от биржи или уже готовый массив (N, 6)
+OHLCV = Union[List[List], np.ndarray]
+
+# Сколько последних результатов comprehensive_analysis держать в кэше анализатора
+_ANALYSIS_CACHE_MAXSIZE = 128
+
+
+class _MarketContext:
+    """
+    Свечи по колонкам (timestamp, open, high, low, close, volume) и общие статистики.
+    Строится один раз на анализ и передаётся во все детекторы вместо списка свечей
+    """
+    
+    def __init__(self, ohlcv: OHLCV):
+        candles = np.asarray(ohlcv, dtype=np.float64).reshape(-1, 6)
+        self.candles = candles
+        self.ts, self.open, self.high, self.low, self.close, self.volume = candles.T
+    
+    @classmethod
+    def of(cls, ohlcv: Union[OHLCV, '_MarketContext']) -> '_MarketContext':
+        """Контекст для свечей (готовый контекст возвращается как есть)"""
+        return ohlcv if isinstance(ohlcv, cls) else cls(ohlcv)
+    
+    def __len__(self) -> int:
+        return len(self.candles)
+    
+    @functools.cached_property
+    def price_min(self) -> float:
+        return float(self.low.min())
+    
+    @functools.cached_property
+    def price_max(self) -> float:
+        return float(self.high.max())
+    
+    @functools.cached_property
+    def avg_volume_20(self) -> float:
+        """Средний объём последних 20 свечей"""
+        return float(self.volume[-20:].mean())
+    
+    @functools.cached_property
+    def last_close(self) -> float:
+        return float(self.close[-1])
+
+
+# Свечи на входе детекторов: сырые OHLCV или уже построенный контекст
+Candles = Union[OHLCV, _MarketContext]
+
+
+def _book_volume(levels: List) -> float:
+    """Суммарный объём уровней стакана [[цена, объём], ...] (числа или строки, как отдаёт BingX)"""
+    return float(np.asarray(levels, dtype=np.float64)[:, 1].sum())
+
+
+@dataclass(frozen=True)
+class VolumeProfile:
+    """Профиль объёма: цены уровней (по возрастанию) и суммарный объём на каждом уровне"""
+    levels: np.ndarray
+    volumes: np.ndarray
+    
+    @property
+    def poc_index(self) -> int:
+        """Индекс уровня с максимальным объёмом (POC)"""
+        return int(self.volumes.argmax())
+    
+    def as_dict(self) -> Dict[float, float]:
+        """Профиль в виде {цена уровня: объём}"""
+        return dict(zip(self.levels.tolist(), self.volumes.tolist()))
+
+
+@dataclass(frozen=True)
+class ZoneColumns:
+    """
+    Найденные зоны (IMB/FVG) по колонкам: поле -> массив значений, по строке на зону.
+    Словари зон строятся только на выходе (to_dicts/row), внутри анализа работают массивы
+    """
+    fields: Dict[str, np.ndarray]
+    
+    def __len__(self) -> int:
+        return len(self.fields['timestamp'])
+    
+    def select(self, rows: np.ndarray) -> 'ZoneColumns':
+        """Подмножество зон по маске или индексам"""
+        return ZoneColumns({name: values[rows] for name, values in self.fields.items()})
+    
+    def concat(self, other: 'ZoneColumns') -> 'ZoneColumns':
+        return ZoneColumns({name: np.concatenate((values, other.fields[name])) for name, values in self.fields.items()})
+    
+    def row(self, i: int) -> Dict[str, Any]:
+        """Одна зона в виде словаря"""
+        return {name: values[i].item() for name, values in self.fields.items()}
+    
+    def to_dicts(self, start: int = 0) -> List[Dict[str, Any]]:
+        """Зоны начиная с позиции start (отрицательная — с конца) в виде списка словарей"""
+        names = list(self.fields)
+        columns = [values[start:].tolist() for values in self.fields.values()]
+        return [dict(zip(names, values)) for values in zip(*columns)]
+
+
+@njit(cache=True)
+def _find_pivots_loop(prices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Индексы локальных минимумов и максимумов цены (строгое сравнение с соседями)"""
+    n = len(prices)
+    low_idx = np.empty(n, dtype=np.int64)
+    high_idx = np.empty(n, dtype=np.int64)
+    lows = 0
+    highs = 0
+    for i in range(1, n - 1):
+        if prices[i] < prices[i - 1] and prices[i] < prices[i + 1]:
+            low_idx[lows] = i
+            lows += 1
+        if prices[i] > prices[i - 1] and prices[i] > prices[i + 1]:
+            high_idx[highs] = i
+            highs += 1
+    return low_idx[:lows], high_idx[:highs]
+
+
+def _find_pivots_numpy(prices: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """То же сравнение с соседями масками по всему массиву (без numba)"""
+    mid, prev, nxt = prices[1:-1], prices[:-2], prices[2:]
+    low_idx = np.flatnonzero((mid < prev) & (mid < nxt)) + 1
+    high_idx = np.flatnonzero((mid > prev) & (mid > nxt)) + 1
+    return low_idx, high_idx
+
+
+# Скомпилированный цикл быстрее на коротких окнах; без numba — векторная версия
+_find_pivots = _find_pivots_loop if _HAS_NUMBA else _find_pivots_numpy
+
+
+@njit(cache=True)
+def _first_tests_loop(zone_lo: np.ndarray, zone_hi: np.ndarray, open_: np.ndarray,
+                      close: np.ndarray, strong: np.ndarray) -> np.ndarray:
+    """Для каждой зоны — индекс первой свечи с сильным объёмом, у которой close или open внутри зоны (-1, если нет)"""
+    first = np.full(len(zone_lo), -1, dtype=np.int64)
+    for z in range(len(zone_lo)):
+        lo = zone_lo[z]
+        hi = zone_hi[z]
+        for i in range(len(close)):
+            if strong[i] and (lo <= close[i] <= hi or lo <= open_[i] <= hi):
+                first[z] = i
+                break
+    return first
+
+
+def _first_tests_numpy(zone_lo: np.ndarray, zone_hi: np.ndarray, open_: np.ndarray,
+                       close: np.ndarray, strong: np.ndarray) -> np.ndarray:
+    """То же через маску (зоны x свечи) без numba"""
+    lo, hi = zone_lo[:, None], zone_hi[:, None]
+    hits = (((close >= lo) & (close <= hi)) | ((open_ >= lo) & (open_ <= hi))) & strong
+    return np.where(hits.any(axis=1), hits.argmax(axis=1), -1)
+
+
+# Цикл с выходом на первом попадании не считает лишнего; без numba — маска целиком
+_first_tests = _first_tests_loop if _HAS_NUMBA else _first_tests_numpy
 
 
 class AdvancedMarketAnalyzer:
@@ -9,178 +177,272 @@ class AdvancedMarketAnalyzer:
     
     def __init__(self):
         self.candle_analyzer = CandleAnalyzer()
+        # Результаты comprehensive_analysis по ключу входных данных (dict сохраняет порядок вставки)
+        self._analysis_cache: Dict[Tuple, Dict[str, Any]] = {}
+        # Зоны IMB/FVG по закрытым свечам: (вид, символ, интервал) -> (начало окна, timestamp последней зоны, зоны).
+        # Свечи одного символа и интервала одинаковы для всех пользователей, поэтому на общем
+        # анализаторе (get_shared_analyzer) следующий вызов досканирует только новые свечи
+        self._scan_cache: Dict[Tuple, Tuple[float, float, ZoneColumns]] = {}
+        # Буфер под массив свечей: свой на поток. Анализ идёт в потоках asyncio.to_thread,
+        # они долгоживущие — на общем анализаторе буфер переиспользуется между вызовами
+        self._buffers = threading.local()
+        # Защищает вытеснение из кэшей при анализе из нескольких потоков
+        self._cache_lock = threading.Lock()
+    
+    def _candles_buffer(self, ohlcv: OHLCV) -> np.ndarray:
+        """
+        Свечи в переиспользуемом массиве (N, 6): окно обычно фиксированной длины,
+        поэтому на установившемся потоке данных массив не выделяется заново
+        """
+        if isinstance(ohlcv, np.ndarray) or not len(ohlcv):
+            return np.asarray(ohlcv, dtype=np.float64)
+        buf = getattr(self._buffers, 'candles', None)
+        if buf is None or buf.shape[0] != len(ohlcv):
+            buf = self._buffers.candles = np.empty((len(ohlcv), 6), dtype=np.float64)
+        buf[:] = ohlcv
+        return buf
     
-    def find_imbalance(self, ohlcv: List[List], timeframe: str = '1h') -> List[Dict[str, Any]]:
+    @staticmethod
+    def _analysis_key(ohlcv: OHLCV, orderbook: Optional[Dict]) -> Tuple:
+        """
+        Ключ кэша анализа: окно свечей (длина, первая метка времени, последняя свеча целиком —
+        она ещё формируется и меняется внутри своего интервала) и первые 50 уровней стакана
+        """
+        first, last = ohlcv[0], ohlcv[-1]
+        book = None
+        if orderbook:
+            book = (
+                tuple(tuple(level) for level in orderbook.get('bids', [])[:50]),
+                tuple(tuple(level) for level in orderbook.get('asks', [])[:50]),
+            )
+        return (len(ohlcv), float(first[0]), tuple(float(v) for v in last), book)
+    
+    def find_imbalance(self, ohlcv: Candles, timeframe: str = '1h',
+                       symbol: Optional[str] = None) -> List[Dict[str, Any]]:
         """
         Находит IMB (Imbalance) - зоны несбалансированного объёма (gap в цене)
         
+        Если передан symbol, зоны по закрытым свечам запоминаются и при следующем вызове
+        пересчитываются только новые свечи
+        
         Returns список найденных IMB зон
         """
-        if len(ohlcv) < 3:
-            return []
-        
-        df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-        imbalances = []
-        
-        for i in range(1, len(df)):
-            prev_candle = df.iloc[i-1]
-            curr_candle = df.iloc[i]
-            
-            # Бычий IMB (gap вверх)
-            if curr_candle['low'] > prev_candle['high']:
-                imbalance = {
-                    'type': 'bullish_imb',
-                    'zone_start': prev_candle['high'],
-                    'zone_end': curr_candle['low'],
-                    'timestamp': curr_candle['timestamp'],
-                    'strength': 'strong' if (curr_candle['low'] - prev_candle['high']) > (prev_candle['high'] * 0.002) else 'weak',
-                    'direction': 'long'
-                }
-                imbalances.append(imbalance)
-            
-            # Медвежий IMB (gap вниз)
-            elif curr_candle['high'] < prev_candle['low']:
-                imbalance = {
-                    'type': 'bearish_imb',
-                    'zone_start': curr_candle['high'],
-                    'zone_end': prev_candle['low'],
-                    'timestamp': curr_candle['timestamp'],
-                    'strength': 'strong' if (prev_candle['low'] - curr_candle['high']) > (prev_candle['low'] * 0.002) else 'weak',
-                    'direction': 'short'
-                }
-                imbalances.append(imbalance)
-        
-        return imbalances
-    
-    def find_fvg(self, ohlcv: List[List]) -> List[Dict[str, Any]]:
+        return self._imbalance_columns(_MarketContext.of(ohlcv), symbol).to_dicts()
+    
+    def _imbalance_columns(self, ctx: '_MarketContext', symbol: Optional[str]) -> ZoneColumns:
+        if len(ctx) < 3:
+            return self._scan_imbalances(ctx.candles[:0])
+        if symbol is None:
+            return self._scan_imbalances(ctx.candles)
+        return self._scan_incremental(('imb', symbol), ctx, self._scan_imbalances, lookahead=0)
+    
+    @staticmethod
+    def _scan_imbalances(candles: np.ndarray) -> ZoneColumns:
+        """IMB по всем парам соседних свечей массива"""
+        ts, high, low = candles[:, 0], candles[:, 2], candles[:, 3]
+        prev_high, prev_low = high[:-1], low[:-1]
+        curr_high, curr_low = high[1:], low[1:]
+        
+        # Бычий IMB (gap вверх) / медвежий IMB (gap вниз) — маски по всем парам свечей сразу
+        bull = curr_low > prev_high
+        bear = ~bull & (curr_high < prev_low)
+        idx = np.flatnonzero(bull | bear)
+        bull, prev_high, prev_low = bull[idx], prev_high[idx], prev_low[idx]
+        curr_high, curr_low = curr_high[idx], curr_low[idx]
+        
+        # Все поля зоны считаются без ветвлений: бычья берёт свои границы/порог силы, медвежья — свои
+        zone_start = np.where(bull, prev_high, curr_high)
+        zone_end = np.where(bull, curr_low, prev_low)
+        strong = np.where(bull, zone_end - zone_start > prev_high * 0.002, zone_end - zone_start > prev_low * 0.002)
+        
+        return ZoneColumns({
+            'type': np.where(bull, 'bullish_imb', 'bearish_imb'),
+            'zone_start': zone_start,
+            'zone_end': zone_end,
+            'timestamp': ts[1:][idx],
+            'strength': np.where(strong, 'strong', 'weak'),
+            'direction': np.where(bull, 'long', 'short')
+        })
+    
+    def find_fvg(self, ohlcv: Candles, symbol: Optional[str] = None) -> List[Dict[str, Any]]:
         """
         Находит FVG (Fair Value Gap) - gap в цене для отката
         
+        Если передан symbol, работает инкрементально, как find_imbalance
+        
         Returns список найденных FVG зон
         """
-        if len(ohlcv) < 3:
-            return []
-        
-        df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-        fvgs = []
+        return self._fvg_columns(_MarketContext.of(ohlcv), symbol).to_dicts()
+    
+    def _fvg_columns(self, ctx: '_MarketContext', symbol: Optional[str]) -> ZoneColumns:
+        if len(ctx) < 3:
+            return self._scan_fvgs(ctx.candles[:0])
+        if symbol is None:
+            return self._scan_fvgs(ctx.candles)
+        return self._scan_incremental(('fvg', symbol), ctx, self._scan_fvgs, lookahead=1)
+    
+    @staticmethod
+    def _scan_fvgs(candles: np.ndarray) -> ZoneColumns:
+        """FVG по всем тройкам соседних свечей массива"""
+        ts, high, low = candles[:, 0], candles[:, 2], candles[:, 3]
+        # Тройки свечей (prev, curr, next) как сдвинутые срезы
+        prev_high, prev_low = high[:-2], low[:-2]
+        curr_high, curr_low = high[1:-1], low[1:-1]
+        next_high, next_low = high[2:], low[2:]
+        
+        # Бычий FVG (gap между свечами для отката вверх) / медвежий (для отката вниз)
+        bull = (curr_low > prev_high) & (next_low > prev_high)
+        bear = ~bull & (curr_high < prev_low) & (next_high < prev_low)
+        idx = np.flatnonzero(bull | bear)
+        bull = bull[idx]
+        
+        zone_start = np.where(bull, prev_high[idx], np.maximum(curr_high[idx], next_high[idx]))
+        zone_end = np.where(bull, np.minimum(curr_low[idx], next_low[idx]), prev_low[idx])
+        
+        return ZoneColumns({
+            'type': np.where(bull, 'bullish_fvg', 'bearish_fvg'),
+            'zone_start': zone_start,
+            'zone_end': zone_end,
+            'timestamp': ts[1:-1][idx],
+            'mid_point': (zone_start + zone_end) / 2,
+            'direction': np.where(bull, 'long', 'short'),
+            'expectation': np.full(len(idx), 'pullback_test')
+        })
+    
+    def _scan_incremental(self, key: Tuple, ctx: '_MarketContext', scan, lookahead: int) -> ZoneColumns:
+        """
+        Инкрементальный поиск зон по скользящему окну свечей одного символа.
         
-        for i in range(1, len(df) - 1):
-            prev_candle = df.iloc[i-1]
-            curr_candle = df.iloc[i]
-            next_candle = df.iloc[i+1]
-            
-            # Бычий FVG (gap между свечами для отката вверх)
-            if (curr_candle['low'] > prev_candle['high'] and 
-                next_candle['low'] > prev_candle['high']):
-                fvg = {
-                    'type': 'bullish_fvg',
-                    'zone_start': prev_candle['high'],
-                    'zone_end': min(curr_candle['low'], next_candle['low']),
-                    'timestamp': curr_candle['timestamp'],
-                    'mid_point': (prev_candle['high'] + min(curr_candle['low'], next_candle['low'])) / 2,
-                    'direction': 'long',
-                    'expectation': 'pullback_test'
-                }
-                fvgs.append(fvg)
-            
-            # Медвежий FVG (gap между свечами для отката вниз)
-            elif (curr_candle['high'] < prev_candle['low'] and 
-                  next_candle['high'] < prev_candle['low']):
-                fvg = {
-                    'type': 'bearish_fvg',
-                    'zone_start': max(curr_candle['high'], next_candle['high']),
-                    'zone_end': prev_candle['low'],
-                    'timestamp': curr_candle['timestamp'],
-                    'mid_point': (max(curr_candle['high'], next_candle['high']) + prev_candle['low']) / 2,
-                    'direction': 'short',
-                    'expectation': 'pullback_test'
-                }
-                fvgs.append(fvg)
-        
-        return fvgs
-    
-    def find_stb_zones(self, ohlcv: List[List], imbalance_zones: List[Dict]) -> List[Dict[str, Any]]:
+        Зона привязана к свече timestamp и зависит от предыдущей свечи и `lookahead` следующих.
+        Последняя свеча окна ещё формируется, поэтому запоминаются только зоны, все свечи которых
+        закрыты; при следующем вызове сканируется хвост окна начиная с последней такой свечи,
+        а зоны, выпавшие из окна, отбрасываются. Если новое окно начинается раньше
+        закэшированного (запрошено больше свечей), выполняется полный поиск
+        """
+        ts = ctx.ts
+        # Ключ включает интервал свечей: у одного символа анализируются разные таймфреймы
+        key = key + (float(ts[1] - ts[0]),)
+        cached = self._scan_cache.get(key)
+        
+        # Первая свеча окна не имеет предыдущей — зоны на ней и раньше уже не в окне
+        first_ts = float(ts[1])
+        start = None
+        if cached is not None:
+            cached_first_ts, stable_ts, stable_zones = cached
+            # Закэшированные зоны покрывают окно только начиная с cached_first_ts
+            if cached_first_ts <= first_ts:
+                pos = int(np.searchsorted(ts, stable_ts))
+                if pos < len(ts) and ts[pos] == stable_ts:
+                    start = pos
+        
+        if start is None:
+            zones = scan(ctx.candles)
+        else:
+            zones = stable_zones.select(stable_zones.fields['timestamp'] >= first_ts)
+            zones = zones.concat(scan(ctx.candles[start:]))
+        
+        # Последняя зона, у которой все свечи закрыты
+        last_stable = len(ts) - 2 - lookahead
+        if last_stable >= 1:
+            stable_ts = float(ts[last_stable])
+            stable_zones = zones.select(zones.fields['timestamp'] <= stable_ts)
+            with self._cache_lock:
+                if len(self._scan_cache) >= _ANALYSIS_CACHE_MAXSIZE and key not in self._scan_cache:
+                    self._scan_cache.pop(next(iter(self._scan_cache)))
+                self._scan_cache[key] = (first_ts, stable_ts, stable_zones)
+        return zones
+    
+    def find_stb_zones(self, ohlcv: Candles, imbalance_zones: Union[List[Dict], ZoneColumns]) -> List[Dict[str, Any]]:
         """
         Находит STB-зоны (Strong to Break) - зоны прорыва с имбалансом
         """
-        if len(ohlcv) < 5:
+        # Меньше 20 свечей — объём считается средним (ratio = 1.0), прорывов нет
+        if len(ohlcv) < 20 or not imbalance_zones:
             return []
         
-        df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-        stb_zones = []
+        ctx = _MarketContext.of(ohlcv)
+        ts, open_, close = ctx.ts, ctx.open, ctx.close
+        volume_ratio = ctx.volume / ctx.avg_volume_20
+        strong = volume_ratio > 1.5  # Объём выше среднего
         
-        # Ищем зоны, где цена сильно отклонилась от IMB
-        for imb in imbalance_zones:
-            # Находим свечи рядом с IMB зоной
-            zone_start = min(imb['zone_start'], imb['zone_end'])
-            zone_end = max(imb['zone_start'], imb['zone_end'])
-            
-            # Ищем свечи, которые тестируют эту зону
-            for i in range(len(df)):
-                candle = df.iloc[i]
-                if zone_start <= candle['close'] <= zone_end or zone_start <= candle['open'] <= zone_end:
-                    # Проверяем силу прорыва
-                    volume_ratio = candle['volume'] / df['volume'].tail(20).mean() if len(df) >= 20 else 1.0
-                    
-                    if volume_ratio > 1.5:  # Объём выше среднего
-                        stb = {
-                            'type': 'stb_zone',
-                            'imb_zone': imb,
-                            'test_price': candle['close'],
-                            'volume_ratio': volume_ratio,
-                            'timestamp': candle['timestamp'],
-                            'direction': imb['direction'],
-                            'signal': 'strong'
-                        }
-                        stb_zones.append(stb)
-                        break
+        # Границы всех IMB зон (из колонок — без обхода словарей)
+        if isinstance(imbalance_zones, ZoneColumns):
+            starts, ends = imbalance_zones.fields['zone_start'], imbalance_zones.fields['zone_end']
+            zone_at = imbalance_zones.row
+        else:
+            starts = np.array([imb['zone_start'] for imb in imbalance_zones], dtype=np.float64)
+            ends = np.array([imb['zone_end'] for imb in imbalance_zones], dtype=np.float64)
+            zone_at = imbalance_zones.__getitem__
+        
+        # Первая свеча, которая тестирует зону (close или open внутри) с сильным объёмом
+        first = _first_tests(np.minimum(starts, ends), np.maximum(starts, ends), open_, close, strong)
+        
+        stb_zones = []
+        for z in np.flatnonzero(first >= 0).tolist():
+            imb, i = zone_at(z), first[z]
+            stb_zones.append({
+                'type': 'stb_zone',
+                'imb_zone': imb,
+                'test_price': float(close[i]),
+                'volume_ratio': float(volume_ratio[i]),
+                'timestamp': float(ts[i]),
+                'direction': imb['direction'],
+                'signal': 'strong'
+            })
         
         return stb_zones
     
-    def analyze_liquidity_pools(self, ohlcv: List[List], orderbook: Optional[Dict] = None) -> Dict[str, Any]:
+    def analyze_liquidity_pools(self, ohlcv: Candles, orderbook: Optional[Dict] = None) -> Dict[str, Any]:
         """
         Анализирует пулы ликвидности - крупные скопления ордеров
         """
         if len(ohlcv) < 10:
             return {}
         
-        df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+        ctx = _MarketContext.of(ohlcv)
+        low, volume = ctx.low, ctx.volume
         
         # Находим уровни с наибольшим объёмом (Volume Profile)
-        volume_profile = {}
-        price_range = df['high'].max() - df['low'].min()
+        low_min = ctx.price_min
+        price_range = ctx.price_max - low_min
         num_levels = 20
         level_size = price_range / num_levels
         
-        for _, candle in df.iterrows():
-            price_start = df['low'].min() + int((candle['low'] - df['low'].min()) / level_size) * level_size
-            price_start = round(price_start, 2)
-            
-            if price_start not in volume_profile:
-                volume_profile[price_start] = 0
-            volume_profile[price_start] += candle['volume']
+        # Номер уровня для каждой свечи и суммарный объём по уровням одним проходом
+        if level_size > 0:
+            bins = ((low - low_min) / level_size).astype(np.int64)
+        else:
+            bins = np.zeros(len(low), dtype=np.int64)
+        level_volumes = np.bincount(bins, weights=volume)
+        occupied = np.flatnonzero(np.bincount(bins))
+        
+        # Уровни храним по целому номеру; в цену (начало уровня) переводим только для результата
+        levels = low_min + occupied * level_size
+        volume_profile = VolumeProfile(levels, level_volumes[occupied])
+        volumes = volume_profile.volumes
         
         # Находим POC (Point of Control) - уровень с максимальным объёмом
-        if volume_profile:
-            poc_level = max(volume_profile, key=volume_profile.get)
-            poc_volume = volume_profile[poc_level]
-            
-            # Находим HVN (High Volume Nodes) - уровни с высоким объёмом
-            avg_volume = sum(volume_profile.values()) / len(volume_profile)
-            hvn_levels = [level for level, vol in volume_profile.items() if vol > avg_volume * 1.5]
-            
-            # LVN (Low Volume Nodes) - уровни с низким объёмом
-            lvn_levels = [level for level, vol in volume_profile.items() if vol < avg_volume * 0.5]
-            
-        pool_analysis = self._analyze_pool_position(df['close'].iloc[-1], poc_level, hvn_levels, lvn_levels)
+        poc_index = volume_profile.poc_index
+        poc_level = float(levels[poc_index])
+        poc_volume = float(volumes[poc_index])
+        
+        # Находим HVN (High Volume Nodes) - уровни с высоким объёмом
+        avg_volume = volumes.mean()
+        hvn_levels = levels[volumes > avg_volume * 1.5].tolist()
+        
+        # LVN (Low Volume Nodes) - уровни с низким объёмом
+        lvn_levels = levels[volumes < avg_volume * 0.5].tolist()
+        
+        current_price = ctx.last_close
+        pool_analysis = self._analyze_pool_position(current_price, poc_level, hvn_levels, lvn_levels)
         
         return {
             'poc': poc_level,
             'poc_volume': poc_volume,
-            'hvn_levels': sorted(hvn_levels),
-            'lvn_levels': sorted(lvn_levels),
+            'hvn_levels': hvn_levels,
+            'lvn_levels': lvn_levels,
             'volume_profile': volume_profile,
-            'current_price': df['close'].iloc[-1],
+            'current_price': current_price,
             'analysis': pool_analysis,
             'nearest_pool_below': pool_analysis.get('nearest_pool_below'),
             'nearest_pool_above': pool_analysis.get('nearest_pool_above')
@@ -188,14 +450,13 @@ class AdvancedMarketAnalyzer:
     
     def _analyze_pool_position(self, current_price: float, poc: float, hvn: List[float], lvn: List[float]) -> Dict[str, Any]:
         """Анализирует позицию цены относительно пулов ликвидности"""
-        # Определяем ближайшие уровни
-        all_levels = sorted([poc] + hvn + lvn)
-        
-        below_levels = [l for l in all_levels if l < current_price]
-        above_levels = [l for l in all_levels if l > current_price]
+        # Определяем ближайшие уровни: бинарный поиск цены в отсортированных уровнях
+        all_levels = np.sort(np.array([poc] + hvn + lvn, dtype=np.float64))
+        below = int(np.searchsorted(all_levels, current_price, side='left'))
+        above = int(np.searchsorted(all_levels, current_price, side='right'))
         
-        nearest_below = max(below_levels) if below_levels else None
-        nearest_above = min(above_levels) if above_levels else None
+        nearest_below = float(all_levels[below - 1]) if below > 0 else None
+        nearest_above = float(all_levels[above]) if above < len(all_levels) else None
         
         return {
             'position': 'above_poc' if current_price > poc else 'below_poc' if current_price < poc else 'at_poc',
@@ -204,54 +465,51 @@ class AdvancedMarketAnalyzer:
             'distance_to_poc': abs(current_price - poc) / poc * 100 if poc > 0 else 0
         }
     
-    def detect_liquidity_sweeps(self, ohlcv: List[List], orderbook: Optional[Dict] = None) -> List[Dict[str, Any]]:
+    def detect_liquidity_sweeps(self, ohlcv: Candles, orderbook: Optional[Dict] = None) -> List[Dict[str, Any]]:
         """
         Обнаруживает манипуляции с ликвидностью - свипы лоев/хаев (сбор стопов)
         """
         if len(ohlcv) < 5:
             return []
         
-        df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-        sweeps = []
-        
         # Анализируем последние 10 свечей
-        recent_candles = df.tail(10)
+        recent = _MarketContext.of(ohlcv).candles[-10:]
+        ts, open_, high, low, close = (recent[1:, col] for col in range(5))
+        prev_high, prev_low, prev_close = recent[:-1, 2], recent[:-1, 3], recent[:-1, 4]
         
-        for i in range(1, len(recent_candles)):
-            prev_candle = recent_candles.iloc[i-1]
-            curr_candle = recent_candles.iloc[i]
-            
-            # Свип лоев (sweep lows) - цена пробила минимум, но отскочила вверх
-            if (curr_candle['low'] < prev_candle['low'] and 
-                curr_candle['close'] > prev_candle['close'] and
-                curr_candle['close'] > curr_candle['open']):
-                sweep = {
+        # Свип лоев (sweep lows) - цена пробила минимум, но отскочила вверх
+        sweep_lows = (low < prev_low) & (close > prev_close) & (close > open_)
+        # Свип хаев (sweep highs) - цена пробила максимум, но отскочила вниз
+        sweep_highs = ~sweep_lows & (high > prev_high) & (close < prev_close) & (close < open_)
+        
+        idx = np.flatnonzero(sweep_lows | sweep_highs)
+        sweeps = []
+        for is_low, t, h, l, c in zip(
+            sweep_lows[idx].tolist(), ts[idx].tolist(), high[idx].tolist(),
+            low[idx].tolist(), close[idx].tolist()
+        ):
+            if is_low:
+                sweeps.append({
                     'type': 'liquidity_sweep_lows',
-                    'sweep_price': curr_candle['low'],
-                    'reaction_price': curr_candle['close'],
-                    'timestamp': curr_candle['timestamp'],
+                    'sweep_price': l,
+                    'reaction_price': c,
+                    'timestamp': t,
                     'direction': 'bullish_reversal',
                     'signal': 'long'
-                }
-                sweeps.append(sweep)
-            
-            # Свип хаев (sweep highs) - цена пробила максимум, но отскочила вниз
-            elif (curr_candle['high'] > prev_candle['high'] and 
-                  curr_candle['close'] < prev_candle['close'] and
-                  curr_candle['close'] < curr_candle['open']):
-                sweep = {
+                })
+            else:
+                sweeps.append({
                     'type': 'liquidity_sweep_highs',
-                    'sweep_price': curr_candle['high'],
-                    'reaction_price': curr_candle['close'],
-                    'timestamp': curr_candle['timestamp'],
+                    'sweep_price': h,
+                    'reaction_price': c,
+                    'timestamp': t,
                     'direction': 'bearish_reversal',
                     'signal': 'short'
-                }
-                sweeps.append(sweep)
+                })
         
         return sweeps
     
-    def detect_divergence(self, ohlcv: List[List], rsi_values: List[float]) -> Dict[str, Any]:
+    def detect_divergence(self, ohlcv: Candles, rsi_values: List[float]) -> Dict[str, Any]:
         """
         Обнаруживает дивергенцию RSI/Order Flow (согласно analiz.txt)
         
@@ -260,59 +518,35 @@ class AdvancedMarketAnalyzer:
         if len(ohlcv) < 20 or len(rsi_values) < 20:
             return {'has_divergence': False}
         
-        df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-        
         # Берём последние 20 свечей для анализа
-        recent_prices = df['close'].tail(20).values
+        recent_prices = _MarketContext.of(ohlcv).close[-20:]
         recent_rsi = rsi_values[-20:] if len(rsi_values) >= 20 else rsi_values
         
         if len(recent_prices) < 10 or len(recent_rsi) < 10:
             return {'has_divergence': False}
         
         # Ищем локальные минимумы и максимумы
-        price_lows = []
-        price_highs = []
-        rsi_lows = []
-        rsi_highs = []
-        
-        for i in range(1, len(recent_prices) - 1):
-            # Локальный минимум цены
-            if recent_prices[i] < recent_prices[i-1] and recent_prices[i] < recent_prices[i+1]:
-                price_lows.append((i, recent_prices[i]))
-                if i < len(recent_rsi):
-                    rsi_lows.append((i, recent_rsi[i]))
-            
-            # Локальный максимум цены
-            if recent_prices[i] > recent_prices[i-1] and recent_prices[i] > recent_prices[i+1]:
-                price_highs.append((i, recent_prices[i]))
-                if i < len(recent_rsi):
-                    rsi_highs.append((i, recent_rsi[i]))
-        
-        # Проверяем бычью дивергенцию (цена делает новый минимум, RSI - нет)
-        bullish_divergence = False
-        if len(price_lows) >= 2 and len(rsi_lows) >= 2:
-            last_low_price = price_lows[-1][1]
-            prev_low_price = price_lows[-2][1]
-            last_low_rsi = rsi_lows[-1][1] if len(rsi_lows) > 0 else None
-            prev_low_rsi = rsi_lows[-2][1] if len(rsi_lows) > 1 else None
-            
-            if last_low_rsi is not None and prev_low_rsi is not None:
-                # Цена упала ниже, но RSI выше - бычья дивергенция
-                if last_low_price < prev_low_price and last_low_rsi > prev_low_rsi:
-                    bullish_divergence = True
-        
-        # Проверяем медвежью дивергенцию (цена делает новый максимум, RSI - нет)
-        bearish_divergence = False
-        if len(price_highs) >= 2 and len(rsi_highs) >= 2:
-            last_high_price = price_highs[-1][1]
-            prev_high_price = price_highs[-2][1]
-            last_high_rsi = rsi_highs[-1][1] if len(rsi_highs) > 0 else None
-            prev_high_rsi = rsi_highs[-2][1] if len(rsi_highs) > 1 else None
-            
-            if last_high_rsi is not None and prev_high_rsi is not None:
-                # Цена выросла выше, но RSI ниже - медвежья дивергенция
-                if last_high_price > prev_high_price and last_high_rsi < prev_high_rsi:
-                    bearish_divergence = True
+        prices = np.ascontiguousarray(recent_prices, dtype=np.float64)
+        rsi = np.asarray(recent_rsi, dtype=np.float64)
+        low_idx, high_idx = _find_pivots(prices)
+        rsi_low_idx = low_idx[low_idx < len(rsi)]
+        rsi_high_idx = high_idx[high_idx < len(rsi)]
+        
+        # Проверяем бычью дивергенцию (цена делает новый минимум, RSI - нет):
+        # цена упала ниже, но RSI выше на двух последних минимумах
+        bullish_divergence = bool(
+            len(low_idx) >= 2 and len(rsi_low_idx) >= 2
+            and prices[low_idx[-1]] < prices[low_idx[-2]]
+            and rsi[rsi_low_idx[-1]] > rsi[rsi_low_idx[-2]]
+        )
+        
+        # Проверяем медвежью дивергенцию (цена делает новый максимум, RSI - нет):
+        # цена выросла выше, но RSI ниже на двух последних максимумах
+        bearish_divergence = bool(
+            len(high_idx) >= 2 and len(rsi_high_idx) >= 2
+            and prices[high_idx[-1]] > prices[high_idx[-2]]
+            and rsi[rsi_high_idx[-1]] < rsi[rsi_high_idx[-2]]
+        )
         
         return {
             'has_divergence': bullish_divergence or bearish_divergence,
@@ -321,22 +555,19 @@ class AdvancedMarketAnalyzer:
             'signal': 'long' if bullish_divergence else 'short' if bearish_divergence else 'neutral'
         }
     
-    def analyze_order_flow(self, ohlcv: List[List], orderbook: Optional[Dict] = None) -> Dict[str, Any]:
+    def analyze_order_flow(self, ohlcv: Candles, orderbook: Optional[Dict] = None) -> Dict[str, Any]:
         """
         Анализирует Order Flow (поток ордеров) с Delta из стакана
         """
         if len(ohlcv) < 10:
             return {}
         
-        df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+        ctx = _MarketContext.of(ohlcv)
+        open_, close, volume = ctx.open, ctx.close, ctx.volume
         
-        # Простой анализ Order Flow на основе свечей и объёма
-        bullish_candles = df[df['close'] > df['open']]
-        bearish_candles = df[df['close'] < df['open']]
-        
-        bullish_volume = bullish_candles['volume'].sum() if len(bullish_candles) > 0 else 0
-        bearish_volume = bearish_candles['volume'].sum() if len(bearish_candles) > 0 else 0
-        total_volume = df['volume'].sum()
+        # Простой анализ Order Flow на основе свечей и объёма: объём бычьих/медвежьих свечей без фильтрации фрейма
+        bullish_volume = float(np.where(close > open_, volume, 0.0).sum())
+        bearish_volume = float(np.where(close < open_, volume, 0.0).sum())
         
         # Delta из стакана (buy/sell volume imbalance)
         # Согласно proverka.txt: используем больше уровней для точности (до 100 для перпетульного API)
@@ -345,8 +576,8 @@ class AdvancedMarketAnalyzer:
             bids = orderbook.get('bids', [])
             asks = orderbook.get('asks', [])
             # Суммируем объёмы в стакане (первые 50 уровней для более точного анализа)
-            bid_volume = sum([b[1] for b in bids[:50]]) if bids else 0
-            ask_volume = sum([a[1] for a in asks[:50]]) if asks else 0
+            bid_volume = _book_volume(bids[:50]) if bids else 0
+            ask_volume = _book_volume(asks[:50]) if asks else 0
             delta = bid_volume - ask_volume
             delta_percent = (delta / (bid_volume + ask_volume) * 100) if (bid_volume + ask_volume) > 0 else 0
             
@@ -384,8 +615,7 @@ class AdvancedMarketAnalyzer:
             of_strength *= 1.2
         
         # Анализ на младшем таймфрейме (последние 3 свечи)
-        recent_3 = df.tail(3)
-        recent_trend = 'up' if recent_3['close'].iloc[-1] > recent_3['close'].iloc[0] else 'down'
+        recent_trend = 'up' if close[-1] > close[-3] else 'down'
         
         return {
             'direction': of_direction,
@@ -401,25 +631,25 @@ class AdvancedMarketAnalyzer:
                      'short' if of_direction == 'bearish' and recent_trend == 'down' else 'neutral'
         }
     
-    def detect_bos_choch(self, ohlcv: List[List]) -> Dict[str, Any]:
+    def detect_bos_choch(self, ohlcv: Candles) -> Dict[str, Any]:
         """
         Обнаруживает BOS (Break of Structure) и CHOCH (Change of Character)
         """
         if len(ohlcv) < 20:
             return {}
         
-        df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+        ctx = _MarketContext.of(ohlcv)
+        high, low = ctx.high, ctx.low
         
         # Анализируем структуру (Higher Highs / Lower Lows)
-        recent_10 = df.tail(10)
-        highs = recent_10['high'].values
-        lows = recent_10['low'].values
+        highs = high[-10:]
+        lows = low[-10:]
         
         # BOS - прорыв структуры (новый HH или новый LL)
-        highest_high = df['high'].max()
-        lowest_low = df['low'].min()
-        current_high = df['high'].iloc[-1]
-        current_low = df['low'].iloc[-1]
+        highest_high = ctx.price_max
+        lowest_low = ctx.price_min
+        current_high = high[-1]
+        current_low = low[-1]
         
         bos = None
         if current_high > highest_high * 0.99:
@@ -429,8 +659,8 @@ class AdvancedMarketAnalyzer:
         
         # CHOCH - смена характера тренда
         # Ищем разворот паттерна HH/LL
-        higher_highs = sum([1 for i in range(1, len(highs)) if highs[i] > highs[i-1]])
-        lower_lows = sum([1 for i in range(1, len(lows)) if lows[i] < lows[i-1]])
+        higher_highs = int(np.count_nonzero(highs[1:] > highs[:-1]))
+        lower_lows = int(np.count_nonzero(lows[1:] < lows[:-1]))
         
         choch = None
         if higher_highs >= 3 and lower_lows >= 2:
@@ -446,28 +676,46 @@ class AdvancedMarketAnalyzer:
             'structure': 'uptrend' if higher_highs > lower_lows else 'downtrend' if lower_lows > higher_highs else 'range'
         }
     
-    def comprehensive_analysis(self, ohlcv: List[List], orderbook: Optional[Dict] = None) -> Dict[str, Any]:
+    def comprehensive_analysis(self, ohlcv: OHLCV, orderbook: Optional[Dict] = None,
+                               symbol: Optional[str] = None) -> Dict[str, Any]:
         """
         Комплексный анализ рынка с использованием всех техник
+        
+        Результат кэшируется: пока не пришла новая свеча/тик и не изменился стакан,
+        повторные вызовы возвращают копию того же отчёта без пересчёта
+        (кэш полезен на общем анализаторе, см. get_shared_analyzer)
         """
-        current_price = ohlcv[-1][4] if ohlcv else 0
+        cache_key = self._analysis_key(ohlcv, orderbook) if len(ohlcv) else None
+        if cache_key is not None:
+            cached = self._analysis_cache.get(cache_key)
+            if cached is not None:
+                # Копия: вызывающий код дополняет отчёт и не должен портить кэш
+                return copy.deepcopy(cached)
+        
+        current_price = ohlcv[-1][4] if len(ohlcv) else 0
+        
+        # Свечи и общие статистики готовим один раз — все детекторы работают с общим контекстом
+        candles = _MarketContext(self._candles_buffer(ohlcv))
         
         # Анализ IMB, FVG, STB
-        imbalances = self.find_imbalance(ohlcv)
-        fvgs = self.find_fvg(ohlcv)
-        stb_zones = self.find_stb_zones(ohlcv, imbalances)
+        # Зоны остаются в колонках; словари строятся только для последних 5, попадающих в отчёт
+        imbalance_columns = self._imbalance_columns(candles, symbol)
+        fvg_columns = self._fvg_columns(candles, symbol)
+        stb_zones = self.find_stb_zones(candles, imbalance_columns)
+        imbalances = imbalance_columns.to_dicts(-5)
+        fvgs = fvg_columns.to_dicts(-5)
         
         # Анализ пулов ликвидности
-        liquidity_pools = self.analyze_liquidity_pools(ohlcv, orderbook)
+        liquidity_pools = self.analyze_liquidity_pools(candles, orderbook)
         
         # Анализ свипов ликвидности
-        liquidity_sweeps = self.detect_liquidity_sweeps(ohlcv, orderbook)
+        liquidity_sweeps = self.detect_liquidity_sweeps(candles, orderbook)
         
         # Анализ Order Flow
-        order_flow = self.analyze_order_flow(ohlcv, orderbook)
+        order_flow = self.analyze_order_flow(candles, orderbook)
         
         # BOS/CHOCH
-        structure = self.detect_bos_choch(ohlcv)
+        structure = self.detect_bos_choch(candles)
         
         # Генерируем торговые сигналы
         signals = self._generate_advanced_signals(
@@ -475,10 +723,10 @@ class AdvancedMarketAnalyzer:
             liquidity_pools, liquidity_sweeps, order_flow, structure
         )
         
-        return {
+        result = {
             'current_price': current_price,
-            'imbalances': imbalances[-5:] if imbalances else [],  # Последние 5
-            'fvgs': fvgs[-5:] if fvgs else [],  # Последние 5
+            'imbalances': imbalances,  # Последние 5
+            'fvgs': fvgs,  # Последние 5
             'stb_zones': stb_zones,
             'liquidity_pools': liquidity_pools,
             'liquidity_sweeps': liquidity_sweeps[-3:] if liquidity_sweeps else [],
@@ -487,6 +735,14 @@ class AdvancedMarketAnalyzer:
             'signals': signals,
             'recommendations': self._generate_recommendations(signals, liquidity_pools, fvgs)
         }
+        
+        if cache_key is not None:
+            with self._cache_lock:
+                if len(self._analysis_cache) >= _ANALYSIS_CACHE_MAXSIZE and cache_key not in self._analysis_cache:
+                    # Вытесняем самую старую запись
+                    self._analysis_cache.pop(next(iter(self._analysis_cache)))
+                self._analysis_cache[cache_key] = copy.deepcopy(result)
+        return result
     
     def _generate_advanced_signals(self, current_price: float, imbalances: List, 
                                    fvgs: List, stb_zones: List, liquidity_pools: Dict,
@@ -614,3 +870,14 @@ class AdvancedMarketAnalyzer:
             }
         
         return None
+
+
+# Общий анализатор на процесс: TradingEngine и MarketAnalyzer создаются на каждый запрос,
+# а кэш отчётов, инкрементальные зоны IMB/FVG и буферы свечей имеют смысл, только
+# пока живут между вызовами (для всех пользователей и пар)
+_shared_analyzer = AdvancedMarketAnalyzer()
+
+
+def get_shared_analyzer() -> AdvancedMarketAnalyzer:
+    """Получить общий экземпляр AdvancedMarketAnalyzer"""
+    return _shared_analyzer
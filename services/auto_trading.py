@@ -1,14 +1,25 @@
 import asyncio
+import heapq
+import logging
 import time
 import traceback
-from typing import Dict, List, Optional, TYPE_CHECKING
+from typing import Callable, Dict, List, Optional, Tuple, TYPE_CHECKING
 from datetime import datetime, timezone
-from services.bingx_api import BingXAPI
+from services.bingx_api import (
+    BingXAPI,
+    BingXConnectionError,
+    BingXDataError,
+    BingXSignatureError,
+    get_user_api,
+    wrap_error,
+)
 from services.trading import TradingEngine
 from services.statistics import StatisticsManager
 from data.user_data import UserDataManager
 from config.settings import (
+    AUTO_TRADING_MAX_CONCURRENCY,
     DEFAULT_PAIRS,
+    SCAN_MAX_CONCURRENCY,
     SCALPING_BLOCKED_PAIRS,
     SCALPING_BLOCKED_HOURS,
     SCALPING_BLOCKED_WEEKDAYS,
@@ -19,6 +30,13 @@ from aiogram.types import BufferedInputFile
 if TYPE_CHECKING:
     from aiogram import Bot
 
+# Частые сообщения (на каждый цикл, пару, позицию) пишем через logging с ленивым форматированием:
+# при отключённом уровне строки не собираются вовсе
+logger = logging.getLogger(__name__)
+
+# DEFAULT_PAIRS без проблемных для скальпинга пар (оба набора неизменяемы — считаем один раз)
+_SCALPING_DEFAULT_PAIRS = tuple(p for p in DEFAULT_PAIRS if p not in SCALPING_BLOCKED_PAIRS)
+
 
 class AutoTradingManager:
     """Менеджер автоматической торговли"""
@@ -28,19 +46,76 @@ class AutoTradingManager:
         self.user_data = UserDataManager()
         self.bot: Optional['Bot'] = None  # Бот для отправки сообщений
         # Cooldown после SL по паре (symbol -> timestamp последнего SL)
-        self.sl_cooldowns: Dict[str, float] = {}  # symbol -> timestamp
+        # (user_id, symbol) -> time.monotonic() момента SL
+        self.sl_cooldowns: Dict[Tuple[int, str], float] = {}
+        # Куча (окончание cooldown, ключ, момент SL) для вычистки истёкших записей
+        self._sl_cooldown_heap: List[Tuple[float, Tuple[int, str], float]] = []
         self.sl_cooldown_minutes = 15  # Минут cooldown после SL
+        # Колбэк при открытии/закрытии демо-позиции (например, сброс кэша меню)
+        self.on_positions_changed: Optional[Callable[[int], None]] = None
+        # Блокировки открытия позиций по пользователям (user_id -> lock)
+        self._open_locks: Dict[int, asyncio.Lock] = {}
+        # События остановки циклов авто-торговли (user_id -> event)
+        self._stop_events: Dict[int, asyncio.Event] = {}
     
     def set_bot(self, bot: 'Bot'):
         """Установить экземпляр бота для отправки сообщений"""
         self.bot = bot
     
+    def _open_lock(self, user_id: int) -> asyncio.Lock:
+        """Блокировка, под которой открываются позиции пользователя"""
+        lock = self._open_locks.get(user_id)
+        if lock is None:
+            lock = self._open_locks[user_id] = asyncio.Lock()
+        return lock
+    
+    @staticmethod
+    def _get_api(user_id: int, data: Dict) -> BingXAPI:
+        """Клиент BingX пользователя (кэшируется и пересоздаётся только при смене ключей)"""
+        return get_user_api(user_id, data.get('api_key'), data.get('secret_key'))
+    
+    @staticmethod
+    async def _sleep_or_stop(stop_event: asyncio.Event, seconds: float) -> bool:
+        """Подождать seconds секунд; True, если за это время пришёл сигнал остановки"""
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=seconds)
+            return True
+        except asyncio.TimeoutError:
+            return False
+    
+    def _start_sl_cooldown(self, user_id: int, symbol: str, minutes: float):
+        """Запомнить SL по паре пользователя (cooldown считается по монотонным часам)"""
+        key = (user_id, symbol)
+        now = time.monotonic()
+        self.sl_cooldowns[key] = now
+        heapq.heappush(self._sl_cooldown_heap, (now + minutes * 60, key, now))
+    
+    def _expire_sl_cooldowns(self):
+        """Удалить истёкшие cooldown'ы, чтобы словарь не рос бесконечно"""
+        heap = self._sl_cooldown_heap
+        now = time.monotonic()
+        while heap and heap[0][0] <= now:
+            _, key, sl_time = heapq.heappop(heap)
+            # Запись могла обновиться более поздним SL — её не трогаем
+            if self.sl_cooldowns.get(key) == sl_time:
+                del self.sl_cooldowns[key]
+    
+    def _notify_positions_changed(self, user_id: int):
+        """Сообщить подписчику, что набор открытых позиций пользователя изменился"""
+        if self.on_positions_changed:
+            try:
+                self.on_positions_changed(user_id)
+            except Exception:
+                pass
+    
     async def start_auto_trading(self, user_id: int):
         """Запустить автоматическую торговлю для пользователя"""
         if user_id in self.active_tasks:
             return False  # Уже запущено
         
-        task = asyncio.create_task(self._auto_trading_loop(user_id))
+        stop_event = asyncio.Event()
+        self._stop_events[user_id] = stop_event
+        task = asyncio.create_task(self._auto_trading_loop(user_id, stop_event))
         self.active_tasks[user_id] = task
         return True
     
@@ -49,17 +124,22 @@ class AutoTradingManager:
         if user_id not in self.active_tasks:
             return False
         
+        stop_event = self._stop_events.pop(user_id, None)
+        if stop_event:
+            stop_event.set()
         task = self.active_tasks[user_id]
         task.cancel()
         del self.active_tasks[user_id]
         return True
     
-    async def _auto_trading_loop(self, user_id: int):
+    async def _auto_trading_loop(self, user_id: int, stop_event: Optional[asyncio.Event] = None):
         """Основной цикл автоматической торговли"""
         print(f"[Авто-торговля] Запуск для пользователя {user_id}")
+        if stop_event is None:
+            stop_event = asyncio.Event()
         
         # Запускаем отдельный цикл мониторинга позиций (каждые 30 секунд)
-        monitoring_task = asyncio.create_task(self._monitoring_loop(user_id))
+        monitoring_task = asyncio.create_task(self._monitoring_loop(user_id, stop_event))
         
         try:
             cycle_count = 0
@@ -76,7 +156,8 @@ class AutoTradingManager:
                     # Проверяем API
                     if not data.get('api_key') or not data.get('secret_key'):
                         print(f"[Авто-торговля] Пользователь {user_id}: API не подключен, ожидание...")
-                        await asyncio.sleep(60)  # Ждём минуту и проверяем снова
+                        if await self._sleep_or_stop(stop_event, 60):  # Ждём минуту и проверяем снова
+                            break
                         continue
 
                     # ===== ФИЛЬТРЫ СКАЛЬПИНГА ПО ВРЕМЕНИ (UTC) =====
@@ -97,10 +178,12 @@ class AutoTradingManager:
                             f"[Авто-торговля] ⏸ Скальпинг приостановлен для пользователя {user_id}: "
                             f"анализ показывает низкую эффективность ({reason}). Ожидание 15 минут..."
                         )
-                        await asyncio.sleep(900)  # 15 минут пауза перед следующей попыткой
+                        if await self._sleep_or_stop(stop_event, 900):  # 15 минут пауза перед следующей попыткой
+                            break
                         continue
                 
-                    print(f"[Авто-торговля] Цикл #{cycle_count} для пользователя {user_id}")
+                    logger.info("[Авто-торговля] Цикл #%d для пользователя %d", cycle_count, user_id)
+                    self._expire_sl_cooldowns()
                 
                     # Проверяем drawdown и авто-стоп
                     is_demo = data.get('is_demo_mode', True)
@@ -111,7 +194,7 @@ class AutoTradingManager:
                         drawdown = ((initial_balance - current_balance) / initial_balance * 100) if initial_balance > 0 else 0
                         if drawdown > max_drawdown_percent:
                             print(f"[Авто-торговля] ⛔ Авто-стоп: Drawdown {drawdown:.2f}% > {max_drawdown_percent}%")
-                            self.user_data.update_user_setting(user_id, 'auto_trading_enabled', False)
+                            await self.user_data.update_user_setting_async(user_id, 'auto_trading_enabled', False)
                             if self.bot:
                                 try:
                                     await self.bot.send_message(
@@ -132,9 +215,8 @@ class AutoTradingManager:
                     # Делаем не каждый раз, чтобы не грузить API (раз в 5 циклов ≈ 15 минут)
                     if cycle_count == 1 or cycle_count % 5 == 0:
                         try:
-                            await self._refresh_scalping_pairs(user_id, data)
-                            # Перечитываем данные после обновления
-                            data = self.user_data.get_user_data(user_id)
+                            # Обновляем пары прямо в data, перечитывать данные пользователя не нужно
+                            data["trading_pairs"] = await self._refresh_scalping_pairs(user_id, data)
                         except Exception as e:
                             print(f"[Авто-торговля] ⚠️ Не удалось обновить список пар: {e}")
                 
@@ -142,18 +224,19 @@ class AutoTradingManager:
                     # Используем сохранённые пары пользователя, если есть и их достаточно, иначе все DEFAULT_PAIRS
                     user_pairs = data.get("trading_pairs") or []
                     if user_pairs and len(user_pairs) >= len(DEFAULT_PAIRS):
-                        pairs = user_pairs
+                        original_len = len(user_pairs)
+                        # Фильтруем пары, которые показали устойчиво плохие результаты для скальпинга
+                        pairs = [p for p in user_pairs if p not in SCALPING_BLOCKED_PAIRS]
                     else:
                         # Если у пользователя нет сохранённых пар или их меньше чем DEFAULT_PAIRS, используем все DEFAULT_PAIRS
-                        pairs = DEFAULT_PAIRS.copy()
                         # Обновляем пары пользователя на все DEFAULT_PAIRS
-                        if user_pairs != pairs:
-                            self.user_data.update_user_setting(user_id, "trading_pairs", pairs)
-                            print(f"[Авто-торговля] ✅ Обновлены пары пользователя на все {len(pairs)} пар из DEFAULT_PAIRS")
+                        if user_pairs != list(DEFAULT_PAIRS):
+                            await self.user_data.update_user_setting_async(user_id, "trading_pairs", list(DEFAULT_PAIRS))
+                            print(f"[Авто-торговля] ✅ Обновлены пары пользователя на все {len(DEFAULT_PAIRS)} пар из DEFAULT_PAIRS")
+                        # Проблемные пары уже отфильтрованы при импорте
+                        original_len = len(DEFAULT_PAIRS)
+                        pairs = _SCALPING_DEFAULT_PAIRS
 
-                    # Фильтруем пары, которые показали устойчиво плохие результаты для скальпинга
-                    original_len = len(pairs)
-                    pairs = [p for p in pairs if p not in SCALPING_BLOCKED_PAIRS]
                     if len(pairs) < original_len:
                         removed = original_len - len(pairs)
                         print(
@@ -163,131 +246,177 @@ class AutoTradingManager:
 
                     if not pairs:
                         print("[Авто-торговля] ⛔ Нет доступных пар для скальпинга после фильтрации, ожидание 15 минут...")
-                        await asyncio.sleep(900)
+                        if await self._sleep_or_stop(stop_event, 900):
+                            break
                         continue
 
-                    preview = ", ".join([p.split('/')[0] for p in pairs[:10]])
-                    dots = "..." if len(pairs) > 10 else ""
-                    print(f"[Авто-торговля] Анализ {len(pairs)} пар: {preview}{dots}")
+                    if logger.isEnabledFor(logging.INFO):
+                        preview = ", ".join([p.split('/')[0] for p in pairs[:10]])
+                        dots = "..." if len(pairs) > 10 else ""
+                        logger.info("[Авто-торговля] Анализ %d пар: %s%s", len(pairs), preview, dots)
                 
-                    # Анализируем каждую пару
+                    # Анализируем пары параллельно, семафор ограничивает нагрузку на API BingX
+                    semaphore = asyncio.Semaphore(AUTO_TRADING_MAX_CONCURRENCY)
+                    outcomes = await asyncio.gather(
+                        *(self._analyze_one(user_id, symbol, data, semaphore) for symbol in pairs),
+                        return_exceptions=True,
+                    )
+                    
+                    # Разбираем ошибки в порядке пар
                     analyzed = 0
                     errors_count = 0
+                    connection_alert_sent = False
                 
-                    for symbol in pairs:
-                        try:
-                            await self._analyze_and_trade(user_id, symbol, data)
+                    for symbol, outcome in zip(pairs, outcomes):
+                        if isinstance(outcome, asyncio.CancelledError):
+                            raise outcome
+                        if not isinstance(outcome, Exception):
                             analyzed += 1
                             errors_count = 0  # Сбрасываем счётчик ошибок при успехе
-                        except Exception as e:
-                            errors_count += 1
-                            error_msg = str(e)
+                            continue
                         
-                            # Пропускаем ошибки соединения (временные проблемы с сетью)
-                            if "Не удалось подключиться" in error_msg or "No route to host" in error_msg or "Request timeout" in error_msg:
-                                print(f"[Авто-торговля] ⚠️ {symbol}: Проблемы с соединением (ошибка #{errors_count}) - пропускаем пару")
-                                # Если много ошибок подряд - уведомляем пользователя (из tt.txt: обработка ошибок)
-                                if errors_count >= 3 and self.bot:
-                                    try:
-                                        await self.bot.send_message(
-                                            chat_id=user_id,
-                                            text=(
-                                                f"⚠️ <b>BingX API недоступен</b>\n\n"
-                                                f"Множественные ошибки соединения ({errors_count}).\n"
-                                                f"Авто-торговля продолжает работу, но некоторые пары могут быть пропущены.\n\n"
-                                                f"Проверьте интернет-соединение и доступность BingX API."
-                                            ),
-                                            parse_mode='HTML'
-                                        )
-                                    except Exception:
-                                        pass
-                            elif "Signature verification" in error_msg:
-                                print(f"[Авто-торговля] ⚠️ {symbol}: Ошибка подписи API (пробуем следующую пару)")
-                            elif "Ошибка получения свечей" in error_msg or "Ошибка получения стакана" in error_msg:
-                                # Проблемы с конкретной парой - пропускаем её, но не останавливаем весь цикл
-                                print(f"[Авто-торговля] ⚠️ {symbol}: Проблемы с получением данных - пропускаем пару")
-                            elif "Домен" in error_msg:
-                                print(f"[Авто-торговля] ⚠️ {symbol}: Проблемы с доступностью домена (ошибка #{errors_count}) - пропускаем пару")
-                            else:
-                                print(f"[Авто-торговля] ❌ Ошибка при анализе {symbol}: {error_msg[:150]}")
+                        errors_count += 1
                         
-                            # Продолжаем со следующей парой даже при ошибках
-                            # Если слишком много ошибок подряд - делаем короткую паузу, но продолжаем
-                            if errors_count >= 5:
-                                print(f"[Авто-торговля] ⚠️ Много ошибок подряд ({errors_count}), делаю паузу 15 сек перед следующей парой...")
-                                await asyncio.sleep(15)
-                                errors_count = 0  # Сбрасываем после паузы
-                    
-                        # Небольшая задержка между парами для снижения нагрузки
-                        await asyncio.sleep(2)
+                        # Пропускаем ошибки соединения (временные проблемы с сетью, блокировка домена)
+                        if isinstance(outcome, BingXConnectionError):
+                            print(f"[Авто-торговля] ⚠️ {symbol}: Проблемы с соединением (ошибка #{errors_count}) - пропускаем пару")
+                            # Если много ошибок подряд - уведомляем пользователя (из tt.txt: обработка ошибок), раз за цикл
+                            if errors_count >= 3 and self.bot and not connection_alert_sent:
+                                connection_alert_sent = True
+                                try:
+                                    await self.bot.send_message(
+                                        chat_id=user_id,
+                                        text=(
+                                            f"⚠️ <b>BingX API недоступен</b>\n\n"
+                                            f"Множественные ошибки соединения ({errors_count}).\n"
+                                            f"Авто-торговля продолжает работу, но некоторые пары могут быть пропущены.\n\n"
+                                            f"Проверьте интернет-соединение и доступность BingX API."
+                                        ),
+                                        parse_mode='HTML'
+                                    )
+                                except Exception:
+                                    pass
+                        elif isinstance(outcome, BingXSignatureError):
+                            print(f"[Авто-торговля] ⚠️ {symbol}: Ошибка подписи API (пробуем следующую пару)")
+                        elif isinstance(outcome, BingXDataError):
+                            # Проблемы с конкретной парой - пропускаем её, но не останавливаем весь цикл
+                            print(f"[Авто-торговля] ⚠️ {symbol}: Проблемы с получением данных - пропускаем пару")
+                        else:
+                            print(f"[Авто-торговля] ❌ Ошибка при анализе {symbol}: {str(outcome)[:150]}")
                 
-                    print(f"[Авто-торговля] Цикл #{cycle_count} завершён ({analyzed}/{len(pairs)} пар проанализировано), ожидание 3 минуты...")
+                    logger.info(
+                        "[Авто-торговля] Цикл #%d завершён (%d/%d пар проанализировано), ожидание 3 минуты...",
+                        cycle_count, analyzed, len(pairs)
+                    )
                 
                     # Сокращено ожидание между циклами для более частого анализа
-                    await asyncio.sleep(180)  # 3 минуты вместо 5
+                    if await self._sleep_or_stop(stop_event, 180):  # 3 минуты вместо 5
+                        break
                 except asyncio.CancelledError:
                     raise
                 except Exception as e:
                     traceback.print_exc()
                     print(f"[Авто-торговля] ❌ Ошибка в цикле для {user_id}: {e}")
-                    await asyncio.sleep(60)
+                    if await self._sleep_or_stop(stop_event, 60):
+                        break
                 
         except asyncio.CancelledError:
             print(f"[Авто-торговля] Остановлена пользователем для {user_id}")
             monitoring_task.cancel()
             raise
         finally:
+            # Будим цикл мониторинга, чтобы он завершился вместе с основным
+            stop_event.set()
             # Удаляем задачу из активных только при завершении цикла
-            # (это может быть из-за отмены или отключения авто-торговли)
-            if user_id in self.active_tasks:
+            # (это может быть из-за отмены или отключения авто-торговли).
+            # Новый запуск мог уже занять место - его не трогаем
+            if self.active_tasks.get(user_id) is asyncio.current_task():
                 del self.active_tasks[user_id]
+            if self._stop_events.get(user_id) is stop_event:
+                del self._stop_events[user_id]
 
-    async def _refresh_scalping_pairs(self, user_id: int, data: Dict, desired: int = None):
+    async def _analyze_one(self, user_id: int, symbol: str, data: Dict, semaphore: asyncio.Semaphore):
+        """Проанализировать одну пару в цикле авто-торговли (ошибки пробрасываются в цикл)"""
+        # Пары на cooldown отсекаем до семафора: они не занимают слот и не трогают API
+        if self._in_sl_cooldown(user_id, symbol, data):
+            return
+        async with semaphore:
+            await self._analyze_and_trade(user_id, symbol, data)
+    
+    def _in_sl_cooldown(self, user_id: int, symbol: str, data: Dict) -> bool:
+        """Пара пользователя ещё на cooldown после SL (из tt.txt: анти-оверторговля)"""
+        last_sl_time = self.sl_cooldowns.get((user_id, symbol))
+        if last_sl_time is None:
+            return False
+        sl_cooldown_minutes = int(data.get("sl_cooldown_minutes", self.sl_cooldown_minutes) or self.sl_cooldown_minutes)
+        minutes_passed = (time.monotonic() - last_sl_time) / 60
+        if minutes_passed < sl_cooldown_minutes:
+            logger.info(
+                "[Авто-торговля] ⏸️ %s: Cooldown после SL (%.1f/%s мин)",
+                symbol, minutes_passed, sl_cooldown_minutes
+            )
+            return True
+        return False
+
+    async def _refresh_scalping_pairs(self, user_id: int, data: Dict, desired: int = None) -> List[str]:
         """
         Убираем "пустые" пары и заменяем на пары с большим объёмом для скальпинга.
 
         Критерии "пустых":
         - Не удаётся получить тикер/свечи
         - 24h volume слишком маленький (если доступен)
+
+        Возвращает итоговый список пар (он же сохраняется в настройках пользователя).
         """
-        api = BingXAPI(
-            api_key=data.get('api_key'),
-            secret_key=data.get('secret_key'),
-            sandbox=False
-        )
+        api = self._get_api(user_id, data)
 
         current_pairs = data.get("trading_pairs") or []
         # Если desired не указан или у пользователя нет пар — используем все DEFAULT_PAIRS
         if desired is None:
             desired = len(DEFAULT_PAIRS)
         if not current_pairs or len(current_pairs) < desired:
-            current_pairs = DEFAULT_PAIRS.copy()
+            current_pairs = list(DEFAULT_PAIRS)
 
         valid_pairs: List[str] = []
         removed_pairs: List[str] = []
 
-        for sym in current_pairs:
-            # Сразу пропускаем пары, которые показали устойчиво плохие результаты для скальпинга
-            if sym in SCALPING_BLOCKED_PAIRS:
-                removed_pairs.append(sym)
-                continue
+        # Сразу пропускаем пары, которые показали устойчиво плохие результаты для скальпинга
+        candidates = [sym for sym in current_pairs if sym not in SCALPING_BLOCKED_PAIRS]
+        removed_pairs.extend(sym for sym in current_pairs if sym in SCALPING_BLOCKED_PAIRS)
 
-            try:
-                ticker = await api.get_ticker(sym)
-                vol = float(ticker.get("volume", 0) or 0)
+        # Тикеры и свечи всех пар запрашиваем параллельно, семафор бережёт лимиты BingX
+        semaphore = asyncio.Semaphore(SCAN_MAX_CONCURRENCY)
 
-                # Лёгкая проверка свечей, чтобы не было "пусто"
-                _ = await api.get_ohlcv(sym, "5m", limit=100)
+        async def fetch(coro):
+            async with semaphore:
+                return await coro
 
-                # Фильтр по объёму: если совсем низкий объём — выкидываем
-                # (порог мягкий, чтобы не убивать пары без volume в ответе)
-                if vol > 0 and vol < 1_000_000:  # 1m USDT 24h
-                    removed_pairs.append(sym)
-                    continue
+        tickers, candles = await asyncio.gather(
+            asyncio.gather(*(fetch(api.get_ticker(sym)) for sym in candidates), return_exceptions=True),
+            # Лёгкая проверка свечей, чтобы не было "пусто"
+            asyncio.gather(*(fetch(api.get_ohlcv(sym, "5m", limit=100)) for sym in candidates), return_exceptions=True),
+        )
 
-                valid_pairs.append(sym)
+        for sym, ticker, ohlcv in zip(candidates, tickers, candles):
+            for outcome in (ticker, ohlcv):
+                if isinstance(outcome, asyncio.CancelledError):
+                    raise outcome
+            if isinstance(ticker, Exception) or isinstance(ohlcv, Exception):
+                removed_pairs.append(sym)
+                continue
+            try:
+                vol = float(ticker.get("volume", 0) or 0)
             except Exception:
                 removed_pairs.append(sym)
+                continue
+
+            # Фильтр по объёму: если совсем низкий объём — выкидываем
+            # (порог мягкий, чтобы не убивать пары без volume в ответе)
+            if vol > 0 and vol < 1_000_000:  # 1m USDT 24h
+                removed_pairs.append(sym)
+                continue
+
+            valid_pairs.append(sym)
 
         # Добиваем до нужного количества топом по объёму (только если desired указан)
         if desired is not None and len(valid_pairs) < desired:
@@ -311,13 +440,14 @@ class AutoTradingManager:
             final_pairs = valid_pairs
 
         if final_pairs != (data.get("trading_pairs") or []):
-            self.user_data.update_user_setting(user_id, "trading_pairs", final_pairs)
+            await self.user_data.update_user_setting_async(user_id, "trading_pairs", final_pairs)
             print(
                 f"[Авто-торговля] ✅ Обновил пары для скальпинга: {len(final_pairs)} шт. "
                 f"(убрано: {len(removed_pairs)}, добавлено топ-объёмом: {max(0, len(final_pairs) - (len(current_pairs) - len(removed_pairs)))})"
             )
+        return final_pairs
     
-    async def _monitoring_loop(self, user_id: int):
+    async def _monitoring_loop(self, user_id: int, stop_event: asyncio.Event):
         """Отдельный цикл для частого мониторинга позиций (каждые 30 секунд)"""
         print(f"[Авто-торговля] 🔍 Запуск мониторинга позиций для пользователя {user_id}")
         try:
@@ -334,12 +464,14 @@ class AutoTradingManager:
                         await self._monitor_positions(user_id, data)
                     
                     # Ждём 30 секунд перед следующей проверкой
-                    await asyncio.sleep(30)
+                    if await self._sleep_or_stop(stop_event, 30):
+                        break
                 except asyncio.CancelledError:
                     break
                 except Exception as e:
                     print(f"[Авто-торговля] ⚠️ Ошибка в цикле мониторинга: {e}")
-                    await asyncio.sleep(30)  # Продолжаем даже при ошибках
+                    if await self._sleep_or_stop(stop_event, 30):  # Продолжаем даже при ошибках
+                        break
         except asyncio.CancelledError:
             print(f"[Авто-торговля] Мониторинг остановлен для {user_id}")
         except Exception as e:
@@ -352,24 +484,10 @@ class AutoTradingManager:
             # Параметры из профиля (как в pycryptobot: конфиг управляет стратегией)
             timeframe = data.get("timeframe", "5m")
             atr_min_percent = float(data.get("atr_min_percent", 0.25) or 0.25)
-            sl_cooldown_minutes = int(data.get("sl_cooldown_minutes", self.sl_cooldown_minutes) or self.sl_cooldown_minutes)
-            
-            # Проверяем cooldown после SL (из tt.txt: анти-оверторговля)
-            cooldown_key = f"{user_id}_{symbol}"
-            if cooldown_key in self.sl_cooldowns:
-                last_sl_time = self.sl_cooldowns[cooldown_key]
-                minutes_passed = (time.time() - last_sl_time) / 60
-                if minutes_passed < sl_cooldown_minutes:
-                    print(f"[Авто-торговля] ⏸️ {symbol}: Cooldown после SL ({minutes_passed:.1f}/{sl_cooldown_minutes} мин)")
-                    return
             
             # BingX не имеет testnet API, всегда используем реальный API
             # Демо-режим контролируется на уровне логики бота
-            api = BingXAPI(
-                api_key=data.get('api_key'),
-                secret_key=data.get('secret_key'),
-                sandbox=False
-            )
+            api = self._get_api(user_id, data)
             
             trading_engine = TradingEngine(api, is_demo=is_demo)
             
@@ -378,260 +496,274 @@ class AutoTradingManager:
             
             if 'error' in result:
                 # Пробрасываем ошибку, чтобы она была обработана в основном цикле
-                raise Exception(f"Ошибка получения свечей: {result['error']}")
+                raise wrap_error(f"Ошибка получения свечей: {result['error']}", result.get('exception'), BingXDataError)
             
             decision = result.get('decision', {})
             action = decision.get('action', 'skip')
             reason = decision.get('reason', '')
             
-            print(f"[Авто-торговля] {symbol}: {action} - {reason}")
+            logger.info("[Авто-торговля] %s: %s - %s", symbol, action, reason)
             
-            # Если сигнал на открытие позиции
+            # Разбираем действие один раз: None — открывать нечего, иначе 'long'/'short'
+            # (action вида open_long, open_strong_short и т.п.)
             if action.startswith('open_'):
-                # В ДЕМО-режиме не обращаемся к BingX за позициями (это paper trading)
-                if not is_demo:
-                    # Проверяем, нет ли уже открытых позиций (если проверка возможна)
+                direction = 'long' if 'long' in action else 'short'
+            else:
+                direction = None
+            
+            # Если сигнал на открытие позиции
+            if direction is not None:
+                # Открытия по парам пользователя выполняются по одной: пары анализируются параллельно,
+                # и без блокировки одновременные проверки лимита позиций пропустили бы лишние сделки
+                async with self._open_lock(user_id):
+                    # В ДЕМО-режиме не обращаемся к BingX за позициями (это paper trading)
+                    if not is_demo:
+                        # Проверяем, нет ли уже открытых позиций (если проверка возможна)
+                        try:
+                            positions = await api.get_positions()
+                            open_positions = [p for p in positions if p.get('contracts', 0) != 0]
+                            
+                            max_positions = data.get('max_open_positions', 5)
+                            if len(open_positions) >= max_positions:
+                                print(f"[Авто-торговля] {symbol}: Достигнут лимит позиций ({max_positions})")
+                                return  # Достигнут лимит позиций
+                            
+                            # Проверяем, нет ли уже позиции по этой паре
+                            for pos in open_positions:
+                                if pos.get('symbol') == symbol:
+                                    print(f"[Авто-торговля] {symbol}: Позиция уже открыта")
+                                    return  # Позиция уже открыта
+                        except Exception as pos_error:
+                            # Если не удалось получить позиции (подпись/сеть) — продолжаем,
+                            # чтобы не стопорить торговлю (особенно при временных проблемах).
+                            error_msg = str(pos_error)
+                            if isinstance(pos_error, BingXSignatureError):
+                                print(f"[Авто-торговля] ⚠️ {symbol}: Не удалось проверить существующие позиции (ошибка API подписи), продолжаем открытие позиции")
+                            elif isinstance(pos_error, BingXConnectionError):
+                                print(f"[Авто-торговля] ⚠️ {symbol}: Не удалось подключиться к BingX при проверке позиций, продолжаем")
+                            else:
+                                # Для других ошибок тоже продолжаем, но логируем
+                                print(f"[Авто-торговля] ⚠️ {symbol}: Ошибка при проверке позиций: {error_msg[:120]}, продолжаем открытие позиции")
+                    
+                    # Рассчитываем размер позиции и открываем позицию (выполняется всегда, независимо от результата проверки позиций)
                     try:
-                        positions = await api.get_positions()
-                        open_positions = [p for p in positions if p.get('contracts', 0) != 0]
+                        balance_info = await api.get_balance() if not is_demo else {'total': data.get('demo_balance', 10000)}
+                        balance = balance_info.get('total', 10000)
                         
-                        max_positions = data.get('max_open_positions', 5)
-                        if len(open_positions) >= max_positions:
-                            print(f"[Авто-торговля] {symbol}: Достигнут лимит позиций ({max_positions})")
-                            return  # Достигнут лимит позиций
+                        risk_percent = data.get('risk_per_trade', 1.5)
+                        recommendation = result.get('analysis', {}).get('recommendation')
+                        current_price = result.get('analysis', {}).get('current_price') or result.get('current_price', 0)
                         
-                        # Проверяем, нет ли уже позиции по этой паре
-                        for pos in open_positions:
-                            if pos.get('symbol') == symbol:
-                                print(f"[Авто-торговля] {symbol}: Позиция уже открыта")
-                                return  # Позиция уже открыта
-                    except Exception as pos_error:
-                        # Если не удалось получить позиции (подпись/сеть) — продолжаем,
-                        # чтобы не стопорить торговлю (особенно при временных проблемах).
-                        error_msg = str(pos_error)
-                        if "Signature" in error_msg or "100001" in error_msg:
-                            print(f"[Авто-торговля] ⚠️ {symbol}: Не удалось проверить существующие позиции (ошибка API подписи), продолжаем открытие позиции")
-                        elif "Не удалось подключиться" in error_msg or "No route to host" in error_msg:
-                            print(f"[Авто-торговля] ⚠️ {symbol}: Не удалось подключиться к BingX при проверке позиций, продолжаем")
+                        # Если current_price = 0, получаем цену напрямую из API
+                        if current_price == 0 or current_price is None:
+                            try:
+                                ticker = await api.get_ticker(symbol)
+                                current_price = float(ticker.get('last', 0))
+                                if current_price == 0:
+                                    bid = float(ticker.get('bid', 0))
+                                    ask = float(ticker.get('ask', 0))
+                                    if bid > 0 and ask > 0:
+                                        current_price = (bid + ask) / 2
+                                    elif bid > 0:
+                                        current_price = bid
+                                    elif ask > 0:
+                                        current_price = ask
+                            except Exception as price_err:
+                                print(f"[Авто-торговля] ⚠️ {symbol}: Не удалось получить цену: {price_err}")
+                                current_price = 0
+                        
+                        # Используем рекомендации из анализа (на основе пулов ликвидности)
+                        # Если recommendation есть - используем его, иначе рассчитываем сами
+                        advanced_analysis = result.get('analysis', {}).get('advanced_analysis', {})
+                        liquidity_pools = advanced_analysis.get('liquidity_pools', {})
+                        
+                        if recommendation:
+                            entry = recommendation.get('entry', current_price)
+                            stop_loss = recommendation.get('stop_loss')
+                            take_profit = recommendation.get('take_profit')
                         else:
-                            # Для других ошибок тоже продолжаем, но логируем
-                            print(f"[Авто-торговля] ⚠️ {symbol}: Ошибка при проверке позиций: {error_msg[:120]}, продолжаем открытие позиции")
-                
-                # Рассчитываем размер позиции и открываем позицию (выполняется всегда, независимо от результата проверки позиций)
-                try:
-                    balance_info = await api.get_balance() if not is_demo else {'total': data.get('demo_balance', 10000)}
-                    balance = balance_info.get('total', 10000)
-                    
-                    risk_percent = data.get('risk_per_trade', 1.5)
-                    recommendation = result.get('analysis', {}).get('recommendation')
-                    current_price = result.get('analysis', {}).get('current_price') or result.get('current_price', 0)
-                    
-                    # Если current_price = 0, получаем цену напрямую из API
-                    if current_price == 0 or current_price is None:
-                        try:
-                            ticker = await api.get_ticker(symbol)
-                            current_price = float(ticker.get('last', 0))
-                            if current_price == 0:
-                                bid = float(ticker.get('bid', 0))
-                                ask = float(ticker.get('ask', 0))
-                                if bid > 0 and ask > 0:
-                                    current_price = (bid + ask) / 2
-                                elif bid > 0:
-                                    current_price = bid
-                                elif ask > 0:
-                                    current_price = ask
-                        except Exception as price_err:
-                            print(f"[Авто-торговля] ⚠️ {symbol}: Не удалось получить цену: {price_err}")
-                            current_price = 0
-                    
-                    # Используем рекомендации из анализа (на основе пулов ликвидности)
-                    # Если recommendation есть - используем его, иначе рассчитываем сами
-                    advanced_analysis = result.get('analysis', {}).get('advanced_analysis', {})
-                    liquidity_pools = advanced_analysis.get('liquidity_pools', {})
-                    
-                    if recommendation:
-                        entry = recommendation.get('entry', current_price)
-                        stop_loss = recommendation.get('stop_loss')
-                        take_profit = recommendation.get('take_profit')
-                    else:
-                        entry = current_price
-                        stop_loss = None
-                        take_profit = None
+                            entry = current_price
+                            stop_loss = None
+                            take_profit = None
 
-                    # Скальперский SL/TP от волатильности (ATR) — чтобы уровни были реалистичными
-                    leverage = data.get('leverage', 5)
-                    direction = 'long' if 'long' in action else 'short'
-                    
-                    # ATR-фильтр: если волатильность слишком низкая - пропускаем (из tt.txt)
-                    try:
-                        levels = await trading_engine.calculate_scalping_sl_tp(
-                            symbol=symbol,
-                            entry=entry,
-                            direction=direction,
-                            leverage=leverage,
-                            timeframe=timeframe,
-                            candles_limit=1440,
-                        )
-                        meta = levels.get("meta", {})
-                        atr_pct = meta.get('atr_pct', 0)
+                        # Скальперский SL/TP от волатильности (ATR) — чтобы уровни были реалистичными
+                        leverage = data.get('leverage', 5)
                         
-                        # Фильтр по ATR: если волатильность слишком низкая - пропускаем
-                        if atr_pct < atr_min_percent:
-                            print(
-                                f"[Авто-торговля] ⏸️ {symbol}: Пропуск - низкая волатильность "
-                                f"(ATR%={atr_pct:.2f}% < {atr_min_percent}%)"
+                        # ATR-фильтр: если волатильность слишком низкая - пропускаем (из tt.txt)
+                        try:
+                            levels = await trading_engine.calculate_scalping_sl_tp(
+                                symbol=symbol,
+                                entry=entry,
+                                direction=direction,
+                                leverage=leverage,
+                                timeframe=timeframe,
+                                candles_limit=1440,
                             )
+                            meta = levels.get("meta", {})
+                            atr_pct = meta.get('atr_pct', 0)
+                            
+                            # Фильтр по ATR: если волатильность слишком низкая - пропускаем
+                            if atr_pct < atr_min_percent:
+                                logger.info(
+                                    "[Авто-торговля] ⏸️ %s: Пропуск - низкая волатильность (ATR%%=%.2f%% < %s%%)",
+                                    symbol, atr_pct, atr_min_percent
+                                )
+                                return
+                            
+                            if levels.get("stop_loss") and levels.get("take_profit"):
+                                stop_loss = float(levels["stop_loss"])
+                                take_profit = float(levels["take_profit"])
+                                logger.info(
+                                    "[Авто-торговля] %s: ATR SL/TP калибровка (ATR%%=%.2f%%, SL%%=%.2f%%, TP%%=%.2f%%)",
+                                    symbol, atr_pct, meta.get('sl_pct', 0), meta.get('tp_pct', 0)
+                                )
+                        except Exception as lvl_err:
+                            print(f"[Авто-торговля] ⚠️ {symbol}: не удалось рассчитать ATR SL/TP: {lvl_err}")
+                        
+                        # Если entry не был установлен из recommendation, используем текущую цену
+                        if not entry or entry == 0:
+                            entry = current_price
+                        
+                        # ФИКСИРОВАННЫЙ размер позиции: ровно 100 USDT на каждую позицию
+                        position_value = 100.0  # Фиксированный размер позиции в USDT
+                        
+                        # Рассчитываем количество монет/токенов для позиции размером 100 USDT
+                        if entry > 0:
+                            amount = position_value / entry
+                        else:
+                            print(f"[Авто-торговля] ❌ {symbol}: Невозможно рассчитать размер позиции - entry = 0")
                             return
                         
-                        if levels.get("stop_loss") and levels.get("take_profit"):
-                            stop_loss = float(levels["stop_loss"])
-                            take_profit = float(levels["take_profit"])
-                            print(
-                                f"[Авто-торговля] {symbol}: ATR SL/TP калибровка "
-                                f"(ATR%={atr_pct:.2f}%, SL%={meta.get('sl_pct', 0):.2f}%, TP%={meta.get('tp_pct', 0):.2f}%)"
-                            )
-                    except Exception as lvl_err:
-                        print(f"[Авто-торговля] ⚠️ {symbol}: не удалось рассчитать ATR SL/TP: {lvl_err}")
-                    
-                    # Если entry не был установлен из recommendation, используем текущую цену
-                    if not entry or entry == 0:
-                        entry = current_price
-                    
-                    # ФИКСИРОВАННЫЙ размер позиции: ровно 100 USDT на каждую позицию
-                    position_value = 100.0  # Фиксированный размер позиции в USDT
-                    
-                    # Рассчитываем количество монет/токенов для позиции размером 100 USDT
-                    if entry > 0:
-                        amount = position_value / entry
-                    else:
-                        print(f"[Авто-торговля] ❌ {symbol}: Невозможно рассчитать размер позиции - entry = 0")
-                        return
-                    
-                    # Получаем данные для логирования (не влияют на размер позиции)
-                    analysis_data = result.get('analysis', {})
-                    probability = analysis_data.get('probability', 0)
-                    decision_data = result.get('decision', {})
-                    quality_score = decision_data.get('quality_score', 0) or 0
-                    signal_strength = decision_data.get('signal_strength', 0) or 0
-                    scale_factor = 1.0  # Для совместимости с уведомлениями (не влияет на размер)
-                    
-                    # Рассчитываем ожидаемую прибыль и риск
-                    if stop_loss and take_profit:
-                        risk_amount = abs(entry - stop_loss) * amount
-                        potential_profit = abs(take_profit - entry) * amount
-                        risk_reward_ratio = potential_profit / risk_amount if risk_amount > 0 else 0
-                    else:
-                        risk_amount = 0
-                        potential_profit = 0
-                        risk_reward_ratio = 0
-                    
-                    print(
-                        f"[Авто-торговля] {symbol}: Рассчитанные параметры:\n"
-                        f"  Entry: {entry:.2f}, SL: {stop_loss:.2f}, TP: {take_profit:.2f}\n"
-                        f"  Amount: {amount:.6f}, Position Value: {position_value:.2f} USDT (фиксировано: $100)\n"
-                        f"  Risk: {risk_amount:.2f} USDT, Potential Profit: {potential_profit:.2f} USDT\n"
-                        f"  R/R Ratio: {risk_reward_ratio:.2f}\n"
-                        f"  Probability: {probability}%, Quality Score: {quality_score}"
-                    )
-                    
-                    # Минимальный размер позиции (защита от слишком маленьких позиций)
-                    # Для фиксированного размера 100 USDT проверяем только минимальный объём монет
-                    min_amount = 0.001  # Минимальный объём для крипты
-                    if amount < min_amount:
-                        print(f"[Авто-торговля] {symbol}: Размер позиции слишком мал ({amount:.6f} < {min_amount}) - возможно, цена слишком высокая")
-                        return
-                    
-                    if amount > 0:
-                        direction = 'long' if 'long' in action else 'short'
+                        # Получаем данные для логирования (не влияют на размер позиции)
+                        analysis_data = result.get('analysis', {})
+                        probability = analysis_data.get('probability', 0)
+                        decision_data = result.get('decision', {})
+                        quality_score = decision_data.get('quality_score', 0) or 0
+                        signal_strength = decision_data.get('signal_strength', 0) or 0
+                        scale_factor = 1.0  # Для совместимости с уведомлениями (не влияет на размер)
                         
-                        print(f"[Авто-торговля] {symbol}: Открываю {direction.upper()} позицию - объём: {amount:.6f}, размер позиции: {position_value:.2f} USDT (фиксировано: $100), баланс: {balance:.2f} USDT")
+                        # Рассчитываем ожидаемую прибыль и риск
+                        if stop_loss and take_profit:
+                            risk_amount = abs(entry - stop_loss) * amount
+                            potential_profit = abs(take_profit - entry) * amount
+                            risk_reward_ratio = potential_profit / risk_amount if risk_amount > 0 else 0
+                        else:
+                            risk_amount = 0
+                            potential_profit = 0
+                            risk_reward_ratio = 0
                         
-                        # Открываем позицию
-                        trade_result = await trading_engine.execute_trade(
-                            symbol=symbol,
-                            direction=direction,
-                            amount=amount,
-                            stop_loss=stop_loss,
-                            take_profit=take_profit,
-                            leverage=data.get('leverage', 5)
-                        )
+                        if logger.isEnabledFor(logging.DEBUG):
+                            logger.debug(
+                                "[Авто-торговля] %s: Рассчитанные параметры:\n"
+                                "  Entry: %.2f, SL: %.2f, TP: %.2f\n"
+                                "  Amount: %.6f, Position Value: %.2f USDT (фиксировано: $100)\n"
+                                "  Risk: %.2f USDT, Potential Profit: %.2f USDT\n"
+                                "  R/R Ratio: %.2f\n"
+                                "  Probability: %s%%, Quality Score: %s",
+                                symbol, entry, stop_loss, take_profit,
+                                amount, position_value,
+                                risk_amount, potential_profit,
+                                risk_reward_ratio,
+                                probability, quality_score
+                            )
                         
-                        # Логируем результат
-                        if trade_result.get('success'):
-                            entry_price_actual = trade_result.get('price', entry)
-                            # Если цена все еще 0, используем entry или current_price
-                            if entry_price_actual == 0 or entry_price_actual is None:
-                                if entry and entry > 0:
-                                    entry_price_actual = entry
-                                else:
-                                    # Получаем текущую цену как последний резерв
-                                    try:
-                                        ticker = await api.get_ticker(symbol)
-                                        entry_price_actual = float(ticker.get('last', 0))
-                                        if entry_price_actual == 0:
-                                            bid = float(ticker.get('bid', 0))
-                                            ask = float(ticker.get('ask', 0))
-                                            if bid > 0 and ask > 0:
-                                                entry_price_actual = (bid + ask) / 2
-                                            elif bid > 0:
-                                                entry_price_actual = bid
-                                            elif ask > 0:
-                                                entry_price_actual = ask
-                                    except Exception as price_err:
-                                        print(f"[Авто-торговля] ⚠️ Не удалось получить цену для {symbol}: {price_err}")
-                                        entry_price_actual = current_price if current_price > 0 else 0
-                            
-                            # Критическая проверка: если цена все еще 0, не сохраняем позицию
-                            if entry_price_actual == 0 or entry_price_actual is None:
-                                print(f"[Авто-торговля] ❌ {symbol}: Невозможно открыть позицию - цена входа = 0")
-                                return  # Выходим из функции, не открываем позицию
-                            
-                            order_id = trade_result.get('order_id')
-                            
-                            print(f"[Авто-торговля] ✅ {symbol}: Позиция открыта - {direction.upper()} {amount:.6f} @ {entry_price_actual:.2f}")
-                            
-                            stats = StatisticsManager(api, user_id)
-                            if is_demo:
-                                trade_data = {
-                                    'symbol': symbol,
-                                    'direction': direction,
-                                    'amount': amount,
-                                    'entry': entry_price_actual,
-                                    'stop_loss': stop_loss,
-                                    'take_profit': take_profit,
-                                    'pnl': 0,
-                                    'status': 'open',
-                                    'leverage': leverage,
-                                    'position_value': position_value,
-                                    'risk_amount': risk_amount,
-                                    'potential_profit': potential_profit,
-                                    'risk_reward_ratio': risk_reward_ratio,
-                                    'probability': probability,
-                                    'quality_score': quality_score,
-                                    'signal_strength': signal_strength,
-                                    'scale_factor': scale_factor,
-                                    'order_id': order_id,
-                                    'is_demo': is_demo,
-                                    'entry_time': datetime.now().isoformat()  # КРИТИЧНО: сохраняем время открытия для скальпинга
-                                }
-                                stats.add_demo_trade(trade_data)
+                        # Минимальный размер позиции (защита от слишком маленьких позиций)
+                        # Для фиксированного размера 100 USDT проверяем только минимальный объём монет
+                        min_amount = 0.001  # Минимальный объём для крипты
+                        if amount < min_amount:
+                            print(f"[Авто-торговля] {symbol}: Размер позиции слишком мал ({amount:.6f} < {min_amount}) - возможно, цена слишком высокая")
+                            return
+                        
+                        if amount > 0:
+                            print(f"[Авто-торговля] {symbol}: Открываю {direction.upper()} позицию - объём: {amount:.6f}, размер позиции: {position_value:.2f} USDT (фиксировано: $100), баланс: {balance:.2f} USDT")
                             
-                            # Отправляем уведомление в Telegram с графиком
-                            await self._send_trade_notification(
-                                user_id, symbol, direction, amount, entry_price_actual,
-                                stop_loss, take_profit, leverage, balance, reason,
-                                result.get('analysis', {}), api, is_demo, order_id,
-                                scale_factor=scale_factor, risk_percent=risk_percent
+                            # Открываем позицию
+                            trade_result = await trading_engine.execute_trade(
+                                symbol=symbol,
+                                direction=direction,
+                                amount=amount,
+                                stop_loss=stop_loss,
+                                take_profit=take_profit,
+                                leverage=leverage
                             )
+                            
+                            # Логируем результат
+                            if trade_result.get('success'):
+                                entry_price_actual = trade_result.get('price', entry)
+                                # Если цена все еще 0, используем entry или current_price
+                                if entry_price_actual == 0 or entry_price_actual is None:
+                                    if entry and entry > 0:
+                                        entry_price_actual = entry
+                                    else:
+                                        # Получаем текущую цену как последний резерв
+                                        try:
+                                            ticker = await api.get_ticker(symbol)
+                                            entry_price_actual = float(ticker.get('last', 0))
+                                            if entry_price_actual == 0:
+                                                bid = float(ticker.get('bid', 0))
+                                                ask = float(ticker.get('ask', 0))
+                                                if bid > 0 and ask > 0:
+                                                    entry_price_actual = (bid + ask) / 2
+                                                elif bid > 0:
+                                                    entry_price_actual = bid
+                                                elif ask > 0:
+                                                    entry_price_actual = ask
+                                        except Exception as price_err:
+                                            print(f"[Авто-торговля] ⚠️ Не удалось получить цену для {symbol}: {price_err}")
+                                            entry_price_actual = current_price if current_price > 0 else 0
+                                
+                                # Критическая проверка: если цена все еще 0, не сохраняем позицию
+                                if entry_price_actual == 0 or entry_price_actual is None:
+                                    print(f"[Авто-торговля] ❌ {symbol}: Невозможно открыть позицию - цена входа = 0")
+                                    return  # Выходим из функции, не открываем позицию
+                                
+                                order_id = trade_result.get('order_id')
+                                
+                                print(f"[Авто-торговля] ✅ {symbol}: Позиция открыта - {direction.upper()} {amount:.6f} @ {entry_price_actual:.2f}")
+                                
+                                stats = StatisticsManager(api, user_id)
+                                if is_demo:
+                                    trade_data = {
+                                        'symbol': symbol,
+                                        'direction': direction,
+                                        'amount': amount,
+                                        'entry': entry_price_actual,
+                                        'stop_loss': stop_loss,
+                                        'take_profit': take_profit,
+                                        'pnl': 0,
+                                        'status': 'open',
+                                        'leverage': leverage,
+                                        'position_value': position_value,
+                                        'risk_amount': risk_amount,
+                                        'potential_profit': potential_profit,
+                                        'risk_reward_ratio': risk_reward_ratio,
+                                        'probability': probability,
+                                        'quality_score': quality_score,
+                                        'signal_strength': signal_strength,
+                                        'scale_factor': scale_factor,
+                                        'order_id': order_id,
+                                        'is_demo': is_demo,
+                                        'entry_time': datetime.now().isoformat()  # КРИТИЧНО: сохраняем время открытия для скальпинга
+                                    }
+                                    stats.add_demo_trade(trade_data)
+                                    self._notify_positions_changed(user_id)
+                                
+                                # Отправляем уведомление в Telegram с графиком
+                                await self._send_trade_notification(
+                                    user_id, symbol, direction, amount, entry_price_actual,
+                                    stop_loss, take_profit, leverage, balance, reason,
+                                    result.get('analysis', {}), api, is_demo, order_id,
+                                    scale_factor=scale_factor, risk_percent=risk_percent
+                                )
+                            else:
+                                error_msg = trade_result.get('error', 'Unknown error')
+                                print(f"[Авто-торговля] ❌ {symbol}: Ошибка открытия позиции - {error_msg}")
                         else:
-                            error_msg = trade_result.get('error', 'Unknown error')
-                            print(f"[Авто-торговля] ❌ {symbol}: Ошибка открытия позиции - {error_msg}")
-                    else:
-                        print(f"[Авто-торговля] {symbol}: Неверный размер позиции ({amount})")
-                        
-                except Exception as e:
-                    print(f"[Авто-торговля] ❌ Ошибка при открытии позиции {symbol}: {e}")
-                    traceback.print_exc()
+                            print(f"[Авто-торговля] {symbol}: Неверный размер позиции ({amount})")
+                            
+                    except Exception as e:
+                        print(f"[Авто-торговля] ❌ Ошибка при открытии позиции {symbol}: {e}")
+                        traceback.print_exc()
         except Exception as e:
             # Пробрасываем ошибку наверх для обработки в основном цикле
             raise
@@ -808,11 +940,7 @@ class AutoTradingManager:
         """Мониторит позиции и закрывает их при достижении SL/TP"""
         try:
             is_demo = data.get('is_demo_mode', True)
-            api = BingXAPI(
-                api_key=data.get('api_key'),
-                secret_key=data.get('secret_key'),
-                sandbox=False
-            )
+            api = self._get_api(user_id, data)
             
             # Получаем статистику (хранит информацию о позициях с SL/TP)
             # StatisticsManager теперь загружает демо-позиции из user_data автоматически
@@ -822,7 +950,7 @@ class AutoTradingManager:
             if is_demo:
                 open_trades = stats.get_demo_trades(status='open')
                 if open_trades:
-                    print(f"[Авто-торговля] 🔍 Мониторинг {len(open_trades)} открытых демо-позиций...")
+                    logger.debug("[Авто-торговля] 🔍 Мониторинг %d открытых демо-позиций...", len(open_trades))
                 
                 for trade in open_trades:
                     if trade.get('status') == 'open' and trade.get('close_price') is None:
@@ -905,14 +1033,13 @@ class AutoTradingManager:
                             if should_close:
                                 # Закрываем демо-позицию
                                 stats.close_demo_trade(symbol, current_price, close_reason)
+                                self._notify_positions_changed(user_id)
                                 print(f"[Авто-торговля] ✅ {symbol}: Демо-позиция закрыта - {close_reason} (цена: {current_price:.2f})")
                                 
                                 # Если закрытие по SL - устанавливаем cooldown (анти-оверторговля)
                                 if "Stop Loss" in close_reason:
-                                    import time
-                                    cooldown_key = f"{user_id}_{symbol}"
-                                    self.sl_cooldowns[cooldown_key] = time.time()
-                                    sl_cooldown_minutes = data.get("sl_cooldown_minutes", self.sl_cooldown_minutes)
+                                    sl_cooldown_minutes = int(data.get("sl_cooldown_minutes", self.sl_cooldown_minutes) or self.sl_cooldown_minutes)
+                                    self._start_sl_cooldown(user_id, symbol, sl_cooldown_minutes)
                                     print(f"[Авто-торговля] ⏸️ {symbol}: Cooldown {sl_cooldown_minutes} мин после SL")
                                 
                                 # Рассчитываем PnL
@@ -937,7 +1064,7 @@ class AutoTradingManager:
                                         await self._send_close_notification(
                                             user_id, symbol, direction, entry, current_price,
                                             stop_loss, take_profit, amount, pnl, pnl_percent,
-                                            close_reason, is_demo
+                                            close_reason, is_demo, leverage=data.get('leverage', 5)
                                         )
                                         print(f"[Авто-торговля] ✅ Уведомление о закрытии {symbol} отправлено в Telegram")
                                     except Exception as notif_error:
@@ -957,18 +1084,17 @@ class AutoTradingManager:
                     positions = await api.get_positions()
                     open_real_positions = [p for p in positions if p.get('contracts', 0) != 0]
                     if open_real_positions:
-                        print(f"[Авто-торговля] 🔍 Мониторинг {len(open_real_positions)} реальных позиций...")
+                        logger.debug("[Авто-торговля] 🔍 Мониторинг %d реальных позиций...", len(open_real_positions))
                         # BingX автоматически закрывает через условные ордера (SL/TP)
                         # Но можем логировать статус для отладки
                         for pos in open_real_positions:
                             pos_symbol = pos.get('symbol', 'N/A')
                             unrealized_pnl = pos.get('unrealizedPnl', 0) or 0
-                            print(f"[Авто-торговля] 📊 {pos_symbol}: PnL={unrealized_pnl:.2f} USDT")
+                            logger.debug("[Авто-торговля] 📊 %s: PnL=%.2f USDT", pos_symbol, unrealized_pnl)
                 except Exception as real_pos_error:
                     # Не критично, если не удалось получить реальные позиции
-                    error_msg = str(real_pos_error)
-                    if "Signature" not in error_msg and "100001" not in error_msg:
-                        print(f"[Авто-торговля] ⚠️ Ошибка проверки реальных позиций: {error_msg[:100]}")
+                    if not isinstance(real_pos_error, BingXSignatureError):
+                        print(f"[Авто-торговля] ⚠️ Ошибка проверки реальных позиций: {str(real_pos_error)[:100]}")
             
         except Exception as e:
             # Игнорируем ошибки мониторинга, чтобы не блокировать основной цикл
@@ -979,7 +1105,8 @@ class AutoTradingManager:
         self, user_id: int, symbol: str, direction: str,
         entry: float, close_price: float, stop_loss: float,
         take_profit: float, amount: float, pnl: float,
-        pnl_percent: float, close_reason: str, is_demo: bool
+        pnl_percent: float, close_reason: str, is_demo: bool,
+        leverage: Optional[float] = None
     ):
         """Отправляет улучшенное уведомление о закрытии позиции"""
         if not self.bot:
@@ -996,7 +1123,8 @@ class AutoTradingManager:
             potential_profit = abs(take_profit - entry) * amount if take_profit else 0
             
             # Процент от маржи
-            leverage = self.user_data.get_user_data(user_id).get('leverage', 5)
+            if leverage is None:
+                leverage = self.user_data.get_user_data(user_id).get('leverage', 5)
             margin_used = position_value / leverage if leverage > 0 else position_value
             pnl_percent_of_margin = (pnl / margin_used * 100) if margin_used > 0 else 0
             
@@ -9,7 +9,7 @@ import aiohttp
 import socket
 import ssl
 import logging
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 import random
 from config.settings import BINGX_API_KEY, BINGX_SECRET_KEY, BINGX_PROXY, BINGX_PROXY_LIST, BINGX_SSL_VERIFY
 
@@ -27,6 +27,74 @@ except ImportError:
         SSLCertVerificationError = ssl.SSLError
 
 
+class BingXError(Exception):
+    """Ошибка при работе с BingX (текст — готовое сообщение для пользователя)"""
+
+
+class BingXConnectionError(BingXError):
+    """Биржа недоступна: нет соединения, таймаут, блокировка домена"""
+
+
+class BingXSignatureError(BingXError):
+    """Биржа отклонила подпись запроса (ключи, права, время)"""
+
+
+class BingXDataError(BingXError):
+    """Не удалось получить рыночные данные по паре (свечи, стакан, цена)"""
+
+
+def wrap_error(message: str, cause: Optional[BaseException], default: type = BingXError) -> BingXError:
+    """
+    Обернуть ошибку в исключение BingX с новым текстом, сохранив её вид.
+
+    Сетевые ошибки и ошибки подписи остаются такими же при любом уровне обёртки,
+    остальные получают класс default.
+    """
+    if isinstance(cause, (BingXConnectionError, ccxt.NetworkError, aiohttp.ClientConnectionError, asyncio.TimeoutError)):
+        return BingXConnectionError(message)
+    if isinstance(cause, (BingXSignatureError, ccxt.AuthenticationError)):
+        return BingXSignatureError(message)
+    return default(message)
+
+# Общая HTTP-сессия для всех клиентов: переиспользует соединения и TLS между запросами
+_shared_session: Optional[aiohttp.ClientSession] = None
+
+
+def _get_shared_session(ssl_param) -> aiohttp.ClientSession:
+    """Вернуть общую aiohttp-сессию (создаётся лениво внутри работающего event loop)"""
+    global _shared_session
+    if _shared_session is None or _shared_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit_per_host=10, keepalive_timeout=60, family=socket.AF_INET, ssl=ssl_param
+        )
+        _shared_session = aiohttp.ClientSession(connector=connector)
+    return _shared_session
+
+
+# Кэш свечей: (symbol, timeframe, limit) -> (monotonic timestamp, свечи).
+# Свечи публичные, поэтому кэш общий для всех клиентов.
+_ohlcv_cache: Dict[Tuple[str, str, int], Tuple[float, List[List]]] = {}
+_OHLCV_CACHE_MAXSIZE = 256
+_TIMEFRAME_UNITS = {'m': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+def _ohlcv_ttl(timeframe: str) -> float:
+    """TTL кэша свечей: четверть длительности таймфрейма (5m -> 75 сек)"""
+    try:
+        seconds = int(timeframe[:-1]) * _TIMEFRAME_UNITS[timeframe[-1]]
+    except (ValueError, KeyError, IndexError):
+        seconds = 60
+    return seconds / 4
+
+
+async def close_shared_session():
+    """Закрыть общую HTTP-сессию (при остановке бота)"""
+    global _shared_session
+    if _shared_session is not None and not _shared_session.closed:
+        await _shared_session.close()
+    _shared_session = None
+
+
 class BingXAPI:
     """
     Класс для работы с API BingX через ccxt и прямые запросы
@@ -173,23 +241,23 @@ class BingXAPI:
         
         return signature
     
-    def _translate_connection_error(self, error_str: str) -> Exception:
+    def _translate_connection_error(self, error_str: str) -> BingXError:
         """Переводит ClientConnectorError в информативное сообщение для пользователя"""
         if "SSL" in error_str or "certificate" in error_str.lower() or "CERTIFICATE_VERIFY_FAILED" in error_str:
             if self.ssl_verify:
-                return Exception(
+                return BingXError(
                     f"❌ Ошибка SSL сертификата при подключении к API BingX:\n\n"
                     f"Ошибка: {error_str}\n\n"
                     f"💡 Решение:\nДобавьте в файл .env:\nBINGX_SSL_VERIFY=false\n\n"
                     f"⚠️ Отключение проверки SSL снижает безопасность."
                 )
-            return Exception(
+            return BingXError(
                 f"❌ Ошибка SSL даже с отключенной проверкой:\n{error_str}\n\n"
                 f"Проверьте интернет-соединение и настройки прокси."
             )
         if "No route to host" in error_str or "cannot connect" in error_str.lower():
             if not self.proxy:
-                return Exception(
+                return BingXConnectionError(
                     f"❌ Не удалось подключиться к серверу BingX.\n\n"
                     f"Ошибка: {error_str}\n\n"
                     f"💡 <b>Диагностика:</b>\n"
@@ -203,7 +271,7 @@ class BingXAPI:
                     f"2. <b>VPN</b> (сервер в США/Сингапуре/Гонконге)\n\n"
                     f"⚠️ Без прокси/VPN подключение невозможно при блокировке домена."
                 )
-            return Exception(
+            return BingXConnectionError(
                 f"❌ Не удалось подключиться даже через прокси.\n\n"
                 f"Ошибка: {error_str}\n\n"
                 f"Проверьте:\n"
@@ -211,20 +279,20 @@ class BingXAPI:
                 f"• Доступность прокси-сервера\n"
                 f"• Настройки прокси (авторизация, порт)"
             )
-        return Exception(
+        return BingXConnectionError(
             f"Не удалось подключиться к серверу BingX.\n"
             f"Проверьте интернет-соединение и доступность open-api.bingx.com\n"
             f"Ошибка: {error_str}"
         )
 
-    def _translate_ssl_error(self, ssl_err: Exception) -> Exception:
+    def _translate_ssl_error(self, ssl_err: Exception) -> BingXError:
         """Переводит SSLError в информативное сообщение"""
         if self.ssl_verify:
-            return Exception(
+            return BingXError(
                 f"❌ Ошибка SSL сертификата:\n{str(ssl_err)}\n\n"
                 f"💡 Решение: Добавьте в .env файл:\nBINGX_SSL_VERIFY=false"
             )
-        return Exception(f"Ошибка SSL: {str(ssl_err)}")
+        return BingXError(f"Ошибка SSL: {str(ssl_err)}")
 
     async def _do_public_get(self, url_with_params: str) -> Optional[Dict]:
         """Выполняет GET запрос к публичному endpoint с ретрай и обработкой ошибок.
@@ -234,35 +302,34 @@ class BingXAPI:
         """
         ssl_param = self.ssl_context if not self.ssl_verify else True
         timeout = aiohttp.ClientTimeout(total=20, connect=7)
-        connector = aiohttp.TCPConnector(family=socket.AF_INET, ssl=ssl_param)
+        session = _get_shared_session(ssl_param)
 
-        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
-            for attempt in range(2):
-                try:
-                    async with session.get(url_with_params, ssl=ssl_param, proxy=self.proxy) as response:
-                        if response.status == 200:
-                            data = await response.json()
-                            if data.get('code') == 0 and 'data' in data:
-                                return data
-                            raise Exception(data.get('msg', 'API error'))
-                        return None
-                except aiohttp.ClientConnectorError as e:
-                    error_str = str(e)
-                    if "SSL" in error_str or "certificate" in error_str.lower():
-                        raise self._translate_ssl_error(e)
-                    if attempt < 1:
-                        await asyncio.sleep(0.3 * (attempt + 1))
-                        continue
-                    raise self._translate_connection_error(error_str)
-                except (aiohttp.ServerTimeoutError, asyncio.TimeoutError):
-                    if attempt < 1:
-                        await asyncio.sleep(0.3 * (attempt + 1))
-                        continue
-                    raise Exception("Таймаут соединения с сервером BingX.")
-                except (SSLError, SSLCertVerificationError) as ssl_err:
-                    raise self._translate_ssl_error(ssl_err)
-                except Exception:
-                    break  # API-level error — не ретраим
+        for attempt in range(2):
+            try:
+                async with session.get(url_with_params, ssl=ssl_param, proxy=self.proxy, timeout=timeout) as response:
+                    if response.status == 200:
+                        data = await response.json()
+                        if data.get('code') == 0 and 'data' in data:
+                            return data
+                        raise Exception(data.get('msg', 'API error'))
+                    return None
+            except aiohttp.ClientConnectorError as e:
+                error_str = str(e)
+                if "SSL" in error_str or "certificate" in error_str.lower():
+                    raise self._translate_ssl_error(e)
+                if attempt < 1:
+                    await asyncio.sleep(0.3 * (attempt + 1))
+                    continue
+                raise self._translate_connection_error(error_str)
+            except (aiohttp.ServerTimeoutError, asyncio.TimeoutError):
+                if attempt < 1:
+                    await asyncio.sleep(0.3 * (attempt + 1))
+                    continue
+                raise BingXConnectionError("Таймаут соединения с сервером BingX.")
+            except (SSLError, SSLCertVerificationError) as ssl_err:
+                raise self._translate_ssl_error(ssl_err)
+            except Exception:
+                break  # API-level error — не ретраим
         return None
 
     async def _make_request(self, method: str, endpoint: str, params: Optional[Dict] = None) -> Dict:
@@ -282,46 +349,46 @@ class BingXAPI:
         }
         ssl_param = self.ssl_context if not self.ssl_verify else True
         timeout = aiohttp.ClientTimeout(total=10, connect=5)
-        connector = aiohttp.TCPConnector(
-            limit=10, limit_per_host=5, family=socket.AF_INET, ssl=ssl_param
-        )
 
         current_proxy = self.proxy
         max_retries = len(self.proxy_list) if self.proxy_list else 1
 
         try:
-            async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
-                for attempt in range(max_retries):
-                    try:
-                        if method.upper() == 'GET':
-                            sorted_params = sorted(params.items())
-                            query_string = urllib.parse.urlencode(sorted_params)
-                            request_url = f"{url}?{query_string}"
-                            ctx = session.get(request_url, headers=headers, ssl=ssl_param, proxy=current_proxy)
-                        else:
-                            request_url = url
-                            ctx = session.post(url, headers=headers, json=params, ssl=ssl_param, proxy=current_proxy)
-
-                        async with ctx as response:
-                            data = await response.json()
-                            if response.status != 200 or data.get('code') != 0:
-                                error_msg = data.get('msg', f'HTTP {response.status}')
-                                raise Exception(f"API Error: {error_msg} (code: {data.get('code', 'unknown')})")
-                            return data
-                    except aiohttp.ClientConnectorError as conn_error:
-                        if attempt < max_retries - 1 and len(self.proxy_list) > 1:
-                            logger.debug(f"Прокси {current_proxy} не работает, пробуем следующий...")
-                            current_proxy = self._get_next_proxy()
-                            continue
-                        raise self._translate_connection_error(str(conn_error))
+            session = _get_shared_session(ssl_param)
+            for attempt in range(max_retries):
+                try:
+                    if method.upper() == 'GET':
+                        sorted_params = sorted(params.items())
+                        query_string = urllib.parse.urlencode(sorted_params)
+                        request_url = f"{url}?{query_string}"
+                        ctx = session.get(request_url, headers=headers, ssl=ssl_param, proxy=current_proxy, timeout=timeout)
+                    else:
+                        request_url = url
+                        ctx = session.post(url, headers=headers, json=params, ssl=ssl_param, proxy=current_proxy, timeout=timeout)
+
+                    async with ctx as response:
+                        data = await response.json()
+                        if response.status != 200 or data.get('code') != 0:
+                            error_msg = data.get('msg', f'HTTP {response.status}')
+                            error_code = data.get('code', 'unknown')
+                            error_cls = BingXSignatureError if str(error_code) == '100001' or 'signature' in str(error_msg).lower() else BingXError
+                            raise error_cls(f"API Error: {error_msg} (code: {error_code})")
+                        return data
+                except aiohttp.ClientConnectorError as conn_error:
+                    if attempt < max_retries - 1 and len(self.proxy_list) > 1:
+                        logger.debug(f"Прокси {current_proxy} не работает, пробуем следующий...")
+                        current_proxy = self._get_next_proxy()
+                        continue
+                    raise self._translate_connection_error(str(conn_error))
         except aiohttp.ServerTimeoutError:
-            raise Exception("Таймаут соединения с сервером BingX.\nСервер не отвечает. Попробуйте позже.")
+            raise BingXConnectionError("Таймаут соединения с сервером BingX.\nСервер не отвечает. Попробуйте позже.")
         except (SSLError, SSLCertVerificationError) as ssl_err:
             raise self._translate_ssl_error(ssl_err)
+        except BingXError:
+            # Уже переведена в сообщение для пользователя (соединение, SSL, ответ API)
+            raise
         except Exception as e:
-            if any(x in str(e) for x in ["Не удалось подключиться", "Таймаут", "SSL"]):
-                raise
-            raise Exception(f"Ошибка соединения: {str(e)}")
+            raise wrap_error(f"Ошибка соединения: {str(e)}", e) from e
     
     async def get_balance(self) -> Dict[str, Any]:
         """Получить баланс аккаунта"""
@@ -347,7 +414,7 @@ class BingXAPI:
                     'used': balance.get('USDT', {}).get('used', 0),
                 }
         except Exception as e:
-            raise Exception(f"Ошибка получения баланса: {str(e)}")
+            raise wrap_error(f"Ошибка получения баланса: {str(e)}", e) from e
     
     async def get_ticker(self, symbol: str) -> Dict[str, Any]:
         """Получить текущую цену - публичный endpoint"""
@@ -378,7 +445,7 @@ class BingXAPI:
                 'change': ticker.get('percentage', 0),
             }
         except Exception as e:
-            raise Exception(f"Ошибка получения цены: {str(e)}")
+            raise wrap_error(f"Ошибка получения цены: {str(e)}", e, BingXDataError) from e
 
     async def get_top_usdt_perp_pairs_by_volume(self, limit: int = 10, min_quote_volume: float = 0) -> List[str]:
         """
@@ -390,7 +457,7 @@ class BingXAPI:
         try:
             tickers = await asyncio.to_thread(self.public_exchange.fetch_tickers)
         except Exception as e:
-            raise Exception(f"Не удалось получить tickers для подбора пар: {e}")
+            raise wrap_error(f"Не удалось получить tickers для подбора пар: {e}", e, BingXDataError) from e
 
         candidates: List[Dict[str, Any]] = []
         for sym, t in (tickers or {}).items():
@@ -438,7 +505,27 @@ class BingXAPI:
         return validated
 
     async def get_ohlcv(self, symbol: str, timeframe: str = '15m', limit: int = 300) -> List[List]:
-        """Получить свечи (OHLCV) через публичный API endpoint"""
+        """Получить свечи (OHLCV) через публичный API endpoint (с TTL-кэшем)"""
+        cache_key = (symbol, timeframe, limit)
+        cached = _ohlcv_cache.get(cache_key)
+        if cached and time.monotonic() - cached[0] < _ohlcv_ttl(timeframe):
+            return cached[1]
+
+        candles = await self._fetch_ohlcv(symbol, timeframe, limit)
+        if len(_ohlcv_cache) >= _OHLCV_CACHE_MAXSIZE and cache_key not in _ohlcv_cache:
+            # Вытесняем самую старую запись (dict сохраняет порядок вставки)
+            _ohlcv_cache.pop(next(iter(_ohlcv_cache)))
+        _ohlcv_cache[cache_key] = (time.monotonic(), candles)
+        return candles
+
+    @staticmethod
+    def invalidate(symbol: str):
+        """Сбросить кэш свечей по символу (например, после открытия сделки)"""
+        for key in [k for k in _ohlcv_cache if k[0] == symbol]:
+            _ohlcv_cache.pop(key, None)
+
+    async def _fetch_ohlcv(self, symbol: str, timeframe: str, limit: int) -> List[List]:
+        """Загрузить свечи с биржи (без кэша)"""
         try:
             symbol_normalized = symbol.replace('/', '-').replace(':USDT', '')
             if symbol_normalized.endswith('-USDT-USDT'):
@@ -469,11 +556,11 @@ class BingXAPI:
         except Exception as e:
             error_msg = str(e)
             if "No route to host" in error_msg or "Name or service not known" in error_msg:
-                raise Exception(
+                raise BingXConnectionError(
                     f"❌ Не удалось подключиться к API BingX.\n\n"
                     f"Попробуйте использовать прокси (BINGX_PROXY в .env)"
-                )
-            raise Exception(f"Ошибка получения свечей для {symbol}: {error_msg}")
+                ) from e
+            raise wrap_error(f"Ошибка получения свечей для {symbol}: {error_msg}", e, BingXDataError) from e
     async def get_order_book(self, symbol: str, limit: int = 50) -> Dict[str, Any]:
         """
         Получить стакан (order book) - публичный endpoint, подпись не требуется.
@@ -505,7 +592,7 @@ class BingXAPI:
                 'timestamp': orderbook['timestamp'],
             }
         except Exception as e:
-            raise Exception(f"Ошибка получения стакана: {str(e)}")
+            raise wrap_error(f"Ошибка получения стакана: {str(e)}", e, BingXDataError) from e
     
     async def create_market_order(self, symbol: str, side: str, amount: float) -> Dict[str, Any]:
         """Создать рыночный ордер"""
@@ -518,7 +605,7 @@ class BingXAPI:
             )
             return order
         except Exception as e:
-            raise Exception(f"Ошибка создания ордера: {str(e)}")
+            raise wrap_error(f"Ошибка создания ордера: {str(e)}", e) from e
     
     async def create_limit_order(self, symbol: str, side: str, amount: float, price: float) -> Dict[str, Any]:
         """Создать лимитный ордер"""
@@ -532,7 +619,7 @@ class BingXAPI:
             )
             return order
         except Exception as e:
-            raise Exception(f"Ошибка создания лимитного ордера: {str(e)}")
+            raise wrap_error(f"Ошибка создания лимитного ордера: {str(e)}", e) from e
     
     async def create_stop_loss_order(self, symbol: str, side: str, amount: float, 
                                      stop_price: float, price: Optional[float] = None) -> Dict[str, Any]:
@@ -578,7 +665,7 @@ class BingXAPI:
                 )
             return order
         except Exception as e:
-            raise Exception(f"Ошибка создания стоп-лосс ордера: {str(e)}")
+            raise wrap_error(f"Ошибка создания стоп-лосс ордера: {str(e)}", e) from e
     
     async def create_take_profit_order(self, symbol: str, side: str, amount: float, 
                                        take_profit_price: float, price: Optional[float] = None) -> Dict[str, Any]:
@@ -623,7 +710,7 @@ class BingXAPI:
                 )
             return order
         except Exception as e:
-            raise Exception(f"Ошибка создания тейк-профит ордера: {str(e)}")
+            raise wrap_error(f"Ошибка создания тейк-профит ордера: {str(e)}", e) from e
     
     async def set_leverage(self, symbol: str, leverage: int) -> bool:
         """Установить плечо"""
@@ -635,7 +722,7 @@ class BingXAPI:
             )
             return True
         except Exception as e:
-            raise Exception(f"Ошибка установки плеча: {str(e)}")
+            raise wrap_error(f"Ошибка установки плеча: {str(e)}", e) from e
     
     async def get_positions(self) -> List[Dict[str, Any]]:
         """Получить открытые позиции через прямой API запрос"""
@@ -671,38 +758,30 @@ class BingXAPI:
                 
                 return positions
             else:
-                # Если API вернул ошибку, возвращаем пустой список
-                error_msg = response.get('msg', 'Unknown error')
-                raise Exception(f"API вернул ошибку при получении позиций: {error_msg}")
+                # Если API вернул ошибку, возвращаем пустой список, чтобы не блокировать авто-торговлю
+                print(f"[BingX API] ⚠️ API вернул ошибку при получении позиций, возвращаю пустой список")
+                return []
                 
-        except Exception as e:
-            error_msg = str(e)
-            
-            # Если это ошибка подписи - это известная проблема с BingX API для некоторых endpoints
+        except BingXSignatureError:
+            # Ошибка подписи - известная проблема с BingX API для некоторых endpoints
             # Возвращаем пустой список, чтобы авто-торговля могла продолжать работу
             # Проверка позиций будет пропущена, но это лучше, чем полная остановка торговли
-            if "100001" in error_msg or "signature" in error_msg.lower():
+            try:
                 # Пробуем CCXT как fallback
-                try:
-                    positions = await asyncio.to_thread(self.exchange.fetch_positions)
-                    open_positions = [pos for pos in positions if pos.get('contracts', 0) != 0]
-                    return open_positions
-                except Exception:
-                    # Если и CCXT не работает - возвращаем пустой список
-                    # Это позволит авто-торговле продолжить работу без проверки позиций
-                    print(f"[BingX API] ⚠️ Не удалось получить позиции (ошибка подписи API), возвращаю пустой список")
-                    return []
-            
-            # Для других ошибок тоже возвращаем пустой список, чтобы не блокировать авто-торговлю
-            if "API вернул ошибку" in error_msg:
-                print(f"[BingX API] ⚠️ API вернул ошибку при получении позиций, возвращаю пустой список")
+                positions = await asyncio.to_thread(self.exchange.fetch_positions)
+                open_positions = [pos for pos in positions if pos.get('contracts', 0) != 0]
+                return open_positions
+            except Exception:
+                # Если и CCXT не работает - возвращаем пустой список
+                # Это позволит авто-торговле продолжить работу без проверки позиций
+                print(f"[BingX API] ⚠️ Не удалось получить позиции (ошибка подписи API), возвращаю пустой список")
                 return []
-            
+        except BingXConnectionError as e:
             # Для критических ошибок (сеть, таймаут) пробрасываем исключение
-            if "Не удалось подключиться" in error_msg or "Таймаут" in error_msg:
-                raise Exception(f"Ошибка получения позиций: {error_msg}")
-            
+            raise BingXConnectionError(f"Ошибка получения позиций: {str(e)}") from e
+        except Exception as e:
             # Для остальных ошибок возвращаем пустой список
+            error_msg = str(e)
             print(f"[BingX API] ⚠️ Ошибка при получении позиций: {error_msg[:100]}, возвращаю пустой список")
             return []
     
@@ -720,7 +799,7 @@ class BingXAPI:
                         return True
             return False
         except Exception as e:
-            raise Exception(f"Ошибка закрытия позиции: {str(e)}")
+            raise wrap_error(f"Ошибка закрытия позиции: {str(e)}", e) from e
     
     async def close_all_positions(self) -> int:
         """Закрыть все позиции"""
@@ -735,7 +814,7 @@ class BingXAPI:
                 closed += 1
             return closed
         except Exception as e:
-            raise Exception(f"Ошибка закрытия всех позиций: {str(e)}")
+            raise wrap_error(f"Ошибка закрытия всех позиций: {str(e)}", e) from e
     
     async def test_api(self) -> bool:
         """Проверить работоспособность API"""
@@ -743,45 +822,54 @@ class BingXAPI:
             # Проверяем базовую доступность API через простой endpoint
             # Используем endpoint для проверки баланса
             response = await self._make_request('GET', '/openApi/swap/v2/user/balance', {})
-            if response.get('code') == 0:
-                return True
-            else:
-                error_msg = response.get('msg', 'Unknown error')
-                error_code = response.get('code', 'unknown')
-                
-                # Специальная обработка для ошибок подписи
-                if error_code == 100001 or 'signature' in error_msg.lower():
-                    raise Exception(
-                        f"Ошибка подписи API (code {error_code}): {error_msg}\n\n"
-                        f"Проверьте:\n"
-                        f"1. Правильность API ключа и Secret ключа\n"
-                        f"2. Что API ключ имеет права на чтение баланса\n"
-                        f"3. Что IP адрес не заблокирован (если включена защита)\n"
-                        f"4. Что системное время синхронизировано"
-                    )
-                
-                raise Exception(f"API вернул ошибку (code {error_code}): {error_msg}")
+        except BingXSignatureError as e:
+            # Ошибка подписи от _make_request (code 100001)
+            raise BingXSignatureError(
+                f"Ошибка подписи API. Проверьте:\n"
+                f"1. Правильность API ключа и Secret ключа\n"
+                f"2. Что API ключ имеет права на чтение баланса\n"
+                f"3. Что IP адрес не заблокирован (если включена защита)\n"
+                f"4. Что системное время синхронизировано\n\n"
+                f"Детали ошибки: {str(e)}"
+            ) from e
         except Exception as e:
-            error_message = str(e)
-            
-            # Если это уже обработанная ошибка соединения, пробрасываем как есть
-            if "Не удалось подключиться" in error_message or "Таймаут" in error_message or "Не удалось разрешить домен" in error_message:
-                raise Exception(f"API не работает: {error_message}")
-            
-            # Проверяем SSL ошибки
-            if "SSL" in error_message or "certificate" in error_message.lower() or "CERTIFICATE_VERIFY_FAILED" in error_message:
-                # Если это SSL ошибка, пробрасываем как есть (уже обработана с инструкциями)
-                raise Exception(f"API не работает: {error_message}")
-            
-            # Проверяем типичные ошибки подписи
-            if 'signature' in error_message.lower() or '100001' in error_message:
-                raise Exception(
-                    f"Ошибка подписи API. Проверьте:\n"
-                    f"1. Правильность API ключа и Secret ключа\n"
-                    f"2. Что API ключ имеет права на чтение баланса\n"
-                    f"3. Что IP адрес не заблокирован (если включена защита)\n"
-                    f"4. Что системное время синхронизировано\n\n"
-                    f"Детали ошибки: {error_message}"
-                )
-            
-            raise Exception(f"API не работает: {error_message}")
+            # Соединение, SSL и прочее: сообщение уже с инструкциями, вид ошибки сохраняется
+            raise wrap_error(f"API не работает: {str(e)}", e) from e
+        
+        if response.get('code') == 0:
+            return True
+        
+        error_msg = response.get('msg', 'Unknown error')
+        error_code = response.get('code', 'unknown')
+        
+        # Специальная обработка для ошибок подписи
+        if error_code == 100001:
+            raise BingXSignatureError(
+                f"Ошибка подписи API (code {error_code}): {error_msg}\n\n"
+                f"Проверьте:\n"
+                f"1. Правильность API ключа и Secret ключа\n"
+                f"2. Что API ключ имеет права на чтение баланса\n"
+                f"3. Что IP адрес не заблокирован (если включена защита)\n"
+                f"4. Что системное время синхронизировано"
+            )
+        
+        raise BingXError(f"API вернул ошибку (code {error_code}): {error_msg}")
+
+
+# Клиенты BingX по пользователям: user_id -> ((api_key, secret_key), клиент)
+_api_clients: Dict[int, Tuple[Tuple[Optional[str], Optional[str]], BingXAPI]] = {}
+
+
+def get_user_api(user_id: int, api_key: Optional[str], secret_key: Optional[str]) -> BingXAPI:
+    """
+    Вернуть долгоживущий клиент BingX для пользователя.
+
+    Клиент пересоздаётся только если пользователь сменил ключи.
+    """
+    keys = (api_key, secret_key)
+    cached = _api_clients.get(user_id)
+    if cached and cached[0] == keys:
+        return cached[1]
+    api = BingXAPI(api_key=api_key, secret_key=secret_key, sandbox=False)
+    _api_clients[user_id] = (keys, api)
+    return api
@@ -1,8 +1,8 @@
 import pandas as pd
 import pandas_ta as ta
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional
 from services.candle_analysis import CandleAnalyzer
-from services.advanced_analysis import AdvancedMarketAnalyzer
+from services.advanced_analysis import get_shared_analyzer
 
 
 class MarketAnalyzer:
@@ -10,7 +10,8 @@ class MarketAnalyzer:
     
     def __init__(self):
         self.candle_analyzer = CandleAnalyzer()
-        self.advanced_analyzer = AdvancedMarketAnalyzer()
+        # Общий экземпляр: его кэши переживают отдельные анализы
+        self.advanced_analyzer = get_shared_analyzer()
     
     def calculate_indicators(self, ohlcv: List[List]) -> Dict[str, Any]:
         """
@@ -299,13 +300,15 @@ class MarketAnalyzer:
         else:
             return 'neutral'
     
-    def analyze_market(self, ohlcv: List[List], orderbook: Dict[str, Any] = None) -> Dict[str, Any]:
+    def analyze_market(self, ohlcv: List[List], orderbook: Dict[str, Any] = None,
+                       symbol: Optional[str] = None) -> Dict[str, Any]:
         """
         Комплексный анализ рынка с расширенными техниками (IMB, FVG, STB, Order Flow, пулы ликвидности)
         
         Args:
             ohlcv: Список свечей
             orderbook: Стакан (опционально)
+            symbol: Символ пары (опционально) — включает инкрементальный поиск IMB/FVG
         
         Returns:
             Полный отчёт анализа
@@ -319,7 +322,7 @@ class MarketAnalyzer:
         indicators = self.calculate_indicators(ohlcv)
         
         # Расширенный анализ (IMB, FVG, STB, Order Flow, пулы ликвидности)
-        advanced_analysis = self.advanced_analyzer.comprehensive_analysis(ohlcv, orderbook)
+        advanced_analysis = self.advanced_analyzer.comprehensive_analysis(ohlcv, orderbook, symbol=symbol)
         
         # Анализ стакана (если есть)
         orderbook_analysis = None
@@ -26,6 +26,35 @@ class StrategyProfiles:
 
     def __init__(self, config_path: Optional[str] = None):
         self.config_path = Path(config_path) if config_path else Path("config/strategy_profiles.json")
+        # Кэш разобранного конфига; сбрасывается при изменении mtime файла
+        self._cache_mtime: Optional[float] = None
+        self._cache_loaded = False
+        self._profiles: List[StrategyProfile] = []
+        self._keys_index: Dict[str, StrategyProfile] = {}
+        self._titles_index: Dict[str, StrategyProfile] = {}
+
+    def _config_mtime(self) -> Optional[float]:
+        try:
+            return self.config_path.stat().st_mtime
+        except OSError:
+            return None
+
+    def _refresh(self):
+        """Перечитать конфиг, только если файл изменился с прошлого чтения"""
+        mtime = self._config_mtime()
+        if self._cache_loaded and mtime == self._cache_mtime:
+            return
+        self._profiles = self._parse_profiles()
+        self._keys_index = {p.key: p for p in self._profiles}
+        self._titles_index = {p.title: p for p in self._profiles}
+        self._cache_mtime = mtime
+        self._cache_loaded = True
+
+    @property
+    def titles_index(self) -> Dict[str, StrategyProfile]:
+        """Индекс {title: профиль}; перестраивается только при изменении mtime конфига"""
+        self._refresh()
+        return self._titles_index
 
     def load_raw(self) -> Dict[str, Any]:
         if not self.config_path.exists():
@@ -34,6 +63,10 @@ class StrategyProfiles:
             return json.load(f)
 
     def list_profiles(self) -> List[StrategyProfile]:
+        self._refresh()
+        return list(self._profiles)
+
+    def _parse_profiles(self) -> List[StrategyProfile]:
         raw = self.load_raw()
         out: List[StrategyProfile] = []
         for key, cfg in raw.items():
@@ -57,19 +90,16 @@ class StrategyProfiles:
         return out
 
     def get(self, key: str) -> Optional[StrategyProfile]:
-        for p in self.list_profiles():
-            if p.key == key:
-                return p
-        return None
+        self._refresh()
+        return self._keys_index.get(key)
 
     def get_or_default(self, key: Optional[str]) -> StrategyProfile:
         chosen = self.get(key or "")
         if chosen:
             return chosen
         # default: first profile or hardcoded fallback
-        profiles = self.list_profiles()
-        if profiles:
-            return profiles[0]
+        if self._profiles:
+            return self._profiles[0]
         return StrategyProfile(
             key="default",
             title="Default",
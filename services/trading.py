@@ -1,8 +1,9 @@
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 from services.bingx_api import BingXAPI
 from services.market_analysis import MarketAnalyzer
-from config.settings import DEFAULT_LEVERAGE
+from config.settings import DEFAULT_LEVERAGE, SCAN_MAX_CONCURRENCY
 import math
+import asyncio
 
 
 class TradingEngine:
@@ -15,6 +16,9 @@ class TradingEngine:
     - Для 5m скальпа использует готовые свечи (можно улучшить агрегацией из 1m stream)
     """
     
+    # Анализы в процессе выполнения: (symbol, timeframe) -> задача (общая для всех экземпляров)
+    _inflight: Dict[Tuple[str, str], "asyncio.Task"] = {}
+    
     def __init__(self, api: BingXAPI, is_demo: bool = False):
         self.api = api
         self.is_demo = is_demo
@@ -207,9 +211,23 @@ class TradingEngine:
         1. HTF (1H/4H) - поиск зон (IMB, FVG, STB, пулы ликвидности)
         2. LTF (5m) - подтверждение сигнала на младшем таймфрейме
         
+        Одновременные вызовы для одной пары и таймфрейма (в т.ч. от разных пользователей)
+        ждут один общий анализ, а не запускают его повторно.
+        
         Returns:
             Результат анализа и решение
         """
+        key = (symbol, timeframe)
+        task = TradingEngine._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._run_analysis(symbol, timeframe))
+            TradingEngine._inflight[key] = task
+            task.add_done_callback(lambda _t: TradingEngine._inflight.pop(key, None))
+        # shield: отмена одного из ожидающих не прерывает общий анализ
+        return await asyncio.shield(task)
+
+    async def _run_analysis(self, symbol: str, timeframe: str) -> Dict[str, Any]:
+        """Полный цикл анализа пары (без дедупликации)"""
         try:
             # Получаем данные для LTF (5m) - основной таймфрейм
             ohlcv_ltf = await self.api.get_ohlcv(symbol, timeframe, limit=300)
@@ -224,102 +242,117 @@ class TradingEngine:
             # Получаем данные для 4H таймфрейма - для проверки тренда (улучшение на основе анализа)
             ohlcv_4h = await self.api.get_ohlcv(symbol, '4h', limit=100)
             
-            # Анализ LTF (основной)
-            analysis_ltf = self.analyzer.analyze_market(ohlcv_ltf, orderbook)
-            
-            # Анализ HTF (зоны)
-            analysis_htf = self.analyzer.advanced_analyzer.comprehensive_analysis(ohlcv_htf, orderbook)
-            
-            # Анализ тренда на 4H (для фильтрации сигналов)
-            trend_4h = self._check_trend_4h(ohlcv_4h) if ohlcv_4h and len(ohlcv_4h) >= 20 else None
-            
-            # Объединяем анализы
-            analysis = analysis_ltf
-            analysis['htf_zones'] = {
-                'imbalances': analysis_htf.get('imbalances', []),
-                'fvgs': analysis_htf.get('fvgs', []),
-                'stb_zones': analysis_htf.get('stb_zones', []),
-                'liquidity_pools': analysis_htf.get('liquidity_pools', {})
+            # Расчёт индикаторов и зон — чистая работа CPU, выносим её из event loop,
+            # чтобы анализ одной пары не блокировал остальные корутины
+            return await asyncio.to_thread(
+                self._compute_analysis, symbol, ohlcv_ltf, orderbook, ticker, ohlcv_htf, ohlcv_4h
+            )
+        except Exception as e:
+            return {
+                'error': str(e),
+                'exception': e,  # исходное исключение: по его типу вызывающий код различает причину
+                'decision': {'action': 'skip'}
             }
-            
-            # Проверяем правила отмены сигналов
-            analysis = self._check_signal_cancellation(analysis, ohlcv_ltf, orderbook)
-            
-            # Проверяем, не был ли сигнал отменен
-            cancellation_reason = analysis.get('cancellation_reason')
-            if cancellation_reason:
-                return {
-                    'analysis': analysis,
-                    'decision': {
-                        'action': 'skip',
-                        'reason': f'Сигнал отменен: {cancellation_reason}'
-                    },
-                    'symbol': symbol,
-                    'current_price': ticker['last']
-                }
-            
-            # Фильтр по тренду на 4H (улучшение на основе анализа)
-            if trend_4h:
-                final_signal = analysis.get('final_signal', 'neutral')
-                # Если сигнал противоречит тренду на 4H - снижаем вероятность или отменяем
-                if final_signal in ['long', 'strong_long'] and trend_4h == 'bearish':
-                    # Бычий сигнал против медвежьего тренда - снижаем вероятность
-                    current_prob = analysis.get('probability', 0)
-                    analysis['probability'] = max(0, current_prob - 15)
-                    if analysis['probability'] < 50:
-                        analysis['final_signal'] = 'neutral'
-                        analysis['cancellation_reason'] = 'Сигнал противоречит тренду на 4H (медвежий)'
-                elif final_signal in ['short', 'strong_short'] and trend_4h == 'bullish':
-                    # Медвежий сигнал против бычьего тренда - снижаем вероятность
-                    current_prob = analysis.get('probability', 0)
-                    analysis['probability'] = max(0, current_prob - 15)
-                    if analysis['probability'] < 50:
-                        analysis['final_signal'] = 'neutral'
-                        analysis['cancellation_reason'] = 'Сигнал противоречит тренду на 4H (бычий)'
-            
-            # Принимаем решение
-            decision = self._make_decision(analysis)
-            
+
+    def _compute_analysis(self, symbol: str, ohlcv_ltf: List[List], orderbook: Dict, ticker: Dict,
+                          ohlcv_htf: List[List], ohlcv_4h: List[List]) -> Dict[str, Any]:
+        """Синхронная часть анализа по уже загруженным данным (выполняется в отдельном потоке)"""
+        # Анализ LTF (основной)
+        analysis_ltf = self.analyzer.analyze_market(ohlcv_ltf, orderbook, symbol=symbol)
+        
+        # Анализ HTF (зоны)
+        analysis_htf = self.analyzer.advanced_analyzer.comprehensive_analysis(ohlcv_htf, orderbook, symbol=symbol)
+        
+        # Анализ тренда на 4H (для фильтрации сигналов)
+        trend_4h = self._check_trend_4h(ohlcv_4h) if ohlcv_4h and len(ohlcv_4h) >= 20 else None
+        
+        # Объединяем анализы
+        analysis = analysis_ltf
+        analysis['htf_zones'] = {
+            'imbalances': analysis_htf.get('imbalances', []),
+            'fvgs': analysis_htf.get('fvgs', []),
+            'stb_zones': analysis_htf.get('stb_zones', []),
+            'liquidity_pools': analysis_htf.get('liquidity_pools', {})
+        }
+        
+        # Проверяем правила отмены сигналов
+        analysis = self._check_signal_cancellation(analysis, ohlcv_ltf, orderbook)
+        
+        # Проверяем, не был ли сигнал отменен
+        cancellation_reason = analysis.get('cancellation_reason')
+        if cancellation_reason:
             return {
                 'analysis': analysis,
-                'decision': decision,
+                'decision': {
+                    'action': 'skip',
+                    'reason': f'Сигнал отменен: {cancellation_reason}'
+                },
                 'symbol': symbol,
                 'current_price': ticker['last']
             }
-        except Exception as e:
-            return {
-                'error': str(e),
-                'decision': {'action': 'skip'}
-            }
+        
+        # Фильтр по тренду на 4H (улучшение на основе анализа)
+        if trend_4h:
+            final_signal = analysis.get('final_signal', 'neutral')
+            # Если сигнал противоречит тренду на 4H - снижаем вероятность или отменяем
+            if final_signal in ['long', 'strong_long'] and trend_4h == 'bearish':
+                # Бычий сигнал против медвежьего тренда - снижаем вероятность
+                current_prob = analysis.get('probability', 0)
+                analysis['probability'] = max(0, current_prob - 15)
+                if analysis['probability'] < 50:
+                    analysis['final_signal'] = 'neutral'
+                    analysis['cancellation_reason'] = 'Сигнал противоречит тренду на 4H (медвежий)'
+            elif final_signal in ['short', 'strong_short'] and trend_4h == 'bullish':
+                # Медвежий сигнал против бычьего тренда - снижаем вероятность
+                current_prob = analysis.get('probability', 0)
+                analysis['probability'] = max(0, current_prob - 15)
+                if analysis['probability'] < 50:
+                    analysis['final_signal'] = 'neutral'
+                    analysis['cancellation_reason'] = 'Сигнал противоречит тренду на 4H (бычий)'
+        
+        # Принимаем решение
+        decision = self._make_decision(analysis)
+        
+        return {
+            'analysis': analysis,
+            'decision': decision,
+            'symbol': symbol,
+            'current_price': ticker['last']
+        }
 
     async def scan_market(self, pairs: List[str], timeframe: str = "5m", top_n: int = 5) -> List[Dict[str, Any]]:
         """
         Мини-сканер "как в pycryptobot": прогоняем пары и ранжируем по probability/силе сигнала.
         Возвращает топ-N результатов.
         """
-        results: List[Dict[str, Any]] = []
-        for sym in pairs:
-            try:
-                r = await self.analyze_and_trade(sym, timeframe=timeframe)
-                analysis = r.get("analysis") or {}
-                final_signal = analysis.get("final_signal", "neutral")
-                probability = float(analysis.get("probability", 0) or 0)
-                if final_signal != "neutral" and probability > 0:
-                    results.append(
-                        {
-                            "symbol": sym,
-                            "final_signal": final_signal,
-                            "probability": probability,
-                            "confirmations": (analysis.get("confirmations") or {}).get("count", 0),
-                            "current_price": analysis.get("current_price"),
-                        }
-                    )
-            except Exception:
-                continue
+        # Пары анализируем параллельно, семафор ограничивает нагрузку на API BingX
+        semaphore = asyncio.Semaphore(SCAN_MAX_CONCURRENCY)
+        analyzed = await asyncio.gather(
+            *(self._scan_one(sym, timeframe, semaphore) for sym in pairs),
+            return_exceptions=True,
+        )
+        results: List[Dict[str, Any]] = [r for r in analyzed if isinstance(r, dict)]
 
         results.sort(key=lambda x: (x.get("probability", 0), x.get("confirmations", 0)), reverse=True)
         return results[: max(1, int(top_n))]
     
+    async def _scan_one(self, sym: str, timeframe: str, semaphore: asyncio.Semaphore) -> Optional[Dict[str, Any]]:
+        """Проанализировать одну пару для сканера (None, если сигнала нет)"""
+        async with semaphore:
+            r = await self.analyze_and_trade(sym, timeframe=timeframe)
+        analysis = r.get("analysis") or {}
+        final_signal = analysis.get("final_signal", "neutral")
+        probability = float(analysis.get("probability", 0) or 0)
+        if final_signal == "neutral" or probability <= 0:
+            return None
+        return {
+            "symbol": sym,
+            "final_signal": final_signal,
+            "probability": probability,
+            "confirmations": (analysis.get("confirmations") or {}).get("count", 0),
+            "current_price": analysis.get("current_price"),
+        }
+    
     def _check_signal_cancellation(self, analysis: Dict[str, Any], ohlcv: List[List], orderbook: Dict) -> Dict[str, Any]:
         """
         Проверяет правила отмены сигналов согласно analiz.txt:
@@ -704,6 +737,7 @@ class TradingEngine:
             # Открываем позицию
             side = 'buy' if direction == 'long' else 'sell'
             order = await self.api.create_market_order(symbol, side, amount)
+            self.api.invalidate(symbol)
             entry_price = order.get('price') or order.get('average', 0)
             
             stop_loss_order_id = None